@@ -0,0 +1,95 @@
+import numpy as np
+
+
+# optimize the altitude profile along a path: the profile is piecewise linear,
+# may deviate by at most max_dev from the grid altitudes at every node of the
+# path, starts and ends max_dev below the grid altitude and breaks only at path
+# nodes with a deviation of exactly -max_dev or +max_dev; returns the array of
+# deviations of the shortest (in 3D) such profile for all nodes
+#
+# grid_alts are the grid altitudes of the n path nodes and dists the n - 1
+# (horizontal) distances between consecutive nodes
+def optimize_profile(grid_alts, dists, max_dev=10., chunk=64):
+    grid_alts = np.asarray(grid_alts, np.float64)
+    dists     = np.asarray(dists, np.float64)
+    n         = len(grid_alts)
+    devs      = (-max_dev, max_dev)
+    if n < 2:
+        return np.full(n, devs[0])
+
+    # shortest profile to every (node, deviation) and its predecessor; all
+    # segments point forward, thus the nodes can be relaxed in index order
+    costs = np.full((n, 2), np.inf)
+    preds = np.full((n, 2, 2), -1, np.intp)
+    costs[0, 0] = 0.
+    for idx1 in range(n - 1):
+        for dev_idx1, dev1 in enumerate(devs):
+            if costs[idx1, dev_idx1] == np.inf:
+                continue
+            _relax_segments(
+                grid_alts, dists, max_dev, chunk, costs, preds, idx1, dev_idx1
+            )
+
+    # trace back the breakpoints of the profile and interpolate the deviations
+    # of the intermediate nodes along each straight segment
+    alt_devs = np.empty(n)
+    idx2, dev_idx2 = n - 1, 0
+    alt_devs[idx2] = devs[dev_idx2]
+    while idx2 > 0:
+        idx1, dev_idx1 = preds[idx2, dev_idx2]
+        start_alt  = grid_alts[idx1] + devs[dev_idx1]
+        end_alt    = grid_alts[idx2] + devs[dev_idx2]
+        cum_dists  = np.cumsum(np.concatenate(([0.], dists[idx1:idx2])))
+        avg_slope  = (end_alt - start_alt) / cum_dists[-1]
+        target_dev = start_alt + cum_dists[:-1] * avg_slope - grid_alts[idx1:idx2]
+        # the slope cone is checked with divisions instead of the deviations
+        # themselves, clip what lies beyond the limits by rounding only
+        alt_devs[idx1:idx2] = np.clip(target_dev, -max_dev, max_dev)
+        idx2, dev_idx2 = idx1, dev_idx1
+    return alt_devs
+
+
+# relax all straight segments starting at node idx1 with the deviation at index
+# dev_idx1; the cone of feasible slopes (keeping all intermediate nodes within
+# max_dev) is narrowed chunk by chunk until it is empty
+def _relax_segments(grid_alts, dists, max_dev, chunk, costs, preds, idx1, dev_idx1):
+    n         = len(grid_alts)
+    start_alt = grid_alts[idx1] + (max_dev if dev_idx1 else -max_dev)
+    cone      = (-np.inf, np.inf)
+    cum_dist  = 0.
+    pos       = idx1 + 1
+    while pos < n:
+        end = min(pos + chunk, n)
+        # distance from idx1 to the end nodes pos .. end - 1 (summed in order)
+        cum_dists = np.cumsum(np.concatenate(([cum_dist], dists[pos-1:end-1])))[1:]
+        alts      = grid_alts[pos:end]
+
+        # slope cone of the intermediate nodes before each end node
+        cone_lo = np.maximum.accumulate(np.concatenate((
+            [cone[0]], (alts - max_dev - start_alt) / cum_dists
+        )))
+        cone_hi = np.minimum.accumulate(np.concatenate((
+            [cone[1]], (alts + max_dev - start_alt) / cum_dists
+        )))
+        num_open = np.argmin(np.append(cone_lo[:-1] <= cone_hi[:-1], False))
+
+        for dev_idx2, dev2 in enumerate([-max_dev, max_dev]):
+            end_alts = alts[:num_open] + dev2
+            slopes   = (end_alts - start_alt) / cum_dists[:num_open]
+            feasible = np.flatnonzero(
+                (cone_lo[:num_open] <= slopes) & (slopes <= cone_hi[:num_open])
+            )
+            new_costs = costs[idx1, dev_idx1] + np.sqrt(
+                cum_dists[feasible]**2 + (start_alt - end_alts[feasible])**2
+            )
+            idx2s  = pos + feasible
+            better = new_costs < costs[idx2s, dev_idx2]
+            costs[idx2s[better], dev_idx2] = new_costs[better]
+            preds[idx2s[better], dev_idx2] = (idx1, dev_idx1)
+
+        if num_open < end - pos:
+            break
+        cone     = (cone_lo[-1], cone_hi[-1])
+        cum_dist = cum_dists[-1]
+        pos      = end
+        chunk   *= 2
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import argparse
+import platform
+import tracemalloc
+import logging
+import json
+import math
+import time
+import sys
+
+parser = argparse.ArgumentParser(description='Run the performance benchmarks.')
+parser.add_argument('-n', '--sizes', metavar='SIZES', default='1000',
+                    help='comma-separated edge lengths of the synthetic grids '
+                         '(default 1000)')
+parser.add_argument('--seed', metavar='SEED', type=int, default=1,
+                    help='seed of the synthetic terrain and features '
+                         '(default 1)')
+parser.add_argument('-b', '--bench', metavar='BENCHMARKS', default=None,
+                    help='comma-separated names of the benchmarks to run '
+                         '(default all)')
+parser.add_argument('--repeat', metavar='REPEAT', type=int, default=3,
+                    help='number of timed runs per benchmark, the minimum is '
+                         'reported (default 3)')
+parser.add_argument('--graph-size', metavar='GRAPH_SIZE', type=int,
+                    default=300,
+                    help='edge length of the grid used for init_graph, which '
+                         'builds a networkx graph (default 300)')
+parser.add_argument('-c', '--tile-cache', metavar='TILE_CACHE.sqlite',
+                    default=None,
+                    help='basemap vector tiles recorded by gen_grid.py '
+                         '--tile-cache, used in offline mode for the '
+                         'query_shapes benchmark (skipped if not given)')
+parser.add_argument('-o', '--output', metavar='RESULTS.json', default=None,
+                    help='write the results to this file')
+parser.add_argument('--baseline', metavar='BASELINE.json', default=None,
+                    help='compare the results against a stored baseline and '
+                         'exit with status 1 on regressions; a baseline is '
+                         'written by --output on the same machine from the '
+                         'reference checkout (see make benchmark-baseline)')
+parser.add_argument('--time-threshold', metavar='RATIO', type=float,
+                    default=0.25,
+                    help='allowed relative increase of the run time w.r.t. '
+                         'the baseline (default 0.25)')
+parser.add_argument('--memory-threshold', metavar='RATIO', type=float,
+                    default=0.25,
+                    help='allowed relative increase of the peak memory w.r.t. '
+                         'the baseline (default 0.25)')
+args = parser.parse_args()
+
+import numpy as np
+from scipy.ndimage import zoom
+
+from geogrid import GeoGrid
+
+BASEMAP_INDEX = 'https://maps.wien.gv.at/basemapv/bmapv/3857/'
+BASEMAP_LEVEL = 11
+BASEMAP_LAYERS = [
+    r'GRENZEN/.*STAATSGRENZE.*',
+    r'STRASSENNETZ/.*Autobahn.*',
+    r'NUTZUNG/.*Siedlung.*'
+]
+
+GRID_ORIG  = (1060000., 6280000.)
+GRID_SCALE = 100. / math.cos(47.5 * math.pi / 180.)
+SLOPE_FACTOR = 0.1 / (0.05**2) / 100.**2
+
+
+###############################################################################
+# synthetic terrain
+
+# fractal terrain (sum of octaves of bilinearly upsampled value noise with the
+# amplitude halved per octave) scaled to altitudes between min_alt and max_alt
+def synthetic_dem(size, seed, min_alt=200., max_alt=3000., octaves=8):
+    rng  = np.random.default_rng(seed)
+    vals = np.zeros((size, size), np.float32)
+    for octave in range(octaves):
+        cells = min(size, 2 << octave)
+        noise = rng.random((cells + 1, cells + 1), dtype=np.float32)
+        layer = zoom(noise, size / (cells + 1), order=1, grid_mode=True,
+                     mode='nearest')[:size, :size]
+        vals += layer * 0.5**octave
+    vals -= vals.min()
+    vals *= (max_alt - min_alt) / max(float(vals.max()), 1e-6)
+    vals += min_alt
+    return vals
+
+
+# random exclusion polygons (star-shaped), lines and points in map coordinates
+def synthetic_features(size, seed, num_polygons=20, num_lines=10,
+                       num_points=20):
+    rng    = np.random.default_rng(seed + 1)
+    extent = size * GRID_SCALE
+    def random_coords(num):
+        return np.stack((
+            GRID_ORIG[0] + rng.uniform(0., extent, num),
+            GRID_ORIG[1] - rng.uniform(0., extent, num)
+        ), axis=-1)
+
+    polygons = []
+    for center in random_coords(num_polygons):
+        angles = np.sort(rng.uniform(0., 2. * math.pi, 12))
+        radii  = rng.uniform(0.005, 0.02) * extent * rng.uniform(0.5, 1., 12)
+        polygons.append(center + np.stack(
+            (np.cos(angles) * radii, np.sin(angles) * radii), axis=-1
+        ))
+    lines = [
+        start + np.cumsum(rng.normal(0., 0.02 * extent, (10, 2)), axis=0)
+        for start in random_coords(num_lines)
+    ]
+    return polygons, lines, random_coords(num_points)
+
+
+###############################################################################
+# benchmarks
+
+# each benchmark is a function (size, seed) returning a tuple (run, info) of
+# a function without arguments performing the measured work and a dict of
+# additional information; the setup is not measured
+
+def bench_smooth_node_values(size, seed):
+    vals = synthetic_dem(size, seed)
+    def run():
+        grid = GeoGrid(vals.shape, GRID_SCALE, GRID_ORIG, vals.copy())
+        grid.smooth_node_values(0.1, 10.)
+    return run, {}
+
+
+def bench_init_graph(size, seed):
+    size = min(size, args.graph_size)
+    vals = synthetic_dem(size, seed)
+    def run():
+        grid = GeoGrid(vals.shape, GRID_SCALE, GRID_ORIG, vals.copy())
+        grid.init_graph()
+    return run, {'cells': size * size}
+
+
+def bench_rm_polygon(size, seed):
+    vals = synthetic_dem(size, seed)
+    polygons, _, _ = synthetic_features(size, seed)
+    def run():
+        grid = GeoGrid(vals.shape, GRID_SCALE, GRID_ORIG, vals.copy())
+        for coords in polygons:
+            grid.rm_polygon(coords, 120.)
+    return run, {'polygons': len(polygons)}
+
+
+def bench_rm_line(size, seed):
+    vals = synthetic_dem(size, seed)
+    _, lines, _ = synthetic_features(size, seed)
+    def run():
+        grid = GeoGrid(vals.shape, GRID_SCALE, GRID_ORIG, vals.copy())
+        for coords in lines:
+            grid.rm_line(coords, 150.)
+    return run, {'lines': len(lines)}
+
+
+def bench_rm_points(size, seed):
+    vals = synthetic_dem(size, seed)
+    _, _, points = synthetic_features(size, seed)
+    def run():
+        grid = GeoGrid(vals.shape, GRID_SCALE, GRID_ORIG, vals.copy())
+        grid.rm_points(points, 500.)
+    return run, {'points': len(points)}
+
+
+# grid with exclusion areas and the corners (inset by 5%) as start and goal;
+# like grids sampled from a DEM, the border nodes are invalid (find_path does
+# not check the grid bounds)
+def _path_grid(size, seed):
+    grid = GeoGrid((size, size), GRID_SCALE, GRID_ORIG, synthetic_dem(size, seed))
+    grid.vals[:2, :] = grid.vals[-2:, :] = -1.
+    grid.vals[:, :2] = grid.vals[:, -2:] = -1.
+    polygons, lines, _ = synthetic_features(size, seed)
+    for coords in polygons:
+        grid.rm_polygon(coords)
+    for coords in lines:
+        grid.rm_line(coords, 150.)
+    inset = size // 20
+    start, goal = (inset, inset), (size - 1 - inset, size - 1 - inset)
+    grid.vals[start], grid.vals[goal] = 1000., 1000.
+    return grid, start, goal
+
+
+def bench_find_path(size, seed):
+    grid, start, goal = _path_grid(size, seed)
+    def run():
+        path = grid.find_path(start, goal, SLOPE_FACTOR)
+        assert len(path) > 0, "no path found"
+    return run, {}
+
+
+# the post-processing of find_path.py (altitude profile and simplification)
+def bench_postprocess(size, seed):
+    from altprofile import optimize_profile
+    from pathsimplify import simplify_path
+
+    grid, start, goal = _path_grid(size, seed)
+    path = grid.find_path(start, goal, SLOPE_FACTOR)
+    assert len(path) > 0, "no path found"
+    def run():
+        grid_alts = [grid.get_node_value((x, y)) for x, y, _ in path]
+        dists     = [
+            math.sqrt((x1 - x2)**2 + (y1 - y2)**2) * 100.
+            for (x1, y1, _), (x2, y2, _) in zip(path, path[1:])
+        ]
+        alt_devs = optimize_profile(grid_alts, dists, 10.)
+        simplify_path(grid, [
+            (x, y, float(alt)) for (x, y, _), alt in zip(path, alt_devs)
+        ], 100., 10.)
+    return run, {'path_nodes': len(path)}
+
+
+# query_shapes on recorded tiles (independent of the grid size)
+def bench_query_shapes(size, seed):
+    if args.tile_cache is None:
+        return None, {}
+    import tilemap
+    from tilecache import TileCache
+
+    tmap = tilemap.VectorTileMap(
+        BASEMAP_INDEX, cache=TileCache(args.tile_cache), offline=True
+    )
+    filters = tmap.get_style_filters(BASEMAP_LAYERS, BASEMAP_LEVEL)
+    def run():
+        for _ in tmap.query_shapes(BASEMAP_LEVEL, filters, merge_key='$id'):
+            pass
+    return run, {}
+
+
+BENCHMARKS = {
+    'smooth_node_values': bench_smooth_node_values,
+    'init_graph':         bench_init_graph,
+    'rm_polygon':         bench_rm_polygon,
+    'rm_line':            bench_rm_line,
+    'rm_points':          bench_rm_points,
+    'find_path':          bench_find_path,
+    'postprocess':        bench_postprocess,
+    'query_shapes':       bench_query_shapes,
+}
+
+
+###############################################################################
+# run benchmarks
+
+logging.basicConfig(level=logging.WARNING)
+
+sizes = [int(size) for size in args.sizes.split(',')]
+names = list(BENCHMARKS) if args.bench is None else args.bench.split(',')
+for name in names:
+    assert name in BENCHMARKS, f"unknown benchmark {name}"
+
+results, skipped = {}, []
+for size in sizes:
+    for name in names:
+        key = f"{name}@{size}"
+        run, info = BENCHMARKS[name](size, args.seed)
+        if run is None:
+            print(f"{key:28} skipped")
+            skipped.append(key)
+            continue
+        # the run time is measured without tracing, the peak memory (of the
+        # Python and NumPy allocations of this process) in a separate run
+        times = []
+        for _ in range(args.repeat):
+            t_start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t_start)
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[key] = {'time': min(times), 'peak': peak, **info}
+        print(f"{key:28} {min(times):10.4f} s {peak / 2**20:10.1f} MiB")
+
+output = {
+    'meta': {
+        'seed':     args.seed,
+        'sizes':    sizes,
+        'repeat':   args.repeat,
+        'python':   platform.python_version(),
+        'numpy':    np.__version__,
+        'platform': platform.platform(),
+    },
+    'results': results
+}
+if args.output is not None:
+    with open(args.output, 'w') as dst:
+        json.dump(output, dst, indent=2)
+
+
+###############################################################################
+# compare with baseline
+
+if args.baseline is not None:
+    with open(args.baseline) as src:
+        baseline = json.load(src)['results']
+
+    print("Comparing with baseline ...")
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"  {key:28} no baseline")
+            continue
+        for metric, threshold in [
+            ('time', args.time_threshold), ('peak', args.memory_threshold)
+        ]:
+            ratio = result[metric] / max(baseline[key][metric], 1e-9)
+            status = 'ok'
+            if ratio > 1. + threshold:
+                status = 'REGRESSION'
+                regressions.append((key, metric))
+            print(f"  {key:28} {metric:5} {ratio:7.2f}x  {status}")
+    # skipped benchmarks (e.g., query_shapes without --tile-cache) are not
+    # compared, which must not be mistaken for the absence of regressions
+    for key in skipped:
+        print(f"  {key:28} skipped, not compared")
+
+    if len(regressions) > 0:
+        print(f"{len(regressions)} regressions")
+        sys.exit(1)
@@ -14,6 +14,16 @@ parser.add_argument('-s', '--slope_factor', metavar='SLOPE_FACTOR',
 parser.add_argument('-e', '--epsilon', metavar='EPSILON',
                     type=float, default=None,
                     help='epsilon for RDP path reduction (default equal to r)')
+parser.add_argument('-n', '--num_points', metavar='NUM_POINTS',
+                    type=int, default=None,
+                    help='simplify the path to a fixed number of points '
+                         '(Visvalingam-Whyatt) instead of using RDP')
+parser.add_argument('-t', '--tiles', metavar='TILE_DIR', default=None,
+                    help='additionally export the map as z/x/y PNG tile '
+                         'pyramid (EPSG 3857) to this directory')
+parser.add_argument('--stats', action='store_true',
+                    help='print search statistics and write a heatmap of the '
+                         'expanded nodes')
 parser.add_argument('grid', metavar="GRID_FILE.npy",
                     help='grid file')
 parser.add_argument('start', metavar="START", help='start node coordinate')
@@ -69,9 +79,13 @@ print(f"  grid start: {grid_start}, grid goal: {grid_goal}")
 
 slope_factor = args.slope_factor / args.resolution**2
 
+from geogrid import SearchStats
+
+stats = SearchStats(record_expanded=True) if args.stats else None
+
 t_start = time.time()
 try:
-    path = grid.find_path(grid_start, grid_goal, slope_factor)
+    path = grid.find_path(grid_start, grid_goal, slope_factor, stats=stats)
 except Exception as e:
     print(str(e))
     path = []
@@ -79,11 +93,24 @@ t_end = time.time()
 
 print(f"found a path with {len(path)} points in {t_end - t_start:.2f} seconds")
 
+if stats is not None:
+    for name, val in stats.as_dict().items():
+        print(f"  {name + ':':17} {val}")
+
+    from geodraw import GeoDraw
+
+    heatmap = GeoDraw(grid.size)
+    heatmap.fill_heatmap(stats.expanded_order, stats.expanded_order >= 0)
+    heatmap.fill_color(path, (0, 0, 0))
+    heatmap.save(file_base + '_expanded.png')
+
 
 ###############################################################################
 # try to straighten the altitude as much as possible
 
-print("Generating graph for altitude profile optimization ...")
+print("Optimizing altitude profile ...")
+
+from altprofile import optimize_profile
 
 # get grid altitudes and calculate distance between every two nodes
 path_grid_alt = [grid.get_node_value((x, y)) for x, y, _ in path]
@@ -92,95 +119,23 @@ path_dists    = [
     for (x1, y1, _), (x2, y2, _) in zip(path, path[1:])
 ]
 
-def alt_path_straight(grid_alts, dists, start_dev, end_dev):
-    start_alt, end_alt = grid_alts[0] + start_dev, grid_alts[-1] + end_dev
-    total_dist = sum(dists)
-    avg_slope  = (end_alt - start_alt) / total_dist
-    cum_dist   = 0.
-    for grid_alt, dist in zip(grid_alts[1:-1], dists):
-        cum_dist  += dist
-        target_dev = start_alt + cum_dist * avg_slope - grid_alt
-        if target_dev > 10. or target_dev < -10.:
-            return False
-    return True
-
-import networkx as nx
-
-alt_graph = nx.Graph()
-for idx1 in range(len(path) - 1):
-    for idx2 in range(idx1 + 1, len(path)):
-        grid_alts = path_grid_alt[idx1:idx2+1]
-        dists     = path_dists   [idx1:idx2  ]
-        for dev1, dev2 in [(-10, -10), (10, -10), (-10, 10), (10, 10)]:
-            if alt_path_straight(grid_alts, dists, dev1, dev2):
-                alt_diff = (grid_alts[0] + dev1) - (grid_alts[-1] + dev2)
-                wgt      = math.sqrt(sum(dists)**2 + alt_diff**2)
-                alt_graph.add_edge((idx1, dev1), (idx2, dev2), weight=wgt)
-
-print("  optimizing altitude profile")
-
-alt_path_heuristic = lambda n1, n2: sum(path_dists[n1[0]:n2[0]])
-
-alt_path = nx.astar_path(
-    alt_graph, (0, -10), (len(path)-1, -10), alt_path_heuristic
-)
-
-alt_devs = []
-for (idx1, dev1), (idx2, dev2) in zip(alt_path, alt_path[1:]):
-    start_alt, end_alt = path_grid_alt[idx1] + dev1, path_grid_alt[idx2] + dev2
-    total_dist = sum(path_dists[idx1:idx2])
-    avg_slope  = (end_alt - start_alt) / total_dist
-    cum_dist   = 0.
-    for grid_alt, dist in zip(path_grid_alt[idx1:idx2], path_dists[idx1:idx2]):
-        target_dev = start_alt + cum_dist * avg_slope - grid_alt
-        assert -10. <= target_dev <= 10.
-        alt_devs.append(target_dev)
-        cum_dist += dist
+alt_devs = optimize_profile(path_grid_alt, path_dists, 10.)
 
-path = [(x, y, alt) for (x, y, _), alt in zip(path, alt_devs)]
+path = [(x, y, float(alt)) for (x, y, _), alt in zip(path, alt_devs)]
 
 
 
 ###############################################################################
-# simplify path using the Ramer-Douglas-Peucker algorithm
-
-def rdp(path, epsilon, z_scale):
-    # extract the coordinates (including height) of start and end node
-    start, end = path[0], path[-1]
-    x1, y1, z1 = start[0], start[1], grid.get_node_value(start) + start[2]
-    x2, y2, z2 = end  [0], end  [1], grid.get_node_value(end  ) + end  [2]
-    # scale the z values (required to lower the threshold for height deviation)
-    z1 *= z_scale
-    z2 *= z_scale
-    # calculate the distance from start to end node
-    line_len = math.sqrt((x1 - x2)**2 + (y1 - y2)**2 + (z1 - z2)**2)
-    assert line_len > 0.
-    # get the height of each intermediate point
-    alt = [
-        (grid.get_node_value((x, y)) + z) * z_scale for x, y, z in path[1:-1]
-    ]
-    # calculate the distance between all intermediate points and the line from
-    # start to end node
-    dists = [math.sqrt(
-        ((y2 - y1) * (z1 - z) - (y1 - y) * (z2 - z2))**2 +
-        ((z2 - z1) * (x1 - x) - (z1 - z) * (x2 - x2))**2 +
-        ((x2 - x1) * (y1 - y) - (x1 - x) * (y2 - y2))**2
-    ) / line_len for (x, y, _), z in zip(path[1:-1], alt)]
-    # get maximum distance
-    maxdist = max(dists)
-    maxidx  = dists.index(maxdist)
-    if maxdist > epsilon:
-        # divide and conquer
-        res1 = rdp(path[:maxidx+1], epsilon, z_scale)
-        res2 = rdp(path[ maxidx: ], epsilon, z_scale)
-        return res1[:-1] + res2
-    return [start, end]
+# simplify path using the Ramer-Douglas-Peucker (or Visvalingam-Whyatt)
+# algorithm
+
+from pathsimplify import simplify_path
 
 # simplify the path; note that the altitude (z values) need to be exaggerated
 # in order to lower threshold for intermediate points when the height deviates
 epsilon = args.epsilon if args.epsilon is not None else args.resolution
 z_scale = epsilon / 10.
-path    = rdp(path, epsilon, z_scale)
+path    = simplify_path(grid, path, epsilon, z_scale, args.num_points)
 
 print(f"simplified the path to {len(path)} points")
 
@@ -222,11 +177,8 @@ from geodraw import GeoDraw
 
 print("Generating output image ...")
 draw = GeoDraw(grid.size)
-draw.fill_palette(
-    (coord, val / 4500.) for coord, val in (
-        ((x, y), grid.get_node_value((x, y))) for x in range(grid.size[0])
-                                              for y in range(grid.size[1])
-    ) if 0. <= val <= 4500.
+draw.fill_array(
+    grid.vals, (grid.vals >= 0.) & (grid.vals <= 4500.), 1. / 4500.
 )
 #draw.fill_palette(
 #    ((100 + x, 100 + y), x / 1000.) for x in range(1000) for y in range(100)
@@ -235,6 +187,13 @@ draw.fill_color(path, (255, 0, 0))
 draw.fill_color([grid_start, grid_goal], (0, 0, 255))
 draw.save(file_base + '_path.png')
 
+if args.tiles is not None:
+    from tileexport import TilePyramid
+
+    print("Exporting map tiles ...")
+    num_tiles = TilePyramid(args.tiles, grid, [path]).export()
+    print(f"  rendered {num_tiles} tiles")
+
 # overlay SVG file
 with open(file_base + '_path.svg', 'w') as svg:
     svg.write('<svg ')
@@ -0,0 +1,61 @@
+import numpy as np
+import pickle
+import os
+
+from geogrid import GeoGrid
+
+# footprints of the (polygon) features of an airspace layer: the removed nodes
+# of each feature are stored by content hash of the feature, such that a mask of
+# a layer only requires rasterizing the features added or changed since the
+# previous mask
+
+
+# the removed nodes of a feature as tuple (x0, y0, shape, bits) of the region
+# covering the feature and the packed bits of its nodes; the feature is removed
+# from the scratch grid (zeros) and the region is reset afterwards
+def footprint(scratch, shapes, margin):
+    nodes = scratch.coords_to_grid(np.concatenate([
+        coords for _, coords in shapes
+    ]))
+    pad = margin / scratch.scale + 2.
+    x0, y0 = np.maximum(np.floor(nodes.min(axis=0) - pad), 0).astype(int)
+    x1, y1 = np.minimum(np.ceil(nodes.max(axis=0) + pad), scratch.size).astype(int)
+    x1, y1 = max(x1, x0), max(y1, y0)
+    for feature_type, coords in shapes:
+        if feature_type != 3:
+            raise ValueError(f"Unexpected feature type {feature_type}")
+        scratch.rm_polygon(coords, margin)
+    region = scratch.vals[x0:x1, y0:y1]
+    removed = region < 0.
+    region[...] = 0.
+    return (int(x0), int(y0), removed.shape, np.packbits(removed, axis=None))
+
+
+# mask of the removed nodes of the features (tuples (feature id, content hash,
+# shapes)) of a layer, the footprints are stored in the pickle file path (which
+# must only be used for one grid and margin); returns the mask and the number
+# of rasterized footprints, the footprints of features that are no longer part
+# of the layer are dropped
+def layer_mask(path, grid_size, grid_scale, grid_orig, features, margin):
+    footprints = {}
+    if os.path.exists(path):
+        with open(path, 'rb') as src:
+            footprints = pickle.load(src)
+    scratch = GeoGrid(
+        grid_size, grid_scale, grid_orig, np.zeros(grid_size, np.float32)
+    )
+    mask, used, num_rasterized = np.zeros(grid_size, dtype=bool), {}, 0
+    for _, content_hash, shapes in features:
+        if content_hash not in footprints:
+            footprints[content_hash] = footprint(scratch, shapes, margin)
+            num_rasterized += 1
+        x0, y0, shape, bits = used[content_hash] = footprints[content_hash]
+        mask[x0:x0 + shape[0], y0:y0 + shape[1]] |= np.unpackbits(
+            bits, count=shape[0] * shape[1]
+        ).reshape(shape).astype(bool)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as dst:
+        pickle.dump(used, dst, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return mask, num_rasterized
@@ -2,6 +2,10 @@
 
 import math
 import argparse
+import multiprocessing
+import hashlib
+import json
+import os
 import logging
 logging.basicConfig(level=logging.INFO)
 
@@ -9,6 +13,59 @@ parser = argparse.ArgumentParser(description='Generate a terrain grid.')
 parser.add_argument('-r', '--resolution', metavar='GRID_RESOLUTION',
                     type=int, default=100,
                     help='grid resolution in meters (default 100)')
+parser.add_argument('-s', '--sampling', metavar='SAMPLING',
+                    choices=['nearest', 'bilinear', 'min', 'max', 'mean'],
+                    default='max',
+                    help='elevation sampling mode, one of nearest, bilinear, '
+                         'min, max or mean (default max)')
+parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=None,
+                    help='number of worker processes, which are shared by the '
+                         'DEM sampling and the parsing of basemap tiles '
+                         '(default number of CPUs)')
+parser.add_argument('-p', '--pyramid', metavar='PYRAMID_DIR', default=None,
+                    help='directory of the DEM pyramid cache, which is built '
+                         'on first use (supports the sampling modes max and '
+                         'mean at the resolutions 10, 20, 50, 100, 200 and '
+                         '400 m)')
+parser.add_argument('-c', '--tile-cache', metavar='TILE_CACHE.sqlite',
+                    default=None,
+                    help='persistent cache for basemap vector tiles')
+parser.add_argument('--tile-cache-size', metavar='MEGABYTES', type=float,
+                    default=None,
+                    help='maximum size of the tile cache, the least recently '
+                         'used tiles are evicted (default unlimited)')
+parser.add_argument('--offline', action='store_true',
+                    help='use only cached basemap vector tiles and the stored '
+                         'airspace snapshots of the current day (or the latest '
+                         'ones, with a warning)')
+parser.add_argument('--ows-url', metavar='OWS_URL',
+                    default='https://map.dronespace.at/ows',
+                    help='URL of the WFS endpoint of the airspace features '
+                         '(default https://map.dronespace.at/ows)')
+parser.add_argument('--token-url', metavar='TOKEN_URL',
+                    default='https://map.dronespace.at/oauth/token',
+                    help='URL of the OAuth token endpoint of the WFS '
+                         '(default https://map.dronespace.at/oauth/token)')
+parser.add_argument('--refresh', action='store_true',
+                    help='fetch the airspace features again, even if they '
+                         'were fetched for the current day already, and '
+                         'report the added, removed and changed features')
+parser.add_argument('-t', '--tiles', metavar='TILE_DIR', default=None,
+                    help='additionally export the map as z/x/y PNG tile '
+                         'pyramid (EPSG 3857) to this directory')
+parser.add_argument('-C', '--cache-dir', metavar='CACHE_DIR',
+                    default='stage_cache',
+                    help='directory of the cached stage artifacts, a rerun '
+                         'only executes stages with changed inputs or '
+                         'parameters (default stage_cache)')
+parser.add_argument('--force', metavar='STAGES', default=None,
+                    help='comma-separated names of stages to execute (along '
+                         'with all stages depending on them) regardless of '
+                         'cached artifacts, e.g., airspace_shapes')
+parser.add_argument('--trace', metavar='TRACE.json', default=None,
+                    help='record the duration and peak memory of each stage, '
+                         'HTTP and tile statistics and write them as Chrome '
+                         'trace-event JSON')
 parser.add_argument('grid', metavar="GRID_FILE.npy",
                     help='grid file')
 args = parser.parse_args()
@@ -17,6 +74,10 @@ assert args.grid.rsplit('.', 1)[1] == 'npy', (
     "grid file must use file extension *.npy"
 )
 
+import telemetry
+if args.trace is not None:
+    telemetry.enable()
+
 BASEMAP_LEVEL     = 11
 BASEMAP_LINEWIDTH = 300 # width of basemap line features (e.g., highways)
 BASEMAP_MARGIN    = 120 # margin around basemap areas (e.g., buildings)
@@ -36,47 +97,78 @@ grid_size  = (
     int((grid_end[0] - grid_orig[0]) / grid_scale),
     int((grid_orig[1] - grid_end[1]) / grid_scale)
 )
+grid_bbox  = (grid_orig[0], grid_end[1], grid_end[0], grid_orig[1])
+grid_params = {
+    'size': list(grid_size), 'scale': grid_scale, 'orig': list(grid_orig)
+}
+
+# grid generation is a DAG of stages (see pipeline.py), whose artifacts are
+# cached in the cache directory; the stage functions below are only called if
+# their artifacts are missing or invalid; the network stages (access token,
+# WFS queries and basemap) are I/O stages, which start together with the DEM
+# sampling and smoothing and are joined by the exclusion masks
+import numpy as np
+from pipeline import Pipeline
+from geogrid import GeoGrid
+
+stages = Pipeline(args.cache_dir)
 
 ###############################################################################
 # initialize grid
 
-from geotiff import GeoTIFF
-from geogrid import GeoGrid
-
-# initialize a grid graph with altitudes from a digital elevation model
-def init_topo_grid(grid_size, grid_scale, grid_orig, grid_crs, dem_path):
-    grid = GeoGrid(grid_size, grid_scale, grid_orig)
-    dem  = GeoTIFF(dem_path)
-    # get coordinates of each node w.r.t. grid CSR
-    node_list = [
-        (x, y) for x in range(grid.size[0]) for y in range(grid.size[1])
-    ]
-    node_coords = [
-        (grid.orig[0] + x * grid.scale, grid.orig[1] - y * grid.scale)
-        for x, y in node_list
-    ]
-    # convert node coordinates from grid CSR to elevation model raster
-    raster_coords = dem.crs_to_raster(grid_crs, node_coords)
-    # assign each node its respective altitude
-    grid.set_node_values(
-        (node, dem.img.getpixel(raster_coord))
-        for node, raster_coord in zip(node_list, raster_coords)
-        if (0 <= raster_coord[0] < dem.img.size[0] and 0 <= raster_coord[1] < dem.img.size[1])
-    )
-    return grid
-
-print(f"Initializing grid of size {grid_size} ...")
+from geotopo import (
+    init_topo_grid, cached_file_hash, DEMPyramid, PYRAMID_LEVELS, PYRAMID_MODES
+)
 
-# initialize the grid with the digital elevation model
 dem_path = 'ogd-10m-at/dhm_at_lamb_10m_2018.tif'
-grid     = init_topo_grid(grid_size, grid_scale, grid_orig, 3857, dem_path)
 
-print(f"Initialized grid with digital elevation model")
+# initialize the grid with the digital elevation model, either by loading a
+# level of the DEM pyramid or by sampling the model directly (into a file that
+# becomes the artifact of the stage)
+use_pyramid = (args.pyramid is not None and args.resolution in PYRAMID_LEVELS
+                                        and args.sampling in PYRAMID_MODES)
+
+def init_dem():
+    print(f"Initializing grid of size {grid_size} ...")
+    if use_pyramid:
+        pyramid = DEMPyramid(
+            args.pyramid, dem_path, grid_orig, grid_end, distortion, 3857
+        )
+        if not pyramid.is_complete():
+            print(f"Building DEM pyramid in {pyramid.path} ...")
+            pyramid.build(args.jobs, pool=workers)
+        vals = pyramid.load_grid(args.resolution, args.sampling).vals
+    else:
+        vals = os.path.join(args.cache_dir, 'dem', 'sampling.npy')
+        os.makedirs(os.path.dirname(vals), exist_ok=True)
+        init_topo_grid(
+            grid_size, grid_scale, grid_orig, 3857, dem_path, args.sampling,
+            args.resolution, args.jobs, out=vals, pool=workers
+        )
+    print(f"Initialized grid with digital elevation model")
+    return vals
+
+# the hash of the elevation model is a deferred parameter, such that hashing a
+# new or modified model does not delay the network stages; the pyramid levels
+# are aggregated from the base level and thus differ from a direct sampling
+stages.add('dem', init_dem, params={
+    'dem_hash':   lambda: cached_file_hash(dem_path, args.cache_dir),
+    'grid':       grid_params,
+    'sampling':   args.sampling,
+    'resolution': args.resolution,
+    'pyramid':    use_pyramid
+}, fmt='npy')
 
 # smoothing grid
-maxdiff = grid.smooth_node_values(0.1, 10.)
+def smooth_grid(vals):
+    grid = GeoGrid(grid_size, grid_scale, grid_orig, np.array(vals))
+    maxdiff = grid.smooth_node_values(0.1, 10., tile_size=4096, workers=args.jobs)
+    print(f"Smoothed grid (maximum difference: {maxdiff} m")
+    return grid.vals
 
-print(f"Smoothed grid (maximum difference: {maxdiff} m")
+stages.add('smooth', smooth_grid, ['dem'], {
+    'sigma': 0.1, 'max_diff': 10.
+}, fmt='npy')
 
 
 ###############################################################################
@@ -86,16 +178,20 @@ import requests
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, timezone
 from geojson import GeoJSON
+from wfsstore import SnapshotStore
 
-print("Querying restriced airspace ...")
-
-# get access token
-token_url  = 'https://map.dronespace.at/oauth/token'
+# get access token (not needed in offline mode)
+token_url  = args.token_url
 token_auth = ('AustroDroneWeb', 'AustroDroneWeb')
 token_data = {'grant_type': 'client_credentials'}
-req = requests.post(token_url, auth=token_auth, data=token_data)
-assert req.status_code == 200, f"token request status {req.status_code}"
-token = req.json()['access_token']
+def get_token():
+    if args.offline:
+        return None
+    req = requests.post(token_url, auth=token_auth, data=token_data)
+    assert req.status_code == 200, f"token request status {req.status_code}"
+    return req.json()['access_token']
+
+stages.add('token', get_token, params={'url': token_url}, fmt=None, io=True)
 
 def ows_request(url, token, typename, dt_start, dt_end):
     feature_req = ET.Element('GetFeature', {
@@ -113,93 +209,258 @@ def ows_request(url, token, typename, dt_start, dt_end):
         'Content-Type':  'text/xml;charset=UTF-8',
         'Authorization': f"Bearer {token}"
     }
-    req = requests.post(url, headers=req_headers, data=feature_req)
-    assert req.status_code == 200, f"feature request status {req.status_code}"
-    return req.json()
+    # the response is parsed while it is received, the raw response is returned
+    # along with the parsed features
+    raw = []
+    def record(chunks):
+        for chunk in chunks:
+            raw.append(chunk)
+            yield chunk
+    with requests.post(url, headers=req_headers, data=feature_req, stream=True) as req:
+        assert req.status_code == 200, f"feature request status {req.status_code}"
+        geojson = GeoJSON.from_stream(record(req.iter_content(chunk_size=1 << 16)))
+    return geojson, b''.join(raw)
 
 dt_start = datetime.now(timezone.utc)
 dt_end   = datetime(
     dt_start.year, dt_start.month, dt_start.day, tzinfo=timezone.utc
 ) + timedelta(days=0, seconds=3600*24-1, milliseconds=999)
 time_format = '%Y-%m-%dT%H:%M:%S.000Z'
-
-ows_url  = 'https://map.dronespace.at/ows'
-airspace = GeoJSON(ows_request(ows_url, token, 'airspace', dt_start, dt_end))
-uaszone  = GeoJSON(ows_request(ows_url, token, 'uaszone' , dt_start, dt_end))
-
-#for feature in airspace.features:
-#    print(f"{feature.category:26}{feature.lower_limit[0]:6} {feature.upper_limit[0]:7}  {feature.code:8}  {feature.name}")
-
-#for feature in uaszone.features:
-#    print(f"{feature.category:26}{feature.lower_limit[0]:6} {feature.upper_limit[0]:7}  {(feature.code if feature.code is not None else ''):8}  {feature.name}")
+window      = dt_end.strftime('%Y-%m-%d')
+
+# the responses are stored as snapshots of the fetch time window (the current
+# UTC day), a refresh reports the changed features
+os.makedirs(args.cache_dir, exist_ok=True)
+snapshots = SnapshotStore(os.path.join(args.cache_dir, 'snapshots.sqlite'))
+
+# time window of the snapshot of a type name to use: in offline mode, the
+# latest snapshot is used if there is none of the current window yet
+def snapshot_window(typename):
+    if not args.offline or snapshots.get(typename, window) is not None:
+        return window
+    latest = snapshots.latest(typename)
+    if latest is None:
+        parser.error(
+            f"no stored {typename} snapshot for offline mode, run once "
+            f"without --offline to fetch the airspace features"
+        )
+    logging.warning(
+        f"no {typename} snapshot for {window}, using the snapshot of {latest}"
+    )
+    return latest
+
+# the shapes of the restricted airspace at 200 m within the grid bounds as
+# tuples (feature id, content hash, shapes); the artifacts are valid for the
+# time window of the snapshot
+ows_url  = args.ows_url
+def airspace_shapes(typename, snap_window):
+    def query(token):
+        if args.offline:
+            geojson = GeoJSON.from_stream([snapshots.get(typename, snap_window)])
+        else:
+            print(f"Querying restricted airspace ({typename}) ...")
+            geojson, data = ows_request(ows_url, token, typename, dt_start, dt_end)
+            changes = snapshots.update(typename, window, data)
+            print('\n'.join([
+                f"  {typename}: {len(changes.added)} added, "
+                f"{len(changes.removed)} removed, {len(changes.changed)} "
+                f"changed features"
+            ] + [
+                f"    {label:8} {feature_id}"
+                for label, feature_ids in zip(changes._fields, changes)
+                for feature_id in feature_ids
+            ]))
+        hashes = snapshots.hashes(typename, snap_window)
+        return [
+            (feature.feature_id, hashes[feature.feature_id], shapes)
+            for feature, shapes in geojson.get_feature_shapes(200, grid_bbox)
+        ]
+    return query
+
+for typename in ['airspace', 'uaszone']:
+    snap_window = snapshot_window(typename)
+    stages.add(f"{typename}_shapes", airspace_shapes(typename, snap_window), [
+        'token'
+    ], {
+        'url':      ows_url,
+        'typename': typename,
+        'window':   snap_window,
+        'altitude': 200,
+        'bbox':     grid_bbox
+    }, io=True)
 
 
 ###############################################################################
 # basemap features
 
 import tilemap
+from tilecache import TileCache
 
-print("Initializing basemap vector map ...")
-
-tmap = tilemap.VectorTileMap('https://maps.wien.gv.at/basemapv/bmapv/3857/')
-zoom_level = BASEMAP_LEVEL
-for layer in tmap.get_style_layers(zoom_level):
-    print(f"  layer with zoom {zoom_level}: {layer['id']}")
-
-filters = tmap.get_style_filters([
+basemap_url    = 'https://maps.wien.gv.at/basemapv/bmapv/3857/'
+basemap_layers = [
     r'GRENZEN/.*STAATSGRENZE.*',
     r'STRASSENNETZ/.*Autobahn.*',
     r'NUTZUNG/.*Siedlung.*'
-], zoom_level)
-for layer in filters:
-    print(f"  Using layer: {layer}")
+]
+
+# the basemap tiles are fetched while their shapes are parsed and merged
+def basemap_shapes():
+    print("Initializing basemap vector map ...")
+    tile_cache = None
+    if args.tile_cache is not None:
+        max_size = None
+        if args.tile_cache_size is not None:
+            max_size = int(args.tile_cache_size * 2**20)
+        tile_cache = TileCache(args.tile_cache, max_size)
+    tmap = tilemap.VectorTileMap(
+        basemap_url, cache=tile_cache, offline=args.offline
+    )
+    zoom_level = BASEMAP_LEVEL
+    for layer in tmap.get_style_layers(zoom_level):
+        print(f"  layer with zoom {zoom_level}: {layer['id']}")
+
+    filters = tmap.get_style_filters(basemap_layers, zoom_level)
+    for layer in filters:
+        print(f"  Using layer: {layer}")
+    return list(tmap.query_shapes(
+        zoom_level, filters, bbox=grid_bbox, merge_key='$id', pool=workers
+    ))
+
+stages.add('basemap_shapes', basemap_shapes, params={
+    'url':       basemap_url,
+    'zoom':      BASEMAP_LEVEL,
+    'layers':    basemap_layers,
+    'bbox':      grid_bbox,
+    'merge_key': '$id'
+}, io=True)
 
 
 ###############################################################################
 # remove forbidden areas
 
-print("Removing forbidden areas ...")
+from footprints import layer_mask
+
+def rm_shapes(grid, shapes, name, line_margin, polygon_margin):
+    for feature_type, coords in shapes:
+        if feature_type == 2 and line_margin is not None:
+            grid.rm_line(coords, line_margin)
+        elif feature_type == 3:
+            grid.rm_polygon(coords, polygon_margin)
+        else:
+            raise ValueError(f"Unexpected {name} feature type {feature_type}")
+
+# each layer of forbidden areas is rasterized to a mask of removed nodes, such
+# that a change of one layer does not require rasterizing the others
+def exclusion_mask(name, line_margin, polygon_margin):
+    def rasterize(shapes):
+        print(f"  Removing {name} ...")
+        grid = GeoGrid(
+            grid_size, grid_scale, grid_orig, np.zeros(grid_size, np.float32)
+        )
+        rm_shapes(grid, shapes, name, line_margin, polygon_margin)
+        return grid.vals < 0.
+    return rasterize
+
+# the airspace layers are the union of the footprints of their features, which
+# are stored by content hash of the features (for the grid and margin); only
+# the footprints of features added or changed since a previous run are
+# rasterized (see footprints.py)
+def footprint_mask(layer, name, margin):
+    key  = hashlib.sha256(json.dumps(
+        {'grid': grid_params, 'margin': margin}, sort_keys=True
+    ).encode()).hexdigest()
+    path = os.path.join(args.cache_dir, 'footprints', f"{layer}-{key[:16]}.pkl")
+    def rasterize(features):
+        mask, num_rasterized = layer_mask(
+            path, grid_size, grid_scale, grid_orig, features, margin
+        )
+        print(f"  Removing {name} ({num_rasterized} of {len(features)} "
+              f"footprints rasterized) ...")
+        return mask
+    return rasterize
+
+stages.add('basemap_mask', exclusion_mask(
+    'highways and populated areas', distortion * BASEMAP_LINEWIDTH / 2,
+    distortion * BASEMAP_MARGIN
+), ['basemap_shapes'], {
+    'grid': grid_params, 'line_margin': distortion * BASEMAP_LINEWIDTH / 2,
+    'polygon_margin': distortion * BASEMAP_MARGIN
+}, fmt='npy')
+
+for layer, name, margin in [
+    ('airspace', 'restricted airspace', distortion * AIRSPACE_MARGIN),
+    ('uaszone', 'restricted UAS zones', distortion * UASZONE_MARGIN)
+]:
+    stages.add(f"{layer}_mask", footprint_mask(layer, name, margin), [
+        f"{layer}_shapes"
+    ], {'grid': grid_params, 'margin': margin}, fmt='npy')
+
+def composite_grid(vals, *masks):
+    print("Removing forbidden areas ...")
+    vals = np.array(vals)
+    for mask in masks:
+        vals[mask] = -1.
+    return vals
+
+stages.add('grid', composite_grid, [
+    'smooth', 'basemap_mask', 'airspace_mask', 'uaszone_mask'
+], fmt='npy')
 
-print("  Removing highways and populated areas ...")
 
-for feature_type, coords in tmap.query_shapes(zoom_level, filters):
-    if feature_type == 2:
-        grid.rm_line(coords, distortion * BASEMAP_LINEWIDTH / 2)
-    elif feature_type == 3:
-        grid.rm_polygon(coords, distortion * BASEMAP_MARGIN)
-    else:
-        raise ValueError(f"Unexpected basemap feature type {feature_type}")
+###############################################################################
+# save map and generate output image
 
-print("  Removing restricted airspace ...")
+from geodraw import GeoDraw
 
-for feature_type, coords in airspace.get_shapes(200):
-    if feature_type == 3:
-        grid.rm_polygon(coords, distortion * AIRSPACE_MARGIN)
-    else:
-        raise ValueError(f"Unexpected airspace feature type {feature_type}")
+def save_grid(vals):
+    grid = GeoGrid(grid_size, grid_scale, grid_orig, vals)
+    grid.save(args.grid)
 
-print("  Removing restricted UAS zones ...")
+    print("Generating output image ...")
+    img_path = args.grid.rsplit('.', 1)[0] + '.png'
+    draw = GeoDraw(grid.size)
+    draw.fill_array(
+        grid.vals, (grid.vals >= 0.) & (grid.vals <= 4500.), 1. / 4500.
+    )
+    draw.save(img_path)
+    return [args.grid, img_path]
 
-for feature_type, coords in uaszone.get_shapes(200):
-    if feature_type == 3:
-        grid.rm_polygon(coords, distortion * UASZONE_MARGIN)
-    else:
-        raise ValueError(f"Unexpected UAS zone feature type {feature_type}")
+stages.add('render', save_grid, ['grid'], {'grid_path': args.grid}, fmt='files')
 
+if args.tiles is not None:
+    from tileexport import TilePyramid
 
-###############################################################################
-# save map and generate output image
+    # the tile pyramid only re-renders tiles whose source cells changed, the
+    # tiles are rendered by the shared worker pool from the (memory-mapped)
+    # artifact of the grid stage
+    def render_tiles(vals):
+        print("Exporting map tiles ...")
+        grid = GeoGrid(grid_size, grid_scale, grid_orig, vals)
+        num_tiles = TilePyramid(args.tiles, grid, []).export(pool=workers)
+        print(f"  rendered {num_tiles} tiles")
+        return [os.path.join(args.tiles, 'tiles.json')]
 
-grid.save(args.grid)
+    stages.add('tiles', render_tiles, ['grid'], {
+        'tile_path': args.tiles
+    }, fmt='files')
 
-from geodraw import GeoDraw
 
-print("Generating output image ...")
-draw = GeoDraw(grid.size)
-draw.fill_palette(
-    (coord, val / 4500.) for coord, val in (
-        ((x, y), grid.get_node_value((x, y))) for x in range(grid.size[0])
-                                              for y in range(grid.size[1])
-    ) if 0. <= val <= 4500.
-)
-draw.save(args.grid.rsplit('.', 1)[0] + '.png')
+###############################################################################
+# run stages
+
+force = [] if args.force is None else args.force.split(',')
+if args.refresh:
+    force += ['airspace_shapes', 'uaszone_shapes']
+
+# the worker processes of the DEM sampling, the basemap tile parsing and the
+# tile export share one pool of args.jobs processes, which is started before the stages start
+# any threads (forking a multi-threaded process may deadlock the workers)
+workers = multiprocessing.Pool(args.jobs)
+try:
+    stages.run(force=force)
+finally:
+    workers.terminate()
+
+if args.trace is not None:
+    telemetry.write_trace(args.trace)
+    print(f"Wrote trace to {args.trace}")
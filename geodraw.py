@@ -1,4 +1,5 @@
 
+import numpy as np
 from PIL import Image, ImageDraw
 
 class GeoDraw:
@@ -25,6 +26,7 @@ class GeoDraw:
         #    (102,  51,   0),
         #    (255, 255, 255)
         #]
+        self.luts = {}
 
 
     def _palette_color(self, val):
@@ -38,14 +40,83 @@ class GeoDraw:
         )
 
 
+    # palette colors for the values i / size (i = 0 .. size - 1), followed by
+    # the background color for values outside of the palette
+    def _palette_lut(self, size):
+        if size not in self.luts:
+            self.luts[size] = np.array([
+                self._palette_color(idx / size) for idx in range(size)
+            ] + [self.background], np.uint8)
+        return self.luts[size]
+
+
+    # palette colors (..., 3) of an array of values; the table size is rounded
+    # up to a multiple of the palette length, such that no entry straddles a
+    # palette stop
+    def palette_colors(self, vals, lut_size):
+        lut_size = -(-lut_size // len(self.palette)) * len(self.palette)
+        lut      = self._palette_lut(lut_size)
+        with np.errstate(invalid='ignore'):
+            idxs = np.where(
+                (vals >= 0.) & (vals < 1.), vals * lut_size, lut_size
+            ).astype(np.intp)
+        return lut[np.minimum(idxs, lut_size)]
+
+
+    def _set_image(self, pixels):
+        self.img  = Image.fromarray(pixels, 'RGB')
+        self.draw = ImageDraw.Draw(self.img)
+
+
     def fill_color(self, coords, color):
-        for coord in coords:
-            self.img.putpixel((coord[0], coord[1]), color)
+        self.draw.point([(coord[0], coord[1]) for coord in coords], fill=color)
 
 
     def fill_palette(self, vals):
-        for coord, val in vals:
-            self.img.putpixel((coord[0], coord[1]), self._palette_color(val))
+        vals = list(vals)
+        if not vals:
+            return
+        coords = np.array([coord[:2] for coord, _ in vals], np.intp)
+        pixels = np.array(self.img)
+        pixels[coords[:, 1], coords[:, 0]] = self.palette_colors(
+            np.array([val for _, val in vals], np.float64), 4096
+        )
+        self._set_image(pixels)
+
+
+    # fill the image with the palette colors of an array of values indexed by
+    # (x, y) (like the node values of a GeoGrid) multiplied by scale, optionally
+    # only where the validity mask is set; the colors are looked up in a table
+    # of lut_size entries and the array is processed in strips of rows
+    def fill_array(self, vals, valid=None, scale=1., lut_size=4096, strip=1024):
+        assert tuple(vals.shape) == self.img.size, "size of values must match"
+        pixels = np.array(self.img)
+        for x0 in range(0, vals.shape[0], strip):
+            x1     = min(x0 + strip, vals.shape[0])
+            colors = self.palette_colors(
+                np.asarray(vals[x0:x1], np.float64).T * scale, lut_size
+            )
+            if valid is None:
+                pixels[:, x0:x1] = colors
+            else:
+                mask = np.asarray(valid[x0:x1]).T
+                pixels[:, x0:x1][mask] = colors[mask]
+        self._set_image(pixels)
+
+
+    # fill the image with a heatmap of an array of values indexed by (x, y),
+    # the valid values are mapped linearly to the whole palette
+    def fill_heatmap(self, vals, valid=None):
+        vals = np.asarray(vals)
+        if valid is None:
+            valid = np.ones(vals.shape, dtype=bool)
+        if not valid.any():
+            return
+        min_val, max_val = float(vals[valid].min()), float(vals[valid].max())
+        span = (len(self.palette) - 1) / len(self.palette)
+        self.fill_array(
+            vals - min_val, valid, span / max(max_val - min_val, 1e-9) * 0.999
+        )
 
 
     def save(self, path):
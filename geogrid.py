@@ -1,13 +1,86 @@
 
 import numpy as np
 from scipy.ndimage import gaussian_filter
+from concurrent.futures import ThreadPoolExecutor
 import networkx as nx
 import math
 import shapely.geometry as shp
 import heapq
+import time
+
+# statistics of a path search: number of expanded nodes, heap pushes, stale
+# heap entries popped, maximum heap size, cost of the path, time spent relaxing
+# the neighbors of expanded nodes and in total (seconds), and the quality of
+# the heuristic as ratio h(start) / cost (the closer to 1, the fewer nodes are
+# expanded); with record_expanded, expanded_order holds the index at which each
+# node was expanded (-1 if never), e.g., for drawing a heatmap with GeoDraw
+class SearchStats:
+    def __init__(self, record_expanded=False):
+        self.record_expanded = record_expanded
+        self.expanded_order  = None
+        self.expanded        = 0
+        self.pushes          = 0
+        self.stale_pops      = 0
+        self.max_heap        = 0
+        self.cost            = None
+        self.relax_time      = 0.
+        self.total_time      = 0.
+        self.heuristic_ratio = None
+
+
+    def as_dict(self):
+        return {
+            'expanded':        self.expanded,
+            'pushes':          self.pushes,
+            'stale_pops':      self.stale_pops,
+            'max_heap':        self.max_heap,
+            'cost':            self.cost,
+            'relax_time':      self.relax_time,
+            'total_time':      self.total_time,
+            'heuristic_ratio': self.heuristic_ratio
+        }
+
+
+    # hooks of the search loop of GeoGrid.find_path, which are called once per
+    # search, per expanded node (before and after relaxing its neighbors) and
+    # per stale heap entry; the number of pushes of a relaxation is the growth
+    # of the heap, as nodes are only popped by the search loop
+    def start(self, size):
+        self._t_start = time.perf_counter()
+        if self.record_expanded:
+            self.expanded_order = np.full(size, -1, np.int32)
+        self.pushes  += 1
+        self.max_heap = max(self.max_heap, 1)
+
+
+    def expand(self, node, heap_size):
+        if self.record_expanded:
+            self.expanded_order[node] = self.expanded
+        self.expanded  += 1
+        self._heap_size = heap_size
+        self._t_relax   = time.perf_counter()
+
+
+    def stale(self):
+        self.stale_pops += 1
+
+
+    def relaxed(self, heap_size):
+        self.relax_time += time.perf_counter() - self._t_relax
+        self.pushes     += heap_size - self._heap_size
+        self.max_heap    = max(self.max_heap, heap_size)
+
+
+    def finish(self, cost, estimate):
+        self.total_time = time.perf_counter() - self._t_start
+        if cost is not None:
+            self.cost = cost
+            if cost > 0.:
+                self.heuristic_ratio = estimate / cost
+
 
 class GeoGrid:
-    def __init__(self, size, scale, orig=(0,0)):
+    def __init__(self, size, scale, orig=(0,0), vals=None):
         assert (len(size) == 2 and isinstance(size[0], int)
                                and isinstance(size[1], int)), (
             "size must be a tuple with two integers")
@@ -17,16 +90,17 @@ class GeoGrid:
         self.scale = scale
         self.orig  = orig
 
-        # create array for node values
-        self.vals = np.full(size, -1., np.float32)
+        # create array for node values (unless an existing array is used)
+        if vals is None:
+            vals = np.full(size, -1., np.float32)
+        assert vals.shape == tuple(size), "size of node values must match"
+        self.vals = vals
 
 
     @staticmethod
-    def load(path, scale, orig=(0,0)):
-        vals = np.load(path)
-        grid = GeoGrid(vals.shape, scale, orig)
-        grid.vals = vals
-        return grid
+    def load(path, scale, orig=(0,0), mmap_mode=None):
+        vals = np.load(path, mmap_mode=mmap_mode)
+        return GeoGrid(vals.shape, scale, orig, vals)
 
 
     def save(self, path):
@@ -121,23 +195,77 @@ class GeoGrid:
             yield float((x, y), self.vals[x, y])
 
 
-    def smooth_node_values(self, sigma, max_diff):
-        # apply gaussian blur to height map in order to avoid short steep edges
-        hmap  = gaussian_filter(self.vals, sigma=sigma)
-        diffs = [
-            abs(h1 - h2) for h1, h2
-            in zip(np.nditer(self.vals), np.nditer(hmap))
-            if h1 >= 0. and h2 >= 0.
+    @staticmethod
+    def _smooth(vals, sigma):
+        # normalized convolution: blur the valid values and the validity mask
+        # separately, such that invalid nodes do not bleed into valid ones
+        valid = vals >= 0.
+        hmap  = gaussian_filter(np.where(valid, vals, 0.).astype(np.float32), sigma)
+        wgts  = gaussian_filter(valid.astype(np.float32), sigma)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(valid, hmap / wgts, vals).astype(np.float32)
+
+
+    def smooth_node_values(self, sigma, max_diff, tile_size=None, workers=None,
+                           out=None):
+        # apply gaussian blur to height map in order to avoid short steep edges;
+        # optionally, the grid is processed in tiles of tile_size x tile_size
+        # nodes (with an overlap covering the filter radius) by several threads
+        # and the result is written to out (e.g., a memory-mapped array)
+        if out is None:
+            out = np.empty_like(self.vals)
+        if tile_size is None:
+            tile_size = max(self.size)
+        halo = int(4. * sigma + 0.5) # filter radius of gaussian_filter
+
+        def smooth_tile(x0, y0):
+            x1 = min(x0 + tile_size, self.size[0])
+            y1 = min(y0 + tile_size, self.size[1])
+            hx0, hy0 = max(x0 - halo, 0), max(y0 - halo, 0)
+            hx1 = min(x1 + halo, self.size[0])
+            hy1 = min(y1 + halo, self.size[1])
+            vals = np.asarray(self.vals[hx0:hx1, hy0:hy1])
+            hmap = self._smooth(vals, sigma)[x0-hx0:x1-hx0, y0-hy0:y1-hy0]
+            vals = vals[x0-hx0:x1-hx0, y0-hy0:y1-hy0]
+            out[x0:x1, y0:y1] = hmap
+            diffs = np.abs(hmap - vals)[vals >= 0.]
+            return float(diffs.max()) if diffs.size > 0 else 0.
+
+        tiles = [
+            (x, y) for x in range(0, self.size[0], tile_size)
+                   for y in range(0, self.size[1], tile_size)
         ]
-        assert all(diff <= max_diff for diff in diffs)
-        self.vals = hmap
-        return max(diffs)
+        if len(tiles) == 1 or workers == 1:
+            maxdiff = max(smooth_tile(x, y) for x, y in tiles)
+        else:
+            with ThreadPoolExecutor(workers) as pool:
+                maxdiff = max(pool.map(lambda tile: smooth_tile(*tile), tiles))
+        assert maxdiff <= max_diff, (
+            f"smoothing changed a node value by {maxdiff} > {max_diff}")
+        self.vals = out
+        return maxdiff
+
+
+    # convert coordinates to (fractional) grid positions as array
+    def coords_to_grid(self, coords):
+        if not isinstance(coords, np.ndarray):
+            coords = list(coords)
+        coords = np.asarray(coords, np.float64).reshape(-1, 2)
+        orig_x, orig_y = self.orig
+        return np.stack((
+            (coords[:, 0] - orig_x) / self.scale,
+            (orig_y - coords[:, 1]) / self.scale
+        ), axis=-1)
 
 
-    def coords_to_grid(self, coords):
+    # inverse of coords_to_grid, the map coordinates of (fractional) nodes
+    def grid_to_coords(self, nodes):
+        nodes = np.asarray(nodes, np.float64).reshape(-1, 2)
         orig_x, orig_y = self.orig
-        for x, y in coords:
-            yield ((x - orig_x) / self.scale, (orig_y - y) / self.scale)
+        return np.stack((
+            orig_x + nodes[:, 0] * self.scale,
+            orig_y - nodes[:, 1] * self.scale
+        ), axis=-1)
 
 
     def rm_points(self, coords, radius):
@@ -184,15 +312,8 @@ class GeoGrid:
         return diff * self.scale
 
 
-    def find_path(self, node1, node2, slope_factor, extended_radius=False):
-        # the heuristic function is simply the euclidiean distance
-        heuristic = lambda n1, n2: math.sqrt((n1[0] - n2[0])**2 + (n1[1] - n2[1])**2)
-
-        camefrom = {}
-        g_scores = {node1: 0.}
-        f_scores = []
-        heapq.heappush(f_scores, (heuristic(node1, node2), 0., node1))
-
+    @staticmethod
+    def _search_deltas(extended_radius):
         sqrt2 = math.sqrt(2.)
         deltas = [
             (0, 1, 1.   ), (1,  0, 1.   ), ( 0, -1, 1.   ), (-1, 0, 1.   ),
@@ -205,15 +326,53 @@ class GeoGrid:
                 (1, 2, sqrt5), (1, -2, sqrt5), (-1, -2, sqrt5), (-1, 2, sqrt5),
                 (2, 1, sqrt5), (2, -1, sqrt5), (-2, -1, sqrt5), (-2, 1, sqrt5)
             ]
+        return deltas
+
+
+    @staticmethod
+    def _trace_path(camefrom, node1, node2):
+        path = [(node2[0], node2[1], 0.)]
+        current = node2
+        while current != node1:
+            current = camefrom[current]
+            path.insert(0, (current[0], current[1], 0.))
+        return path
+
+
+    # find the path from node1 to node2 with A*; optionally, the search is
+    # instrumented and its statistics are collected in stats (SearchStats),
+    # whose hooks are only called per search, expanded node or stale entry,
+    # such that the uninstrumented search only pays for a few no-op calls per
+    # node
+    def find_path(self, node1, node2, slope_factor, extended_radius=False,
+                  stats=None):
+        # the heuristic function is simply the euclidiean distance
+        heuristic = lambda n1, n2: math.sqrt((n1[0] - n2[0])**2 + (n1[1] - n2[1])**2)
+
+        camefrom = {}
+        g_scores = {node1: 0.}
+        f_scores = []
+        heapq.heappush(f_scores, (heuristic(node1, node2), 0., node1))
+
+        # the hooks are bound once, without statistics they do nothing
+        if stats is None:
+            expand = relaxed = stale = lambda *args: None
+        else:
+            stats.start(self.size)
+            expand, relaxed, stale = stats.expand, stats.relaxed, stats.stale
+
+        deltas = self._search_deltas(extended_radius)
 
         while len(f_scores) > 0:
             current_f, current_g, current = heapq.heappop(f_scores)
             # skip old entries that have already been replaced by a newer entry
             # in f_scores
             if current_g != g_scores[current]:
+                stale()
                 continue
             if current == node2:
                 break
+            expand(current, len(f_scores))
             current_h = self.vals[current[0], current[1]]
             for dx, dy, dist in deltas:
                 neighbor   = (current[0] + dx, current[1] + dy)
@@ -233,12 +392,14 @@ class GeoGrid:
                     g_scores[neighbor] = new_g
                     neighbor_f = new_g + heuristic(neighbor, node2)
                     heapq.heappush(f_scores, (neighbor_f, new_g, neighbor))
+            relaxed(len(f_scores))
 
-        if len(f_scores) == 0:
+        found = len(f_scores) > 0
+        if stats is not None:
+            stats.finish(
+                float(g_scores[node2]) if found else None,
+                heuristic(node1, node2)
+            )
+        if not found:
             return []
-        path = [(node2[0], node2[1], 0.)]
-        current = node2
-        while current != node1:
-            current = camefrom[current]
-            path.insert(0, (current[0], current[1], 0.))
-        return path
+        return self._trace_path(camefrom, node1, node2)
@@ -1,3 +1,10 @@
+import re
+import json
+from bisect import bisect_right
+from itertools import groupby
+import numpy as np
+import shapely
+
 
 class AirspaceFeature:
     SHAPE_TYPES = {'Point': 1, 'LineString': 2, 'Polygon': 3}
@@ -5,7 +12,7 @@ class AirspaceFeature:
     def __init__(self, json_dict):
         self.feature_id = json_dict['id']
         assert self.feature_id.partition('.')[0] in ['airspace', 'uaszone'], (
-            f"{feature_id} is no airspace or uaszone feature")
+            f"{self.feature_id} is no airspace or uaszone feature")
 
         properties = json_dict['properties']
         geometry   = json_dict['geometry']
@@ -24,8 +31,11 @@ class AirspaceFeature:
         limit_props = ['limit_altitude', 'limit_reference', 'limit_unit']
         lower_limit = [properties[f"lower_{prop}"] for prop in limit_props]
         upper_limit = [properties[f"upper_{prop}"] for prop in limit_props]
-        for limit in [lower_limit, upper_limit]:
-            if limit[0] != 0 and limit[2] != 'm':
+        for limit, unbounded in [(lower_limit, -np.inf), (upper_limit, np.inf)]:
+            # a missing limit does not bound the feature
+            if limit[0] is None:
+                limit[0] = unbounded
+            elif limit[0] != 0 and limit[2] != 'm':
                 limit[0] *= {'ft': 0.3048, 'F': 0.3048, 'FL': 30.48}[limit[2]]
         self.lower_limit = tuple(lower_limit[:2])
         self.upper_limit = tuple(upper_limit[:2])
@@ -33,12 +43,11 @@ class AirspaceFeature:
         shape_type = self.SHAPE_TYPES.get(geometry['type'], None)
         assert shape_type is not None, f"unknown primitive {geometry['type']}"
 
-        self.shapes = []
-        for line in geometry['coordinates']:
-            coords = []
-            for coord in line:
-                coords.append(tuple(coord))
-            self.shapes.append((shape_type, coords))
+        # each line or ring is stored as an (n, 2) array of coordinates
+        self.shapes = [
+            (shape_type, np.array(line, dtype=np.float64))
+            for line in geometry['coordinates']
+        ]
 
 
     def get_shapes(self, altitude=None):
@@ -49,21 +58,298 @@ class AirspaceFeature:
 
 
 
+def make_feature(json_dict):
+    feature_id = json_dict['id']
+    if feature_id.partition('.')[0] in ['airspace', 'uaszone']:
+        return AirspaceFeature(json_dict)
+    raise ValueError(f"unsupported feature with id {feature_id}")
+
+
+
+class LazyFeatures:
+    # sequence of features kept as their raw JSON bytes, each feature is only
+    # decoded on its first access (the raw bytes are released afterwards)
+    def __init__(self, raw_features):
+        self.items = list(raw_features)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        item = self.items[idx]
+        if isinstance(item, bytes):
+            item = self.items[idx] = make_feature(json.loads(item))
+        return item
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+
+class FeatureStream:
+    # incremental scanner for a GeoJSON feature collection, which splits the
+    # byte stream into the raw bytes of the features (members of the top-level
+    # 'features' array) and decodes all other top-level members with object or
+    # array values (e.g. 'crs'); only the bytes of the currently scanned member
+    # or feature are kept in the buffer
+    TOKENS = re.compile(rb'[{}\[\]"]')
+    STRING = re.compile(rb'(?:[^"\\]|\\.)*"', re.S)
+
+    def __init__(self):
+        self.buf       = bytearray()
+        self.pos       = 0
+        self.depth     = 0
+        self.in_string = False
+        self.str_start = 0
+        self.key       = None
+        self.member    = None
+        self.start     = 0
+        self.members   = {}
+
+
+    # consume a chunk of bytes, yields the raw bytes of all completed features
+    def feed(self, chunk):
+        buf = self.buf
+        buf += chunk
+        pos = self.pos
+        while True:
+            if self.in_string:
+                match = self.STRING.match(buf, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                self.in_string = False
+                if self.depth == 1:
+                    self.key = bytes(buf[self.str_start:pos - 1]).decode()
+                continue
+
+            match = self.TOKENS.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            pos  = match.end()
+            char = buf[match.start()]
+            if char == ord('"'):
+                self.in_string = True
+                self.str_start = pos
+            elif char in b'{[':
+                self.depth += 1
+                if self.depth == 2:
+                    self.member, self.start = self.key, match.start()
+                elif self.depth == 3 and self.member == 'features':
+                    self.start = match.start()
+            else:
+                if self.depth == 2 and self.member != 'features':
+                    self.members[self.member] = json.loads(buf[self.start:pos])
+                elif self.depth == 3 and self.member == 'features':
+                    yield bytes(buf[self.start:pos])
+                self.depth -= 1
+                assert self.depth >= 0, "unbalanced GeoJSON stream"
+
+        # drop the bytes which are no longer needed
+        if self.depth >= 3 or (self.depth == 2 and self.member != 'features'):
+            keep = self.start
+        elif self.in_string:
+            keep = self.str_start
+        else:
+            keep = pos
+        del buf[:keep]
+        self.pos        = pos - keep
+        self.start     -= keep
+        self.str_start -= keep
+
+
+
+class IntervalTree:
+    # centered interval tree over closed intervals given as tuples (lower,
+    # upper, item), a stabbing query yields the items of all intervals
+    # containing a point in O(log n + k); empty intervals (lower > upper) are
+    # dropped, since no point is contained in them
+    def __init__(self, intervals):
+        intervals = [interval for interval in intervals if interval[0] <= interval[1]]
+        ends = sorted(end for interval in intervals for end in interval[:2])
+        self.center = ends[len(ends) // 2] if ends else None
+        left, right, here = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        # the intervals containing the center, sorted by ascending lower and
+        # descending upper limit, such that a query only needs a bisection
+        by_lower = sorted(here, key=lambda interval: interval[0])
+        by_upper = sorted(here, key=lambda interval: -interval[1])
+        self.lowers       = [interval[0]  for interval in by_lower]
+        self.lower_items  = [interval[2]  for interval in by_lower]
+        self.uppers       = [-interval[1] for interval in by_upper]
+        self.upper_items  = [interval[2]  for interval in by_upper]
+
+        self.left  = IntervalTree(left)  if left  else None
+        self.right = IntervalTree(right) if right else None
+
+
+    def query(self, point):
+        node = self
+        while node is not None and node.center is not None:
+            if point < node.center:
+                yield from node.lower_items[:bisect_right(node.lowers, point)]
+                node = node.left
+            elif point > node.center:
+                yield from node.upper_items[:bisect_right(node.uppers, -point)]
+                node = node.right
+            else:
+                yield from node.lower_items
+                break
+
+
+
+class ShapeIndex:
+    # altitude (interval tree over the metre limits of the features) and
+    # spatial (R-tree over the bounding boxes of the shapes) index for the
+    # shapes of a list of features
+    def __init__(self, features):
+        self.features      = features
+        self.shapes        = []
+        self.shape_feature = []
+        self.feature_start = [0]
+        intervals = []
+        for idx, feature in enumerate(features):
+            intervals.append((feature.lower_limit[0], feature.upper_limit[0], idx))
+            self.shapes.extend(feature.shapes)
+            self.shape_feature.extend([idx] * len(feature.shapes))
+            self.feature_start.append(len(self.shapes))
+        self.shape_feature = np.array(self.shape_feature, dtype=np.intp)
+        self.altitudes     = IntervalTree(intervals)
+
+        # lower and upper limits (metres) and their references per feature
+        self.limits = np.array(
+            [interval[:2] for interval in intervals], np.float64
+        ).reshape(-1, 2)
+        self.limit_refs = [
+            (feature.lower_limit[1], feature.upper_limit[1])
+            for feature in features
+        ]
+
+        bounds = np.array([
+            (*coords.min(axis=0)[:2], *coords.max(axis=0)[:2])
+            for _, coords in self.shapes
+        ]).reshape(-1, 4)
+        self.rtree = shapely.STRtree(shapely.box(*bounds.T))
+        self.geoms = None
+
+
+    # shapely geometries of the shapes (built on first use)
+    def get_geometries(self):
+        if self.geoms is None:
+            self.geoms = np.array([
+                shapely.points(coords[0]) if shape_type == 1 else
+                shapely.linestrings(coords) if shape_type == 2 else
+                shapely.polygons(coords)
+                for shape_type, coords in self.shapes
+            ], dtype=object)
+        return self.geoms
+
+
+    # indices of the features active at the given altitude
+    def active_features(self, altitude):
+        return sorted(self.altitudes.query(altitude))
+
+
+    # indices of the shapes whose bounding box intersects the given bounding
+    # box (min_x, min_y, max_x, max_y)
+    def intersecting_shapes(self, bbox):
+        return np.sort(self.rtree.query(shapely.box(*bbox)))
+
+
+    # shapes of the features active at the given altitude (if not None) whose
+    # bounding box intersects the given bounding box (if not None), in the
+    # order of the features
+    def query(self, altitude=None, bbox=None):
+        for _, shapes in self.query_features(altitude, bbox):
+            yield from shapes
+
+
+    # like query, but yields tuples (feature index, shapes) per feature with at
+    # least one matching shape
+    def query_features(self, altitude=None, bbox=None):
+        if bbox is None:
+            features = (
+                range(len(self.feature_start) - 1) if altitude is None
+                else self.active_features(altitude)
+            )
+            for idx in features:
+                start, end = self.feature_start[idx], self.feature_start[idx + 1]
+                if end > start:
+                    yield idx, self.shapes[start:end]
+            return
+
+        shape_idxs = self.intersecting_shapes(bbox)
+        if altitude is not None:
+            active = np.zeros(len(self.feature_start) - 1, dtype=bool)
+            active[self.active_features(altitude)] = True
+            shape_idxs = shape_idxs[active[self.shape_feature[shape_idxs]]]
+        # the shapes of a feature are consecutive
+        for idx, group in groupby(shape_idxs, lambda i: self.shape_feature[i]):
+            yield int(idx), [self.shapes[i] for i in group]
+
+
+
 class GeoJSON:
     def __init__(self, json_dict):
         crs_str  = json_dict['crs']['properties']['name']
         self.crs = int(crs_str[crs_str.index('EPSG::') + 6:])
 
-        self.features = []
-        for feature in json_dict['features']:
-            feature_id = feature['id']
-            if feature_id.partition('.')[0] in ['airspace', 'uaszone']:
-                self.features.append(AirspaceFeature(feature))
-            else:
-                raise ValueError(f"unsupported feature with id {feature_id}")
+        features = json_dict['features']
+        if isinstance(features, LazyFeatures):
+            self.features = features
+        else:
+            self.features = [make_feature(feature) for feature in features]
+        self.index = None
 
 
-    def get_shapes(self, param=None):
-        for feature in self.features:
-            for shape in feature.get_shapes(param):
-                yield shape
+    # parse a GeoJSON feature collection from an iterable of byte chunks (e.g.
+    # the iter_content() of a streamed response) without building the object
+    # tree of the whole document, the features are decoded lazily
+    @staticmethod
+    def from_stream(chunks):
+        stream   = FeatureStream()
+        features = []
+        for chunk in chunks:
+            features.extend(stream.feed(chunk))
+        assert stream.depth == 0 and not stream.in_string, (
+            "truncated GeoJSON stream")
+        return GeoJSON({**stream.members, 'features': LazyFeatures(features)})
+
+
+    # the index is built on first use, it has to be reset (set to None) if the
+    # features are modified afterwards
+    def get_index(self):
+        if self.index is None:
+            self.index = ShapeIndex(self.features)
+        return self.index
+
+
+    # shapes of all features active at the given altitude (in metres, all
+    # features if None), optionally only those whose bounding box intersects
+    # the bounding box (min_x, min_y, max_x, max_y)
+    def get_shapes(self, param=None, bbox=None):
+        if param is None and bbox is None:
+            for feature in self.features:
+                yield from feature.get_shapes()
+        else:
+            yield from self.get_index().query(param, bbox)
+
+
+    # tuples (feature, shapes) of the features active at the given altitude,
+    # optionally only with the shapes whose bounding box intersects the bounding
+    # box (see get_shapes)
+    def get_feature_shapes(self, param=None, bbox=None):
+        index = self.get_index()
+        for idx, shapes in index.query_features(param, bbox):
+            yield index.features[idx], shapes
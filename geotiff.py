@@ -2,8 +2,14 @@
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = None
 
+import numpy as np
+
+from collections import OrderedDict
 import subprocess
+import tempfile
+import warnings
 import select
+import zlib
 import os
 
 class GeoTIFF:
@@ -16,9 +22,66 @@ class GeoTIFF:
     CRS_GEOGRAPHIC = 2 # geographic 2D
     CRS_GEOCENTRIC = 3 # geocentric cartesian 3D
 
-    def __init__(self, path):
+    # compression types
+    COMPRESSION_NONE     = 1
+    COMPRESSION_LZW      = 5
+    COMPRESSION_DEFLATE  = 8
+    COMPRESSION_ZIP      = 32946 # obsolete deflate code
+    COMPRESSION_PACKBITS = 32773
+
+    # predictor types
+    PREDICTOR_NONE       = 1
+    PREDICTOR_HORIZONTAL = 2
+    PREDICTOR_FLOAT      = 3
+
+    def __init__(self, path, cache_size=64):
         self.img = Image.open(path)
         assert self.img.format == 'TIFF', f"`{path}' is not a TIFF image"
+        self.size = self.img.size
+
+        # block layout (either strips or tiles) of the raster data
+        tags = self.img.tag
+        self.tiled = 322 in tags
+        if self.tiled: # TileWidth
+            self.block_size = (tags[322][0], tags[323][0]) # TileLength
+            self.block_offsets = tags[324] # TileOffsets
+            self.block_counts  = tags[325] # TileByteCounts
+        else:
+            rows = tags[278][0] if 278 in tags else self.size[1] # RowsPerStrip
+            self.block_size = (self.size[0], min(rows, self.size[1]))
+            self.block_offsets = tags[273] # StripOffsets
+            self.block_counts  = tags[279] # StripByteCounts
+        self.blocks_across = -(-self.size[0] // self.block_size[0])
+
+        # sample data type
+        assert tags.get(277, (1,))[0] == 1, ( # SamplesPerPixel
+            f"`{path}' has more than one sample per pixel")
+        with open(path, 'rb') as tif:
+            endian = '<' if tif.read(2) == b'II' else '>'
+        bits = tags[258][0]                   # BitsPerSample
+        kind = {1: 'u', 2: 'i', 3: 'f'}[tags.get(339, (1,))[0]] # SampleFormat
+        self.dtype = np.dtype(f"{endian}{kind}{bits // 8}")
+
+        self.compression = tags.get(259, (self.COMPRESSION_NONE,))[0]
+        self.predictor   = tags.get(317, (self.PREDICTOR_NONE,))[0]
+        assert self.compression in [
+            self.COMPRESSION_NONE, self.COMPRESSION_LZW,
+            self.COMPRESSION_DEFLATE, self.COMPRESSION_ZIP,
+            self.COMPRESSION_PACKBITS
+        ], f"unsupported compression {self.compression}"
+
+        # nodata value (GDAL_NODATA tag)
+        nodata = self.img.tag_v2.get(42113, None)
+        self.nodata = float(nodata.strip('\x00 ')) if nodata else None
+
+        # uncompressed data is memory-mapped, compressed blocks are decoded on
+        # demand and kept in a LRU cache
+        self.path = path
+        self.data = None
+        if self.compression == self.COMPRESSION_NONE:
+            self.data = np.memmap(path, np.uint8, 'r')
+        self.cache_size = cache_size
+        self.cache      = OrderedDict()
 
         self.tie_points = self.img.tag[33922]
         self.pix_scale  = self.img.tag[33550]
@@ -117,10 +180,167 @@ class GeoTIFF:
         raise ValueError(f"invalid tag {tag}")
 
 
+    def _read_raw(self, idx):
+        off, cnt = self.block_offsets[idx], self.block_counts[idx]
+        if self.data is not None:
+            return self.data[off:off+cnt]
+        with open(self.path, 'rb') as tif:
+            tif.seek(off)
+            return tif.read(cnt)
+
+
+    @staticmethod
+    def _lzw_decode(data):
+        # TIFF variant of LZW (MSB first bit order, early code width change)
+        table  = [bytes([val]) for val in range(256)] + [b'', b'']
+        out    = bytearray()
+        prev   = None
+        width  = 9
+        bitbuf = 0
+        bitcnt = 0
+        for byte in data:
+            bitbuf  = (bitbuf << 8) | byte
+            bitcnt += 8
+            if bitcnt < width:
+                continue
+            bitcnt -= width
+            code    = bitbuf >> bitcnt
+            bitbuf &= (1 << bitcnt) - 1
+            if code == 256: # clear code
+                del table[258:]
+                prev  = None
+                width = 9
+                continue
+            if code == 257: # end of information
+                break
+            if prev is None:
+                entry = table[code]
+            else:
+                entry = table[code] if code < len(table) else prev + prev[:1]
+                table.append(prev + entry[:1])
+            out += entry
+            prev = entry
+            if len(table) + 1 >= (1 << width) and width < 12:
+                width += 1
+        return bytes(out)
+
+
+    @staticmethod
+    def _packbits_decode(data):
+        out = bytearray()
+        pos = 0
+        while pos < len(data):
+            cnt  = data[pos]
+            pos += 1
+            if cnt < 128:
+                out += data[pos:pos+cnt+1]
+                pos += cnt + 1
+            elif cnt > 128:
+                out += data[pos:pos+1] * (257 - cnt)
+                pos += 1
+        return bytes(out)
+
+
+    def _decode_block(self, idx):
+        width, height = self.block_size
+        if not self.tiled:
+            # the last strip may be shorter than the others
+            height = min(height, self.size[1] - idx * height)
+        raw = self._read_raw(idx)
+        if self.compression == self.COMPRESSION_NONE:
+            return raw[:width * height * self.dtype.itemsize].view(
+                self.dtype
+            ).reshape(height, width)
+        if self.compression == self.COMPRESSION_LZW:
+            raw = self._lzw_decode(raw)
+        elif self.compression == self.COMPRESSION_PACKBITS:
+            raw = self._packbits_decode(raw)
+        else:
+            raw = zlib.decompress(raw)
+        raw = np.frombuffer(raw, np.uint8)[:width * height * self.dtype.itemsize]
+        if self.predictor == self.PREDICTOR_FLOAT:
+            # undo byte-wise differencing and de-interleave the byte planes,
+            # which are stored with the most significant byte first
+            raw   = raw.reshape(height, -1).cumsum(axis=1, dtype=np.uint8)
+            raw   = raw.reshape(height, self.dtype.itemsize, width)
+            block = raw.transpose(0, 2, 1).copy().view(
+                self.dtype.newbyteorder('>')
+            ).reshape(height, width)
+            return block.astype(self.dtype)
+        block = raw.view(self.dtype).reshape(height, width)
+        if self.predictor == self.PREDICTOR_HORIZONTAL:
+            block = block.cumsum(axis=1, dtype=self.dtype)
+        return block
+
+
+    def read_block(self, idx):
+        if self.data is not None:
+            return self._decode_block(idx)
+        block = self.cache.get(idx, None)
+        if block is None:
+            block = self._decode_block(idx)
+            self.cache[idx] = block
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(idx)
+        return block
+
+
+    def read_window(self, x, y, width, height, fill=None):
+        if fill is None:
+            fill = self.nodata if self.nodata is not None else 0
+        window = np.full((height, width), fill, self.dtype)
+        # intersect the window with the raster
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.size[0]), min(y + height, self.size[1])
+        bw, bh = self.block_size
+        for by in range(y0 // bh, -(-y1 // bh)):
+            for bx in range(x0 // bw, -(-x1 // bw)):
+                block = self.read_block(by * self.blocks_across + bx)
+                # overlap of block and window in raster coordinates
+                ox0, oy0 = max(x0, bx * bw), max(y0, by * bh)
+                ox1 = min(x1, bx * bw + block.shape[1])
+                oy1 = min(y1, by * bh + block.shape[0])
+                window[oy0-y:oy1-y, ox0-x:ox1-x] = block[
+                    oy0-by*bh:oy1-by*bh, ox0-bx*bw:ox1-bx*bw
+                ]
+        return window
+
+
+    def read_pixels(self, cols, rows, fill=None):
+        if fill is None:
+            fill = self.nodata if self.nodata is not None else 0
+        shape  = np.shape(cols)
+        cols   = np.asarray(cols, np.int64).ravel()
+        rows   = np.asarray(rows, np.int64).ravel()
+        pixels = np.full(cols.shape, fill, self.dtype)
+        valid  = (
+            (cols >= 0) & (cols < self.size[0]) &
+            (rows >= 0) & (rows < self.size[1])
+        )
+        # group the pixels by block, such that each block is read only once
+        bw, bh  = self.block_size
+        indices = np.flatnonzero(valid)
+        blocks  = (rows[indices] // bh) * self.blocks_across + cols[indices] // bw
+        order   = np.argsort(blocks, kind='stable')
+        indices, blocks = indices[order], blocks[order]
+        starts  = np.flatnonzero(np.diff(blocks, prepend=-1))
+        for start, end in zip(starts, list(starts[1:]) + [len(indices)]):
+            group = indices[start:end]
+            bx    = int(blocks[start] % self.blocks_across)
+            by    = int(blocks[start] // self.blocks_across)
+            block = self.read_block(int(blocks[start]))
+            pixels[group] = block[rows[group] - by * bh, cols[group] - bx * bw]
+        return pixels.reshape(shape)
+
+
     @staticmethod
     def _cs2cs(args, coords):
         command = ' | '.join('cs2cs -f %.12f ' + arg for arg in args)
-        stdout_tmp = open('cs2cs_buf', 'w')
+        # buffer the output in an anonymous temporary file, such that several
+        # conversions can run concurrently (e.g., in worker processes)
+        stdout_tmp = tempfile.TemporaryFile()
         proc = subprocess.Popen(
             command, stdin=subprocess.PIPE, stdout=stdout_tmp, shell=True
         )
@@ -137,17 +357,12 @@ class GeoTIFF:
                 else:
                     proc.stdin.close()
                     stdin_open = False
-        stdout_tmp.close()
-        stdout_tmp = open('cs2cs_buf', 'rb')
+        proc.wait()
+        stdout_tmp.seek(0)
         stdout_buf = stdout_tmp.read()
         stdout_tmp.close()
-        while len(stdout_buf) > 0:
-            # yield available results
-            pos = stdout_buf.find(b'\n')
-            if pos >= 0:
-                line = stdout_buf[0:pos].decode()
-                yield tuple(float(val) for val in line.split())
-                stdout_buf = stdout_buf[pos+1:]
+        for line in stdout_buf.splitlines():
+            yield tuple(float(val) for val in line.split())
 
 
     def crs_to_model(self, code, coords):
@@ -202,6 +417,75 @@ class GeoTIFF:
             )
 
 
+    def model_to_raster_array(self, coords):
+        # continuous raster coordinates of an array of model coordinates, the
+        # integer part of each coordinate is the index of the enclosing pixel
+        coords = np.asarray(coords, np.float64).reshape(-1, 2)
+        off    = 0.5 if self.raster_type == self.RASTER_POINT else 0.
+        return np.stack((
+            (coords[:, 0] - self.tie_points[3]) / self.pix_scale[0] + off,
+            (self.tie_points[4] - coords[:, 1]) / self.pix_scale[1] + off
+        ), axis=-1)
+
+
+    def _read_values(self, cols, rows):
+        # read pixels as floats, with NaN for nodata and pixels outside
+        vals    = self.read_pixels(cols, rows).astype(np.float64)
+        invalid = (cols < 0) | (cols >= self.size[0]) | (rows < 0) | (rows >= self.size[1])
+        if self.nodata is not None:
+            invalid |= vals == self.nodata
+        vals[invalid] = np.nan
+        return vals
+
+
+    def sample(self, cols, rows, mode='nearest', footprint=1., chunk=1 << 20):
+        cols = np.asarray(cols, np.float64)
+        rows = np.asarray(rows, np.float64)
+        if mode == 'nearest':
+            return self._read_values(
+                np.floor(cols).astype(np.int64), np.floor(rows).astype(np.int64)
+            )
+        if mode == 'bilinear':
+            # interpolate between the centers of the four surrounding pixels,
+            # nodata pixels are excluded by renormalizing the weights
+            cols, rows = cols - 0.5, rows - 0.5
+            col0, row0 = np.floor(cols), np.floor(rows)
+            fcol, frow = cols - col0, rows - row0
+            col0, row0 = col0.astype(np.int64), row0.astype(np.int64)
+            total = np.zeros(cols.shape)
+            wsum  = np.zeros(cols.shape)
+            for dcol, drow, wgt in [
+                (0, 0, (1. - fcol) * (1. - frow)), (1, 0, fcol * (1. - frow)),
+                (0, 1, (1. - fcol) * frow       ), (1, 1, fcol * frow       )
+            ]:
+                vals   = self._read_values(col0 + dcol, row0 + drow)
+                valid  = ~np.isnan(vals)
+                total += np.where(valid, vals * wgt, 0.)
+                wsum  += np.where(valid, wgt, 0.)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(wsum > 0., total / wsum, np.nan)
+        # aggregate a block of footprint x footprint pixels centered on each
+        # coordinate, in chunks of a bounded number of pixels
+        agg = {'min': np.nanmin, 'max': np.nanmax, 'mean': np.nanmean}[mode]
+        size   = max(1, int(round(footprint)))
+        offs   = np.arange(size)
+        col0   = np.floor(cols - size / 2. + 0.5).astype(np.int64).ravel()
+        row0   = np.floor(rows - size / 2. + 0.5).astype(np.int64).ravel()
+        result = np.empty(col0.shape)
+        step   = max(1, chunk // (size * size))
+        for start in range(0, col0.size, step):
+            end  = min(start + step, col0.size)
+            bcol = col0[start:end, None, None] + offs[None, None, :]
+            brow = row0[start:end, None, None] + offs[None, :, None]
+            bcol, brow = np.broadcast_arrays(bcol, brow)
+            vals = self._read_values(bcol, brow)
+            with warnings.catch_warnings():
+                # blocks without any valid pixel result in NaN
+                warnings.simplefilter('ignore', RuntimeWarning)
+                result[start:end] = agg(vals, axis=(1, 2))
+        return result.reshape(cols.shape)
+
+
     def crs_to_raster(self, code, coords):
         return self.model_to_raster(self.crs_to_model(code, coords))
 
@@ -0,0 +1,297 @@
+import numpy as np
+import multiprocessing
+import contextlib
+import hashlib
+import logging
+import queue
+import json
+import os
+
+from geotiff import GeoTIFF
+from geogrid import GeoGrid
+
+logger = logging.getLogger(__name__)
+
+# state of the worker processes (the elevation model is opened once per worker
+# and the node values are shared with the parent process)
+_worker = {}
+
+def _init_worker(dem_path, grid_vals, grid_size):
+    _worker['dem'] = GeoTIFF(dem_path)
+    if isinstance(grid_vals, str):
+        # node values are stored in a memory-mapped file
+        _worker['vals'] = np.load(grid_vals, mmap_mode='r+')
+    else:
+        _worker['vals'] = np.frombuffer(grid_vals, np.float32).reshape(grid_size)
+
+
+# strip task for a pool of generic workers, which are (re-)initialized if the
+# task belongs to another call of init_topo_grid than their previous task
+def _sample_strip_with(task):
+    config, token, strip = task
+    if _worker.get('token') != token:
+        _init_worker(*config)
+        _worker['token'] = token
+    return _sample_strip(strip)
+
+
+# sample the elevation model for all nodes in the rows y0 to y1 of the grid
+def _sample_strip(task):
+    y0, y1, scale, orig, crs, sampling, footprint = task
+    dem, vals = _worker['dem'], _worker['vals']
+    # get coordinates of each node of the strip w.r.t. grid CSR
+    xs, ys = np.meshgrid(
+        np.arange(vals.shape[0]), np.arange(y0, y1), indexing='ij'
+    )
+    node_coords = np.stack((
+        orig[0] + xs.ravel() * scale, orig[1] - ys.ravel() * scale
+    ), axis=-1)
+    # convert node coordinates from grid CSR to elevation model raster
+    model_coords  = list(dem.crs_to_model(crs, node_coords))
+    raster_coords = dem.model_to_raster_array(model_coords)
+    # sample the elevation model at all nodes of the strip at once; nodes
+    # outside of the model or on nodata pixels remain invalid
+    alts = dem.sample(
+        raster_coords[:, 0], raster_coords[:, 1], sampling, footprint
+    ).reshape(vals.shape[0], y1 - y0)
+    valid = ~np.isnan(alts)
+    vals[:, y0:y1][valid] = alts[valid]
+    return y1 - y0
+
+
+# initialize a grid graph with altitudes from a digital elevation model; the
+# grid is processed in horizontal strips of about strip_nodes nodes by a pool
+# of worker processes that write directly to the shared node values (or to the
+# memory-mapped *.npy file out), the aggregating sampling modes use all DEM
+# pixels within a grid cell of the given resolution
+#
+# instead of starting its own pool, an existing pool (without initializer) can
+# be used, e.g., one that was started before the calling process started other
+# threads (forking a multi-threaded process may deadlock the workers) and that
+# is shared with other work; its workers write to the file out, as shared memory
+# can only be passed to workers when they are started, and at most two strips
+# per worker are queued at a time, such that other tasks are not starved
+def init_topo_grid(grid_size, grid_scale, grid_orig, grid_crs, dem_path,
+                   sampling='nearest', resolution=None, processes=None,
+                   strip_nodes=1 << 18, out=None, pool=None):
+    assert pool is None or out is not None, (
+        "a shared pool requires an output file")
+    dem = GeoTIFF(dem_path)
+    footprint = 1. if resolution is None else resolution / dem.pix_scale[0]
+
+    # create the node values in shared memory
+    if out is None:
+        shared = multiprocessing.RawArray('f', grid_size[0] * grid_size[1])
+        vals   = np.frombuffer(shared, np.float32).reshape(grid_size)
+    else:
+        shared = out
+        vals   = np.lib.format.open_memmap(out, 'w+', np.float32, grid_size)
+    vals[:] = -1.
+    if out is not None:
+        vals.flush()
+    grid = GeoGrid(grid_size, grid_scale, grid_orig, vals)
+
+    rows  = max(1, strip_nodes // grid.size[0])
+    tasks = [
+        (y, min(y + rows, grid.size[1]), grid.scale, grid.orig, grid_crs,
+         sampling, footprint) for y in range(0, grid.size[1], rows)
+    ]
+    if pool is None:
+        strips = multiprocessing.Pool(
+            processes, _init_worker, (dem_path, shared, grid.size)
+        )
+    else:
+        strips = contextlib.nullcontext(pool)
+    with strips as strip_pool:
+        if pool is None:
+            results = strip_pool.imap_unordered(_sample_strip, tasks)
+        else:
+            config  = (dem_path, shared, tuple(grid.size))
+            token   = os.urandom(8)
+            results = _bounded_map(strip_pool, _sample_strip_with, [
+                (config, token, task) for task in tasks
+            ], 2 * (processes or os.cpu_count()))
+        done = 0
+        for cnt, strip_rows in enumerate(results):
+            done += strip_rows
+            logger.info(
+                f"initialized strip {cnt + 1} of {len(tasks)} "
+                f"({100. * done / grid.size[1]:.1f} %)"
+            )
+    if out is not None:
+        grid.vals.flush()
+    return grid
+
+
+# results of the tasks in the order of completion, with at most max_pending
+# tasks submitted to the pool at a time
+def _bounded_map(pool, func, tasks, max_pending):
+    results, done = [], queue.Queue()
+    for idx, task in enumerate(tasks):
+        if idx >= max_pending:
+            yield results[done.get()].get()
+        notify = lambda _, idx=idx: done.put(idx)
+        results.append(pool.apply_async(
+            func, (task,), callback=notify, error_callback=notify
+        ))
+    for _ in range(min(len(results), max_pending)):
+        yield results[done.get()].get()
+
+
+# grid resolutions (in meters) of the levels of a DEM pyramid
+PYRAMID_LEVELS = [10, 20, 50, 100, 200, 400]
+
+# aggregation modes of the DEM pyramid
+PYRAMID_MODES = ['max', 'mean']
+
+
+def file_hash(path, chunk=1 << 24):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as src:
+        for data in iter(lambda: src.read(chunk), b''):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+# hash of a (large) file, which is only recomputed when its size or modification
+# time changes; the hashes are stored in hashes.json in the index directory,
+# which is replaced atomically (an interrupted write never corrupts the index)
+def cached_file_hash(path, index_dir):
+    stat  = os.stat(path)
+    key   = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    index = os.path.join(index_dir, 'hashes.json')
+    os.makedirs(index_dir, exist_ok=True)
+    hashes = {}
+    if os.path.exists(index):
+        with open(index) as src:
+            hashes = json.load(src)
+    if key not in hashes:
+        hashes[key] = file_hash(path)
+        tmp_index = f"{index}.{os.getpid()}.tmp"
+        with open(tmp_index, 'w') as dst:
+            json.dump(hashes, dst, indent=2)
+        os.replace(tmp_index, index)
+    return hashes[key]
+
+
+# pyramid of grids at several resolutions sampled once from a digital elevation
+# model; each level is stored as *.npy file in a directory named after the hash
+# of the elevation model, such that grids can be loaded as memory-mapped arrays
+# without any coordinate transformation
+class DEMPyramid:
+    def __init__(self, path, dem_path, grid_orig, grid_end, distortion,
+                 grid_crs=3857, levels=PYRAMID_LEVELS):
+        assert all(level % levels[0] == 0 for level in levels), (
+            "pyramid levels must be multiples of the base level")
+        self.dem_path   = dem_path
+        self.grid_orig  = grid_orig
+        self.grid_end   = grid_end
+        self.distortion = distortion
+        self.grid_crs   = grid_crs
+        self.levels     = levels
+        self.path       = os.path.join(path, self._dem_hash(path)[:16])
+        self.params     = {
+            'orig': list(grid_orig), 'end': list(grid_end),
+            'distortion': distortion, 'crs': grid_crs, 'levels': levels
+        }
+
+
+    def _dem_hash(self, path):
+        return cached_file_hash(self.dem_path, path)
+
+
+    def grid_size(self, resolution):
+        scale = self.distortion * resolution
+        return scale, (
+            int((self.grid_end[0] - self.grid_orig[0]) / scale),
+            int((self.grid_orig[1] - self.grid_end[1]) / scale)
+        )
+
+
+    def _level_path(self, resolution, mode):
+        if resolution == self.levels[0]:
+            return os.path.join(self.path, f"{resolution}.npy")
+        return os.path.join(self.path, f"{mode}_{resolution}.npy")
+
+
+    def is_complete(self):
+        meta = os.path.join(self.path, 'pyramid.json')
+        if not os.path.exists(meta):
+            return False
+        with open(meta) as src:
+            if json.load(src) != self.params:
+                return False
+        return all(
+            os.path.exists(self._level_path(level, mode))
+            for level in self.levels for mode in PYRAMID_MODES
+        )
+
+
+    @staticmethod
+    def _aggregate(src, dst, factor, mode, chunk_nodes=1 << 24):
+        # aggregate blocks of factor x factor nodes of src centered on each node
+        # of dst, invalid nodes of src are ignored
+        half = factor // 2
+        rows = max(1, chunk_nodes // (src.shape[1] * factor))
+        for x0 in range(0, dst.shape[0], rows):
+            x1 = min(x0 + rows, dst.shape[0])
+            # read the source window padded with invalid nodes
+            block = np.full(
+                ((x1 - x0) * factor, dst.shape[1] * factor), -1., np.float32
+            )
+            sx0, sx1 = x0 * factor - half, x1 * factor - half
+            sy0, sy1 = -half, dst.shape[1] * factor - half
+            cx0, cx1 = max(sx0, 0), min(sx1, src.shape[0])
+            cy0, cy1 = max(sy0, 0), min(sy1, src.shape[1])
+            block[cx0-sx0:cx1-sx0, cy0-sy0:cy1-sy0] = src[cx0:cx1, cy0:cy1]
+            block = block.reshape(x1 - x0, factor, dst.shape[1], factor)
+            valid = block >= 0.
+            if mode == 'max':
+                dst[x0:x1] = np.where(valid, block, -1.).max(axis=(1, 3))
+            else:
+                total = np.where(valid, block, 0.).sum(axis=(1, 3))
+                count = valid.sum(axis=(1, 3))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    dst[x0:x1] = np.where(count > 0, total / count, -1.)
+
+
+    # build the pyramid with a pool of worker processes of its own or an existing
+    # pool (see init_topo_grid)
+    def build(self, processes=None, pool=None):
+        os.makedirs(self.path, exist_ok=True)
+        # sample the base level from the elevation model (the grid cells of the
+        # base level match the DEM pixels, hence no aggregation is required)
+        base_res   = self.levels[0]
+        scale, size = self.grid_size(base_res)
+        base_path  = self._level_path(base_res, None)
+        logger.info(f"sampling pyramid base level {base_res} m of size {size}")
+        init_topo_grid(
+            size, scale, self.grid_orig, self.grid_crs, self.dem_path,
+            'nearest', None, processes, out=base_path, pool=pool
+        )
+        base = np.load(base_path, mmap_mode='r')
+        # aggregate the remaining levels from the base level
+        for level in self.levels[1:]:
+            for mode in PYRAMID_MODES:
+                logger.info(f"aggregating pyramid level {level} m ({mode})")
+                dst = np.lib.format.open_memmap(
+                    self._level_path(level, mode), 'w+', np.float32,
+                    self.grid_size(level)[1]
+                )
+                self._aggregate(base, dst, level // base_res, mode)
+                dst.flush()
+                del dst
+        with open(os.path.join(self.path, 'pyramid.json'), 'w') as dst:
+            json.dump(self.params, dst, indent=2)
+
+
+    # load the grid of one pyramid level; the node values are memory-mapped
+    # copy-on-write, such that the grid can be modified without altering the
+    # pyramid
+    def load_grid(self, resolution, mode='max'):
+        assert resolution in self.levels, (
+            f"resolution {resolution} is no pyramid level")
+        assert mode in PYRAMID_MODES, f"invalid pyramid mode {mode}"
+        scale, size = self.grid_size(resolution)
+        vals = np.load(self._level_path(resolution, mode), mmap_mode='c')
+        return GeoGrid(size, scale, self.grid_orig, vals)
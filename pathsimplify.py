@@ -0,0 +1,124 @@
+import heapq
+import math
+import numpy as np
+
+
+# cross products of arrays of 3D vectors (np.cross has a large overhead for the
+# many small batches processed here)
+def _cross(u, v):
+    return np.stack((
+        u[..., 1] * v[..., 2] - u[..., 2] * v[..., 1],
+        u[..., 2] * v[..., 0] - u[..., 0] * v[..., 2],
+        u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+    ), axis=-1)
+
+
+# distances of the points (m, 3) to the line through start and end (points on
+# a degenerated line of zero length are measured to its start)
+def _line_distances(points, start, end):
+    line     = end - start
+    line_len = np.sqrt(np.dot(line, line))
+    if line_len == 0.:
+        return np.sqrt(((points - start)**2).sum(axis=1))
+    cross = _cross(line, start - points)
+    return np.sqrt((cross**2).sum(axis=1)) / line_len
+
+
+# Ramer-Douglas-Peucker simplification of an (n, 3) array of points with an
+# explicit stack; returns the sorted indices of the retained points
+def rdp(points, epsilon):
+    points = np.asarray(points, np.float64)
+    n      = len(points)
+    keep   = np.zeros(n, dtype=bool)
+    keep[[0, -1] if n else []] = True
+    stack  = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dists = _line_distances(points[first+1:last], points[first], points[last])
+        idx   = int(np.argmax(dists))
+        if dists[idx] > epsilon:
+            mid = first + 1 + idx
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return np.flatnonzero(keep)
+
+
+# areas of the triangles (a, b, c) for arrays of points (m, 3)
+def _triangle_areas(a, b, c):
+    cross = _cross(b - a, c - a)
+    return 0.5 * np.sqrt((cross**2).sum(axis=-1))
+
+
+# area of a single triangle (a, b, c) of point tuples
+def _triangle_area(a, b, c):
+    ux, uy, uz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    vx, vy, vz = c[0] - a[0], c[1] - a[1], c[2] - a[2]
+    return 0.5 * math.sqrt(
+        (uy * vz - uz * vy)**2 + (uz * vx - ux * vz)**2 + (ux * vy - uy * vx)**2
+    )
+
+
+# Visvalingam-Whyatt simplification of an (n, 3) array of points down to the
+# given number of points (at least the start and end point are retained) by
+# repeatedly removing the point spanning the smallest triangle with its
+# neighbours; returns the sorted indices of the retained points
+def visvalingam(points, count):
+    points = np.asarray(points, np.float64)
+    n      = len(points)
+    count  = max(count, min(n, 2))
+    if n <= count:
+        return np.arange(n)
+
+    # the linked list and the areas are kept as Python lists, since they are
+    # updated element by element
+    prev  = list(range(-1, n - 1))
+    next_ = list(range(1, n + 1))
+    areas = [math.inf] * n
+    areas[1:-1] = _triangle_areas(points[:-2], points[1:-1], points[2:]).tolist()
+    heap  = [(area, idx) for idx, area in enumerate(areas[1:-1], 1)]
+    heapq.heapify(heap)
+    coords    = points.tolist()
+    keep      = np.ones(n, dtype=bool)
+    remaining = n
+    while remaining > count:
+        area, idx = heapq.heappop(heap)
+        if not keep[idx] or area != areas[idx]:
+            continue # stale entry
+        keep[idx] = False
+        remaining -= 1
+        before, after = prev[idx], next_[idx]
+        next_[before], prev[after] = after, before
+        # update the triangles of the neighbours (except start and end)
+        for node in [before, after]:
+            if 0 < node < n - 1:
+                areas[node] = _triangle_area(
+                    coords[prev[node]], coords[node], coords[next_[node]]
+                )
+                heapq.heappush(heap, (areas[node], node))
+    return np.flatnonzero(keep)
+
+
+# simplify a path of grid nodes (x, y, z) with altitude offsets z above the grid
+# values; the altitudes (grid value + z) are multiplied by z_scale in order to
+# lower the threshold for retaining points with deviating heights, either with
+# RDP (distance threshold epsilon in grid units) or Visvalingam-Whyatt (fixed
+# number of points); returns the retained nodes of the path
+def simplify_path(grid, path, epsilon=1., z_scale=1., count=None):
+    if len(path) == 0:
+        return []
+    nodes  = np.asarray(path, np.float64).reshape(len(path), -1)
+    xy     = nodes[:, :2].astype(np.intp)
+    points = np.empty((len(nodes), 3))
+    points[:, :2] = nodes[:, :2]
+    points[:, 2]  = grid.vals[xy[:, 0], xy[:, 1]]
+    if nodes.shape[1] > 2:
+        points[:, 2] += nodes[:, 2]
+    points[:, 2] *= z_scale
+    if count is None:
+        keep = rdp(points, epsilon)
+    else:
+        keep = visvalingam(points, count)
+    return [path[idx] for idx in keep]
@@ -0,0 +1,265 @@
+import concurrent.futures
+import numpy as np
+import hashlib
+import logging
+import pickle
+import json
+import time
+import os
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# artifact formats of the stages: NumPy arrays (loaded memory-mapped read-only),
+# pickled Python objects, lists of output files (valid only while all files
+# exist) and uncached results (e.g., access tokens), which are recomputed
+# whenever a dependent stage is executed
+ARTIFACT_FORMATS = ('npy', 'pickle', 'files', None)
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), params=None, fmt='pickle', io=False):
+        assert fmt in ARTIFACT_FORMATS, f"invalid artifact format {fmt}"
+        self.name   = name
+        self.func   = func
+        self.deps   = tuple(deps)
+        self.params = params if params is not None else {}
+        self.fmt    = fmt
+        self.io     = io
+
+
+# directed acyclic graph of stages; a stage is a function called with the
+# results of its dependencies (in the given order), whose result (artifact) is
+# stored in cache_dir under the hash of the stage parameters and the hashes of
+# its dependencies, i.e., an artifact is invalidated by any change of the
+# parameters of the stage or of a stage it (indirectly) depends on; run()
+# executes only the stages with missing artifacts, independent stages run
+# concurrently in a pool of threads (CPU-heavy stages are expected to use
+# worker processes or release the GIL); I/O-bound stages (e.g., downloads) run
+# in a separate pool and are started before CPU stages, such that they are
+# neither delayed by nor count against the max_workers CPU stages
+#
+# a parameter may be deferred, i.e., given as function that is only called by
+# run() (e.g., the hash of a large input file); the keys of the stage and of
+# all stages depending on it are unknown until then, the other stages are
+# planned and started while the deferred parameters are resolved in the I/O
+# pool
+class Pipeline:
+    def __init__(self, cache_dir, max_workers=None, io_workers=None):
+        self.cache_dir   = cache_dir
+        self.max_workers = max_workers
+        self.io_workers  = io_workers
+        self.stages      = {}
+        self.keys        = {}
+
+
+    def add(self, name, func, deps=(), params=None, fmt='pickle', io=False):
+        assert name not in self.stages, f"duplicate stage {name}"
+        for dep in deps:
+            assert dep in self.stages, f"unknown dependency {dep} of {name}"
+        stage = Stage(name, func, deps, params, fmt, io)
+        self.stages[name] = stage
+        self.keys[name]   = self._key(name)
+        return stage
+
+
+    # key of a stage (None while it has deferred parameters or depends on a
+    # stage with deferred parameters)
+    def _key(self, name):
+        stage = self.stages[name]
+        deps  = [self.keys[dep] for dep in stage.deps]
+        if None in deps or any(callable(v) for v in stage.params.values()):
+            return None
+        return hashlib.sha256(json.dumps({
+            'stage':  name,
+            'params': stage.params,
+            'deps':   deps,
+            'fmt':    stage.fmt
+        }, sort_keys=True).encode()).hexdigest()
+
+
+    # call the deferred parameters and compute the keys of the stages
+    def _resolve(self):
+        for name, stage in self.stages.items():
+            if self.keys[name] is None:
+                stage.params = {
+                    param: value() if callable(value) else value
+                    for param, value in stage.params.items()
+                }
+                self.keys[name] = self._key(name)
+
+
+    def artifact_path(self, name):
+        ext = {'npy': 'npy', 'pickle': 'pkl', 'files': 'json'}[self.stages[name].fmt]
+        return os.path.join(self.cache_dir, name, f"{self.keys[name][:16]}.{ext}")
+
+
+    def is_valid(self, name):
+        stage = self.stages[name]
+        if stage.fmt is None:
+            return False
+        path = self.artifact_path(name)
+        if not os.path.exists(path):
+            return False
+        if stage.fmt == 'files':
+            with open(path) as src:
+                return all(os.path.exists(out) for out in json.load(src))
+        return True
+
+
+    def _load(self, name):
+        path = self.artifact_path(name)
+        fmt  = self.stages[name].fmt
+        if fmt == 'npy':
+            return np.load(path, mmap_mode='r')
+        with open(path, 'rb') as src:
+            return pickle.load(src) if fmt == 'pickle' else json.load(src)
+
+
+    # store an artifact atomically (a partially written file of an interrupted
+    # run is never taken for a valid artifact); NumPy artifacts are reloaded
+    # memory-mapped, such that results of all stages are handled alike; instead
+    # of an array, a stage may return the path of a *.npy file it has written
+    # (e.g., a memory-mapped grid), which is moved to the artifact path
+    def _store(self, name, result):
+        fmt = self.stages[name].fmt
+        if fmt is None:
+            return result
+        path = self.artifact_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if fmt == 'npy' and isinstance(result, str):
+            os.replace(result, path)
+            return self._load(name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as dst:
+            if fmt == 'npy':
+                np.save(dst, result)
+            elif fmt == 'pickle':
+                pickle.dump(result, dst, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                dst.write(json.dumps(list(result)).encode())
+        os.replace(tmp_path, path)
+        return self._load(name) if fmt == 'npy' else result
+
+
+    # stages to execute and stages to load for the targets (default all cached
+    # stages): a stage is executed if its artifact is missing, invalid or
+    # forced, which requires the results of all its dependencies; a valid artifact is
+    # only loaded if it is required by an executed stage or an explicit target;
+    # forcing a stage forces all stages depending on it; stages with unknown
+    # keys (deferred parameters) are not planned
+    def plan(self, targets=None, force=()):
+        forced = set(force)
+        for name in forced:
+            assert name in self.stages, f"unknown stage {name}"
+        for name, stage in self.stages.items():
+            if any(dep in forced for dep in stage.deps):
+                forced.add(name)
+
+        execute, load = set(), set()
+        def visit(name, required):
+            if self.keys[name] is None:
+                return
+            if name in execute or (name in load and required):
+                return
+            if name not in forced and self.is_valid(name):
+                if required:
+                    load.add(name)
+                return
+            execute.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep, True)
+        if targets is None:
+            for name, stage in self.stages.items():
+                if stage.fmt is not None:
+                    visit(name, False)
+        else:
+            for name in targets:
+                assert name in self.stages, f"unknown stage {name}"
+                visit(name, True)
+        return execute, load
+
+
+    def _execute(self, name, results):
+        stage = self.stages[name]
+        start = time.perf_counter()
+        with telemetry.span(f"stage {name}", key=self.keys[name][:16],
+                            io=stage.io):
+            result = stage.func(*(results[dep] for dep in stage.deps))
+            result = self._store(name, result)
+        return result, time.perf_counter() - start
+
+
+    # run the targets (default all cached stages), returns a dict of the results
+    # of the executed and loaded stages; artifacts of completed stages are kept
+    # if a stage fails, such that a rerun resumes with the failed stage
+    def run(self, targets=None, force=()):
+        results, pending, running, planned = {}, [], {}, set()
+        start, busy, executed = time.perf_counter(), 0., 0
+
+        # add the stages of the current plan, which were not planned before, and
+        # load the required artifacts; I/O stages first, otherwise in the order
+        # of the stages
+        def schedule():
+            execute, load = self.plan(targets, force)
+            for name, stage in self.stages.items():
+                if name in load and name not in results:
+                    with telemetry.span(f"load {name}"):
+                        results[name] = self._load(name)
+                if name in planned:
+                    continue
+                if name in execute:
+                    planned.add(name)
+                    pending.append(name)
+                    logger.info(f"stage {name}: scheduled")
+                elif stage.fmt is not None and self.keys[name] is not None:
+                    planned.add(name)
+                    logger.info(f"stage {name}: cached ({self.keys[name][:16]})")
+            pending.sort(key=lambda name: not self.stages[name].io)
+
+        deferred = [name for name in self.stages if self.keys[name] is None]
+        num_io   = sum(stage.io for stage in self.stages.values())
+        with concurrent.futures.ThreadPoolExecutor(
+            self.max_workers or max(len(self.stages) - num_io, 1)
+        ) as cpu_executor, concurrent.futures.ThreadPoolExecutor(
+            self.io_workers or max(num_io, 1) + bool(deferred)
+        ) as io_executor:
+            try:
+                schedule()
+                if deferred:
+                    running[io_executor.submit(self._resolve)] = None
+                while pending or running:
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if all(dep in results for dep in stage.deps):
+                            pending.remove(name)
+                            executor = io_executor if stage.io else cpu_executor
+                            running[executor.submit(
+                                self._execute, name, results
+                            )] = name
+                    done, _ = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        name = running.pop(future)
+                        if name is None:
+                            # deferred parameters resolved, plan the rest
+                            future.result()
+                            schedule()
+                            continue
+                        results[name], duration = future.result()
+                        busy     += duration
+                        executed += 1
+                        logger.info(f"stage {name}: done ({duration:.1f} s)")
+            except BaseException:
+                # no further stages are started, running stages are awaited
+                for future in running:
+                    future.cancel()
+                raise
+        if executed:
+            logger.info(
+                f"executed {executed} stages in "
+                f"{time.perf_counter() - start:.1f} s (sum of stage durations {busy:.1f} s)"
+            )
+        return results
@@ -0,0 +1,75 @@
+import numpy as np
+import shapely
+from collections import namedtuple
+
+# altitude references relative to the terrain, all others (MSL, STD, W84) are
+# treated as altitudes above mean sea level
+GROUND_REFS = ['GND', 'SFC', 'AGL']
+
+Violation = namedtuple('Violation', ['feature', 'segments'])
+
+
+# check a path (sequence of grid nodes (x, y, z) with the altitude offset z as
+# returned by find_path) against the features of a GeoJSON snapshot, where the
+# flight altitude above ground at a node is flight_height + z; a segment
+# violates a feature if it crosses one of its shapes (grown by the margin in
+# map units) and its altitude range overlaps the limits of the feature (missing
+# limits do not bound a feature); all nodes must be within the grid
+#
+# returns a list of violations (feature, array of segment indices) in the order
+# of the features, segment i connects the nodes i and i + 1 of the path
+def check_route(grid, path, geojson, flight_height=110., margin=0.):
+    path = np.asarray(path, np.float64)
+    path = path.reshape(len(path), -1)
+    assert len(path) >= 2, "path must have at least two nodes"
+
+    # flight altitudes above ground and mean sea level at the nodes
+    nodes   = path[:, :2].astype(np.intp)
+    assert np.all((nodes >= 0) & (nodes < grid.size)), (
+        "path leaves the grid (no terrain altitude outside of the grid)")
+    offsets = path[:, 2] if path.shape[1] > 2 else np.zeros(len(path))
+    alt_agl = flight_height + offsets
+    alt_msl = grid.vals[nodes[:, 0], nodes[:, 1]].astype(np.float64) + alt_agl
+
+    # candidate pairs of segments and shapes from the bounding box index,
+    # followed by the exact (vectorized) intersection tests
+    coords   = grid.grid_to_coords(path[:, :2])
+    segments = shapely.linestrings(np.stack((coords[:-1], coords[1:]), axis=1))
+    bounds   = shapely.bounds(segments) + np.array([-1., -1., 1., 1.]) * margin
+    index    = geojson.get_index()
+    seg_idxs, shape_idxs = index.rtree.query(shapely.box(*bounds.T))
+    if len(seg_idxs) == 0:
+        return []
+    geoms = index.get_geometries()[shape_idxs]
+    if margin > 0.:
+        hits = shapely.dwithin(segments[seg_idxs], geoms, margin)
+    else:
+        hits = shapely.intersects(segments[seg_idxs], geoms)
+    seg_idxs, feature_idxs = seg_idxs[hits], index.shape_feature[shape_idxs[hits]]
+
+    # altitude ranges of the segments in the reference of each limit
+    ground_refs = np.array([
+        (lower_ref in GROUND_REFS, upper_ref in GROUND_REFS)
+        for lower_ref, upper_ref in index.limit_refs
+    ], dtype=bool).reshape(-1, 2)
+    ranges = {}
+    for ground, alts in [(True, alt_agl), (False, alt_msl)]:
+        ranges[ground] = (
+            np.minimum(alts[:-1], alts[1:])[seg_idxs],
+            np.maximum(alts[:-1], alts[1:])[seg_idxs]
+        )
+    lower_ground = ground_refs[feature_idxs, 0]
+    upper_ground = ground_refs[feature_idxs, 1]
+    seg_top = np.where(lower_ground, ranges[True][1], ranges[False][1])
+    seg_bot = np.where(upper_ground, ranges[True][0], ranges[False][0])
+    lower, upper = index.limits[feature_idxs].T
+    hits = (seg_top >= lower) & (seg_bot <= upper)
+
+    # unique violated segments grouped by feature
+    keys = np.unique(feature_idxs[hits] * len(segments) + seg_idxs[hits])
+    feature_idxs, seg_idxs = np.divmod(keys, len(segments))
+    splits = np.flatnonzero(np.diff(feature_idxs)) + 1
+    return [
+        Violation(index.features[feature_idxs[segs[0]]], seg_idxs[segs])
+        for segs in np.split(np.arange(len(keys)), splits) if len(segs) > 0
+    ]
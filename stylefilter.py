@@ -0,0 +1,120 @@
+import operator
+
+# compilation of (legacy) Mapbox GL style filters into functions evaluating the
+# filter for features of vector tiles; compiling a filter results in a function
+# that binds the filter to the keys and values of a tile layer, which resolves
+# all keys and values to their integer indices, and the bound filter tests the
+# tags of a feature (dictionary mapping key indices to value indices) and the
+# feature itself (geometry type and id)
+
+# geometry types as used by the `$type' key
+GEOM_TYPES = {'Point': 1, 'LineString': 2, 'Polygon': 3}
+
+COMPARISONS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<' : operator.lt, '<=': operator.le,
+    '>' : operator.gt, '>=': operator.ge
+}
+
+VALUE_FIELDS = [
+    'string_value', 'float_value', 'double_value', 'int_value', 'uint_value',
+    'sint_value', 'bool_value'
+]
+
+
+# get the value of a vector tile value message
+def tile_value(value):
+    for field in VALUE_FIELDS:
+        if value.HasField(field):
+            return getattr(value, field)
+    return None
+
+
+def _compare(op, val1, val2):
+    try:
+        return op(val1, val2)
+    except TypeError:
+        return False
+
+
+# filter that compares the value of a key (features without that key match only
+# if the filter is negated); the `$type' key compares the geometry type and the
+# `$id' key the id of a feature (features without id have no such value)
+def _compile_values(key, match, negate):
+    def bind(key_index, values):
+        if key == '$type':
+            geom_types = frozenset(
+                geom_type for name, geom_type in GEOM_TYPES.items()
+                if match(name)
+            )
+            return lambda tags, feature: (feature.type in geom_types) != negate
+        if key == '$id':
+            return lambda tags, feature: (
+                feature.HasField('id') and match(feature.id)
+            ) != negate
+        key_idx = key_index.get(key, None)
+        if key_idx is None:
+            return lambda tags, feature: negate
+        matching = frozenset(
+            idx for idx, val in enumerate(values) if match(val)
+        )
+        def test(tags, feature):
+            val_idx = tags.get(key_idx, None)
+            if val_idx is None:
+                return negate
+            return (val_idx in matching) != negate
+        return test
+    return bind
+
+
+def _compile_combination(combine, exprs):
+    children = [compile_filter(expr) for expr in exprs]
+    def bind(key_index, values):
+        tests = [child(key_index, values) for child in children]
+        return lambda tags, feature: combine(
+            test(tags, feature) for test in tests
+        )
+    return bind
+
+
+def compile_filter(expr):
+    op, args = expr[0], expr[1:]
+    if op in ['==', '!=']:
+        # inequality is the negated equality (also for missing keys)
+        key, ref = args
+        return _compile_values(key, lambda val: val == ref, op == '!=')
+    if op in COMPARISONS:
+        key, ref = args
+        cmp = COMPARISONS[op]
+        return _compile_values(key, lambda val: _compare(cmp, val, ref), False)
+    if op in ['in', '!in']:
+        key, refs = args[0], frozenset(args[1:])
+        return _compile_values(key, lambda val: val in refs, op == '!in')
+    if op in ['has', '!has']:
+        key = args[0]
+        negate = op == '!has'
+        def bind(key_index, values):
+            key_idx = key_index.get(key, None)
+            if key == '$id':
+                return lambda tags, feature: feature.HasField('id') != negate
+            return lambda tags, feature: (key_idx in tags) != negate
+        return bind
+    if op == 'all':
+        return _compile_combination(all, args)
+    if op == 'any':
+        return _compile_combination(any, args)
+    if op == 'none':
+        return _compile_combination(lambda tests: not any(tests), args)
+    raise ValueError(f"unsupported filter operator {op}")
+
+
+# bind compiled filters to a tile layer; returns a function testing whether a
+# feature matches any of the filters
+def bind_filters(compiled, layer):
+    key_index = {key: idx for idx, key in enumerate(layer.keys)}
+    values    = [tile_value(value) for value in layer.values]
+    tests     = [bind(key_index, values) for bind in compiled]
+    def matches(feature):
+        tags = dict(zip(feature.tags[::2], feature.tags[1::2]))
+        return any(test(tags, feature) for test in tests)
+    return matches
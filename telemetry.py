@@ -0,0 +1,145 @@
+import contextlib
+import threading
+import resource
+import json
+import time
+import os
+
+# lightweight process-wide telemetry: spans (timed sections), counters and
+# histograms, which are written as Chrome trace-event JSON (viewable with
+# chrome://tracing or Perfetto); recording is disabled until enable() is called
+# and all functions are thread-safe
+
+# minimum interval (in microseconds) between two events of a counter, i.e.,
+# increments within the interval are coalesced into one event
+COUNTER_INTERVAL = 1e5
+
+_state = {
+    'enabled':    False,
+    'lock':       threading.Lock(),
+    'start':      time.perf_counter(),
+    'events':     [],
+    'counters':   {},
+    'emitted':    {},
+    'histograms': {}
+}
+
+
+def enable():
+    with _state['lock']:
+        _state['enabled'] = True
+        _state['start']   = time.perf_counter()
+
+
+def enabled():
+    return _state['enabled']
+
+
+def _timestamp():
+    # microseconds since enable()
+    return (time.perf_counter() - _state['start']) * 1e6
+
+
+def _peak_rss():
+    # peak resident set size in bytes (ru_maxrss is in KiB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# timed section of the program, recorded as complete event with the peak RSS
+# at its end; additional arguments are shown with the event
+@contextlib.contextmanager
+def span(name, **args):
+    if not _state['enabled']:
+        yield
+        return
+    start = _timestamp()
+    try:
+        yield
+    finally:
+        end = _timestamp()
+        event = {
+            'name': name, 'ph': 'X', 'ts': start, 'dur': end - start,
+            'pid': os.getpid(), 'tid': threading.get_ident(),
+            'args': {**args, 'peak_rss': _peak_rss()}
+        }
+        with _state['lock']:
+            _state['events'].append(event)
+
+
+# record the current value of a counter (the time and value of its last event
+# are kept in emitted)
+def _counter_event(name, ts):
+    total = _state['counters'][name]
+    _state['emitted'][name] = (ts, total)
+    _state['events'].append({
+        'name': name, 'ph': 'C', 'ts': ts, 'pid': os.getpid(),
+        'args': {'value': total}
+    })
+
+
+# increment a counter, its value over time is recorded as counter events (at
+# most one per COUNTER_INTERVAL, such that the trace does not grow with the
+# number of increments)
+def count(name, value=1):
+    if not _state['enabled']:
+        return
+    with _state['lock']:
+        _state['counters'][name] = _state['counters'].get(name, 0) + value
+        ts = _timestamp()
+        last, _ = _state['emitted'].get(name, (-COUNTER_INTERVAL, None))
+        if ts - last >= COUNTER_INTERVAL:
+            _counter_event(name, ts)
+
+
+# record a value of a distribution (e.g., request latencies)
+def observe(name, value):
+    if not _state['enabled']:
+        return
+    with _state['lock']:
+        _state['histograms'].setdefault(name, []).append(value)
+
+
+# summary of the recorded values of a histogram
+def _summary(vals):
+    vals = sorted(vals)
+    quantile = lambda q: vals[min(len(vals) - 1, int(q * len(vals)))]
+    return {
+        'count': len(vals),
+        'sum':   sum(vals),
+        'min':   vals[0],
+        'max':   vals[-1],
+        'mean':  sum(vals) / len(vals),
+        'p50':   quantile(0.5),
+        'p90':   quantile(0.9),
+        'p99':   quantile(0.99)
+    }
+
+
+def summary():
+    with _state['lock']:
+        return {
+            'counters':   dict(_state['counters']),
+            'histograms': {
+                name: _summary(vals)
+                for name, vals in _state['histograms'].items() if vals
+            },
+            'peak_rss':   _peak_rss()
+        }
+
+
+# write the trace (JSON object format), the counter totals and histogram
+# summaries are stored as additional data of the trace; counters end with an
+# event of their final value
+def write_trace(path):
+    with _state['lock']:
+        ts = _timestamp()
+        for name, total in _state['counters'].items():
+            if _state['emitted'][name][1] != total:
+                _counter_event(name, ts)
+        events = list(_state['events'])
+    with open(path, 'w') as dst:
+        json.dump({
+            'traceEvents':     events,
+            'displayTimeUnit': 'ms',
+            'otherData':       summary()
+        }, dst)
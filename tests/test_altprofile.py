@@ -0,0 +1,115 @@
+import math
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from altprofile import optimize_profile
+
+
+# the former formulation of find_path.py: a graph of all straight segments
+# between (node, deviation) pairs keeping the intermediate nodes within
+# max_dev, searched with networkx A*; the deviation of the goal node is
+# appended (the former loop only produced those of the first n - 1 nodes)
+def reference_profile(grid_alts, dists, max_dev):
+    def straight(idx1, idx2, dev1, dev2):
+        start_alt  = grid_alts[idx1] + dev1
+        end_alt    = grid_alts[idx2] + dev2
+        avg_slope  = (end_alt - start_alt) / sum(dists[idx1:idx2])
+        cum_dist   = 0.
+        for grid_alt, dist in zip(grid_alts[idx1+1:idx2], dists[idx1:idx2]):
+            cum_dist  += dist
+            target_dev = start_alt + cum_dist * avg_slope - grid_alt
+            if target_dev > max_dev or target_dev < -max_dev:
+                return False
+        return True
+
+    n, devs = len(grid_alts), [-max_dev, max_dev]
+    graph = nx.Graph()
+    for idx1 in range(n - 1):
+        for idx2 in range(idx1 + 1, n):
+            for dev1 in devs:
+                for dev2 in devs:
+                    if straight(idx1, idx2, dev1, dev2):
+                        alt_diff = (grid_alts[idx1] + dev1) - (grid_alts[idx2] + dev2)
+                        graph.add_edge((idx1, dev1), (idx2, dev2), weight=math.sqrt(
+                            sum(dists[idx1:idx2])**2 + alt_diff**2
+                        ))
+    alt_path = nx.astar_path(
+        graph, (0, -max_dev), (n - 1, -max_dev),
+        lambda n1, n2: sum(dists[n1[0]:n2[0]])
+    )
+    alt_devs = []
+    for (idx1, dev1), (idx2, dev2) in zip(alt_path, alt_path[1:]):
+        start_alt  = grid_alts[idx1] + dev1
+        avg_slope  = (grid_alts[idx2] + dev2 - start_alt) / sum(dists[idx1:idx2])
+        cum_dist   = 0.
+        for grid_alt, dist in zip(grid_alts[idx1:idx2], dists[idx1:idx2]):
+            alt_devs.append(start_alt + cum_dist * avg_slope - grid_alt)
+            cum_dist += dist
+    return alt_devs + [-max_dev]
+
+
+# random terrain profile along a path of n nodes with straight and diagonal
+# steps, roughness is the standard deviation of the altitude steps
+def random_profile(rng, n, roughness):
+    dists     = rng.choice([100., 100. * math.sqrt(2.)], n - 1)
+    grid_alts = 1000. + np.cumsum(rng.normal(0., roughness, n))
+    return list(grid_alts), list(dists)
+
+
+@pytest.mark.parametrize('seed', range(150))
+def test_matches_networkx_formulation(seed):
+    rng = np.random.default_rng(seed)
+    n   = int(rng.integers(2, 30))
+    grid_alts, dists = random_profile(rng, n, rng.choice([2., 10., 40.]))
+    max_dev = float(rng.choice([1., 10., 25.]))
+    np.testing.assert_allclose(
+        optimize_profile(grid_alts, dists, max_dev),
+        reference_profile(grid_alts, dists, max_dev), rtol=0., atol=1e-9
+    )
+
+
+# segments spanning several chunks (the cone is carried across the chunks and
+# the chunk size doubles)
+@pytest.mark.parametrize('seed', range(10))
+def test_chunk_boundaries(seed):
+    rng = np.random.default_rng(1000 + seed)
+    grid_alts, dists = random_profile(rng, 40, 1.)
+    expected = reference_profile(grid_alts, dists, 10.)
+    for chunk in [1, 3, 4, 64]:
+        np.testing.assert_allclose(
+            optimize_profile(grid_alts, dists, 10., chunk=chunk), expected,
+            rtol=0., atol=1e-9
+        )
+
+
+def test_max_dev_edge_cases():
+    rng = np.random.default_rng(7)
+    grid_alts, dists = random_profile(rng, 20, 20.)
+
+    # without deviation, the profile follows the grid altitudes
+    assert np.all(optimize_profile(grid_alts, dists, 0.) == 0.)
+
+    # in a valley (terrain below the line between start and goal) not deeper
+    # than 2 max_dev, the profile is one straight segment
+    cum_dists = np.concatenate(([0.], np.cumsum(dists)))
+    valley    = 1000. + 0.1 * cum_dists - 30. * np.sin(
+        math.pi * cum_dists / cum_dists[-1]
+    )
+    for max_dev in [15., 100.]:
+        straight = valley[0] + (valley[-1] - valley[0]) * (
+            cum_dists / cum_dists[-1]
+        ) - max_dev
+        np.testing.assert_allclose(
+            optimize_profile(valley, dists, max_dev), straight - valley,
+            atol=1e-9
+        )
+    # a shallower limit requires a break
+    alt_devs = optimize_profile(valley, dists, 14.)
+    assert np.all(np.abs(alt_devs) <= 14.) and np.any(alt_devs == 14.)
+
+    # profiles of one or two nodes
+    assert optimize_profile([1000.], [], 10.).tolist() == [-10.]
+    assert optimize_profile([1000., 1050.], [100.], 10.).tolist() == [-10., -10.]
+    assert optimize_profile([], [], 10.).tolist() == []
@@ -0,0 +1,50 @@
+import numpy as np
+
+from footprints import layer_mask
+from geogrid import GeoGrid
+
+GRID = ((60, 40), 100., (0., 4000.))
+
+
+# stand-in for the features of an airspace layer: squares (map coordinates)
+# with a content hash derived from their position
+def square(x, y, size=500.):
+    coords = np.array([
+        (x, y), (x + size, y), (x + size, y - size), (x, y - size), (x, y)
+    ])
+    return (f"zone-{x}-{y}", f"hash-{x}-{y}-{size}", [(3, coords)])
+
+
+def expected_mask(features, margin):
+    grid = GeoGrid(*GRID, np.zeros(GRID[0], np.float32))
+    for _, _, shapes in features:
+        for _, coords in shapes:
+            grid.rm_polygon(coords, margin)
+    return grid.vals < 0.
+
+
+def test_footprints_are_reused(tmp_path):
+    path = str(tmp_path / 'footprints' / 'uaszone.pkl')
+    features = [square(1000., 3000.), square(2500., 2000.), square(4000., 1000.)]
+    mask, num_rasterized = layer_mask(path, *GRID, features, 150.)
+    assert num_rasterized == 3
+    assert mask.any() and np.array_equal(mask, expected_mask(features, 150.))
+
+    mask, num_rasterized = layer_mask(path, *GRID, features, 150.)
+    assert num_rasterized == 0
+    assert np.array_equal(mask, expected_mask(features, 150.))
+
+    # only the changed feature is rasterized, the removed one is dropped
+    features = [features[0], square(2500., 2000., 800.)]
+    mask, num_rasterized = layer_mask(path, *GRID, features, 150.)
+    assert num_rasterized == 1
+    assert np.array_equal(mask, expected_mask(features, 150.))
+    _, num_rasterized = layer_mask(path, *GRID, [square(4000., 1000.)], 150.)
+    assert num_rasterized == 1
+
+
+def test_footprint_at_grid_border(tmp_path):
+    features = [square(-200., 4200.), square(5800., 200.)]
+    mask, _ = layer_mask(str(tmp_path / 'fp.pkl'), *GRID, features, 0.)
+    assert mask[0, 0] and mask[-1, -1]
+    assert np.array_equal(mask, expected_mask(features, 0.))
@@ -0,0 +1,59 @@
+import numpy as np
+
+from geogrid import GeoGrid, SearchStats
+
+
+def make_grid():
+    return GeoGrid((10, 8), 100., (1000., 5000.), np.zeros((10, 8), np.float32))
+
+
+def test_coords_to_grid_shapes():
+    grid = make_grid()
+    assert grid.coords_to_grid([]).shape == (0, 2)
+    assert grid.coords_to_grid(iter([])).shape == (0, 2)
+    assert grid.coords_to_grid(np.empty((0, 2))).shape == (0, 2)
+    assert grid.grid_to_coords([]).shape == (0, 2)
+    assert np.array_equal(grid.coords_to_grid((1200., 4700.)), [[2., 3.]])
+    assert np.array_equal(
+        grid.grid_to_coords(grid.coords_to_grid([(1200., 4700.), (1050., 5000.)])),
+        [[1200., 4700.], [1050., 5000.]]
+    )
+
+
+def test_rm_points_without_points():
+    grid = make_grid()
+    grid.rm_points([], 150.)
+    assert np.all(grid.vals == 0.)
+    grid.rm_points([(1200., 4700.)], 150.)
+    assert grid.vals[2, 3] == -1. and grid.vals[9, 7] == 0.
+
+
+# a ridge across the grid with a single gap, which the path has to pass
+def make_path_grid():
+    vals = np.full((30, 20), 500., np.float32)
+    vals[[0, -1], :] = vals[:, [0, -1]] = -1.
+    vals[15, :] = -1.
+    vals[15, 16] = 500.
+    return GeoGrid((30, 20), 100., (0., 0.), vals)
+
+
+def test_find_path_stats():
+    grid  = make_path_grid()
+    path  = grid.find_path((3, 3), (26, 3), 1.)
+    stats = SearchStats(record_expanded=True)
+    assert grid.find_path((3, 3), (26, 3), 1., stats=stats) == path
+    assert (15, 16, 0.) in path
+
+    order = stats.expanded_order
+    assert stats.expanded == np.count_nonzero(order >= 0)
+    assert sorted(order[order >= 0]) == list(range(stats.expanded))
+    assert stats.pushes >= stats.expanded + stats.stale_pops
+    assert stats.max_heap > 0 and stats.total_time >= stats.relax_time > 0.
+    assert stats.cost >= (26 - 3) and 0. < stats.heuristic_ratio < 1.
+
+    # no path: statistics of the exhausted search without cost
+    grid.vals[15, 16] = -1.
+    stats = SearchStats()
+    assert grid.find_path((3, 3), (26, 3), 1., stats=stats) == []
+    assert stats.cost is None and stats.heuristic_ratio is None
+    assert stats.expanded == np.count_nonzero(grid.vals[1:15] >= 0.)
@@ -0,0 +1,163 @@
+import json
+
+import numpy as np
+import pytest
+
+from geojson import GeoJSON, FeatureStream, IntervalTree
+
+
+def feature(idx, name, coordinates, geom_type='Polygon', **extra):
+    props = {
+        'external_reference': f"ref{idx}", 'name': name, 'type_code': 'R',
+        'code': f"Z{idx}",
+        'lower_limit_altitude': 0, 'lower_limit_reference': 'AGL',
+        'lower_limit_unit': 'm',
+        'upper_limit_altitude': 100 * idx, 'upper_limit_reference': 'AGL',
+        'upper_limit_unit': 'ft'
+    }
+    props.update(extra)
+    return {
+        'type': 'Feature', 'id': f"uaszone.{idx}", 'properties': props,
+        'geometry': {'type': geom_type, 'coordinates': coordinates}
+    }
+
+
+FEATURES = [
+    # escaped quotes and backslashes, also right before the closing quote,
+    # and brackets within strings
+    feature(1, 'zone "1" {[ \\', [[[0, 0], [1, 0], [1, 1], [0, 0]]],
+            remark='ends with a backslash \\'),
+    # non-ASCII characters (escaped and as multi-byte UTF-8) and a property
+    # named like the features member
+    feature(2, 'Zone äöü ✈', [[[2, 2], [3, 2], [3, 3], [2, 2]]],
+            features='not the features "]}"'),
+    # nested arrays and objects within the properties, several rings
+    feature(3, 'features', [
+        [[0, 0], [9, 0], [9, 9], [0, 0]], [[1, 1], [2, 1], [2, 2], [1, 1]]
+    ], nested=[[1, [2, [3, []]]], {'a': [{}, {'b': ['}']}]}]),
+    feature(4, '', [[4.5, -1e-3], [5.25, 2e10]], 'LineString')
+]
+
+CRS = {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:EPSG::3857'}}
+
+
+# feature collection with members before and after the features (the crs is an
+# object member, the bbox an array member)
+def document():
+    return (
+        '{"type": "FeatureCollection", "name": "features",\n'
+        ' "bbox": [[0, -1e-3], [9, 2e10]],\n'
+        ' "features": ' + json.dumps(FEATURES[:2]).rstrip(']') + ',\n  ' +
+        json.dumps(FEATURES[2:], ensure_ascii=False, indent=2).lstrip('[') +
+        ',\n "totalFeatures": 4, "crs": ' + json.dumps(CRS) + '}'
+    ).encode()
+
+
+def chunked(data, size):
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 100])
+def test_feature_stream_chunks(size):
+    data   = document()
+    stream = FeatureStream()
+    raw    = [item for chunk in chunked(data, size) for item in stream.feed(chunk)]
+    assert [json.loads(item) for item in raw] == FEATURES
+    assert stream.members == {'bbox': [[0, -1e-3], [9, 2e10]], 'crs': CRS}
+    assert stream.depth == 0 and not stream.in_string
+    # only the bytes of an incomplete feature or member are kept
+    assert len(stream.buf) < size
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 100])
+def test_from_stream_chunks(size):
+    expected = GeoJSON(json.loads(document()))
+    geojson  = GeoJSON.from_stream(chunked(document(), size))
+    assert geojson.crs == expected.crs == 3857
+    assert len(geojson.features) == len(expected.features) == 4
+    for feature, other in zip(geojson.features, expected.features):
+        assert feature.feature_id  == other.feature_id
+        assert feature.name        == other.name
+        assert feature.lower_limit == other.lower_limit
+        assert feature.upper_limit == other.upper_limit
+        assert len(feature.shapes) == len(other.shapes)
+        for (type1, coords1), (type2, coords2) in zip(
+            feature.shapes, other.shapes
+        ):
+            assert type1 == type2 and np.array_equal(coords1, coords2)
+
+
+def test_from_stream_truncated():
+    data = document()
+    with pytest.raises(AssertionError):
+        GeoJSON.from_stream(chunked(data[:-1], 7))
+
+
+# stabbing queries agree with a linear scan, also at the interval ends, for
+# empty and unbounded intervals
+@pytest.mark.parametrize('seed', range(20))
+def test_interval_tree(seed):
+    rng    = np.random.default_rng(seed)
+    lowers = rng.integers(0, 30, rng.integers(0, 60)).astype(np.float64)
+    uppers = lowers + rng.integers(-3, 15, len(lowers))
+    lowers[rng.random(len(lowers)) < 0.1] = -np.inf
+    uppers[rng.random(len(uppers)) < 0.1] =  np.inf
+    intervals = list(zip(lowers, uppers, range(len(lowers))))
+    tree = IntervalTree(intervals)
+    for point in np.arange(-2., 48., 0.5).tolist() + [-np.inf, np.inf]:
+        assert sorted(tree.query(point)) == [
+            idx for lower, upper, idx in intervals if lower <= point <= upper
+        ]
+
+
+def random_snapshot(rng, num_features):
+    features = []
+    for idx in range(1, num_features + 1):
+        rings = []
+        for _ in range(rng.integers(1, 4)):
+            x, y = rng.uniform(0., 100., 2)
+            w, h = rng.uniform(0.5, 20., 2)
+            rings.append([[x, y], [x + w, y], [x + w, y + h], [x, y]])
+        features.append(feature(idx, f"zone {idx}", rings))
+        # limits from 0 to 100 idx ft, some without upper limit
+        if rng.random() < 0.2:
+            features[-1]['properties']['upper_limit_altitude'] = None
+    return GeoJSON({'features': features, 'crs': CRS})
+
+
+# the indexed queries return the same shapes (in the order of the features) as
+# filtering the shapes of all features by altitude and bounding box
+@pytest.mark.parametrize('seed', range(10))
+def test_indexed_shapes(seed):
+    rng     = np.random.default_rng(seed)
+    geojson = random_snapshot(rng, 40)
+    def unindexed(param, bbox):
+        return [
+            (feature, shape) for feature in geojson.features
+            for shape in feature.get_shapes(param) if bbox is None or (
+                np.all(shape[1].min(axis=0) <= bbox[2:]) and
+                np.all(shape[1].max(axis=0) >= bbox[:2])
+            )
+        ]
+    for _ in range(20):
+        # altitudes within, at the ends (0 m and the upper limit of feature 7)
+        # and above all limits
+        param = [
+            None, rng.uniform(-10., 1500.), 0., 700 * 0.3048, 3048.
+        ][rng.integers(5)]
+        x, y  = rng.uniform(-10., 110., 2)
+        bbox  = [None, (x, y, x + rng.uniform(0., 40.),
+                        y + rng.uniform(0., 40.))][rng.integers(2)]
+        expected = unindexed(param, bbox)
+        assert [
+            id(shape) for shape in geojson.get_shapes(param, bbox)
+        ] == [id(shape) for _, shape in expected]
+        assert [
+            (feature.feature_id, [id(shape) for shape in shapes])
+            for feature, shapes in geojson.get_feature_shapes(param, bbox)
+        ] == [
+            (feature.feature_id, [id(shape) for other, shape in expected
+                                  if other is feature])
+            for feature in geojson.features
+            if any(other is feature for other, _ in expected)
+        ]
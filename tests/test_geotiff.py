@@ -0,0 +1,258 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from geotiff import GeoTIFF
+
+SIZE = (150, 110)
+
+
+# TIFF variant of LZW (MSB first bit order, code width changes one code early
+# like libtiff, clear code when the table is full)
+def lzw_encode(data):
+    out    = bytearray()
+    bitbuf = 0
+    bitcnt = 0
+    def put(code, width):
+        nonlocal bitbuf, bitcnt
+        bitbuf  = (bitbuf << width) | code
+        bitcnt += width
+        while bitcnt >= 8:
+            bitcnt -= 8
+            out.append((bitbuf >> bitcnt) & 0xff)
+            bitbuf &= (1 << bitcnt) - 1
+    table = {bytes([val]): val for val in range(256)}
+    next_code, width = 258, 9
+    put(256, width)
+    prev = b''
+    for byte in data:
+        entry = prev + bytes([byte])
+        if entry in table:
+            prev = entry
+            continue
+        put(table[prev], width)
+        table[entry] = next_code
+        next_code   += 1
+        prev         = bytes([byte])
+        if next_code == 4094:
+            put(256, width)
+            table = {bytes([val]): val for val in range(256)}
+            next_code, width = 258, 9
+        elif next_code >= 1 << width:
+            width += 1
+    if prev:
+        put(table[prev], width)
+        if next_code + 1 >= 1 << width:
+            width += 1
+    put(257, width)
+    if bitcnt > 0:
+        out.append((bitbuf << (8 - bitcnt)) & 0xff)
+    return bytes(out)
+
+
+def packbits_encode(data):
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        run = 1
+        while pos + run < len(data) and run < 128 and \
+              data[pos + run] == data[pos]:
+            run += 1
+        if run > 1:
+            out += bytes([257 - run, data[pos]])
+            pos += run
+            continue
+        end = pos + 1
+        while end < len(data) and end - pos < 128 and (
+            end + 1 >= len(data) or data[end + 1] != data[end]
+        ):
+            end += 1
+        out += bytes([end - pos - 1]) + data[pos:end]
+        pos = end
+    return bytes(out)
+
+
+# apply a predictor to a block (rows of samples)
+def predict(block, predictor):
+    if predictor == GeoTIFF.PREDICTOR_HORIZONTAL:
+        diff = block.copy()
+        diff[:, 1:] = block[:, 1:] - block[:, :-1]
+        return diff.tobytes()
+    if predictor == GeoTIFF.PREDICTOR_FLOAT:
+        # byte planes (most significant byte first) of each row, differenced
+        # byte-wise
+        planes = block.astype(block.dtype.newbyteorder('>')).view(np.uint8)
+        planes = planes.reshape(block.shape[0], block.shape[1], -1)
+        planes = planes.transpose(0, 2, 1).reshape(block.shape[0], -1)
+        diff   = planes.copy()
+        diff[:, 1:] = planes[:, 1:] - planes[:, :-1]
+        return diff.tobytes()
+    return block.tobytes()
+
+
+# write a little-endian GeoTIFF (geographic CRS) of a single-sample raster,
+# organized in tiles or strips of the block size
+def write_tiff(path, data, compression, predictor=GeoTIFF.PREDICTOR_NONE,
+               tile=None, rows_per_strip=None):
+    height, width = data.shape
+    if tile is not None:
+        bw, bh = tile
+        padded = np.zeros((-(-height // bh) * bh, -(-width // bw) * bw),
+                          data.dtype)
+        padded[:height, :width] = data
+        blocks = [
+            padded[y:y + bh, x:x + bw]
+            for y in range(0, height, bh) for x in range(0, width, bw)
+        ]
+    else:
+        blocks = [
+            data[y:y + rows_per_strip] for y in range(0, height, rows_per_strip)
+        ]
+    encode = {
+        GeoTIFF.COMPRESSION_NONE:     lambda raw: raw,
+        GeoTIFF.COMPRESSION_LZW:      lzw_encode,
+        GeoTIFF.COMPRESSION_DEFLATE:  zlib.compress,
+        GeoTIFF.COMPRESSION_ZIP:      zlib.compress,
+        GeoTIFF.COMPRESSION_PACKBITS: packbits_encode
+    }[compression]
+    chunks = [encode(predict(block, predictor)) for block in blocks]
+
+    kind = {'u': 1, 'i': 2, 'f': 3}[data.dtype.kind]
+    tags = [
+        (256, 4, [width]), (257, 4, [height]),
+        (258, 3, [data.dtype.itemsize * 8]), (259, 3, [compression]),
+        (262, 3, [1]), (277, 3, [1]), (284, 3, [1]), (317, 3, [predictor]),
+        (339, 3, [kind]),
+        (33550, 12, [0.01, 0.01, 0.]),
+        (33922, 12, [0., 0., 0., 8., 48., 0.]),
+        (34735, 3, [1, 1, 0, 3, 1024, 0, 1, 2, 1025, 0, 1, 1,
+                    2048, 0, 1, 4326])
+    ]
+    offsets = []
+    pos = 8
+    for chunk in chunks:
+        offsets.append(pos)
+        pos += len(chunk)
+    counts = [len(chunk) for chunk in chunks]
+    if tile is not None:
+        tags += [(322, 3, [tile[0]]), (323, 3, [tile[1]]),
+                 (324, 4, offsets), (325, 4, counts)]
+    else:
+        tags += [(273, 4, offsets), (278, 4, [rows_per_strip]),
+                 (279, 4, counts)]
+    tags.sort()
+
+    # image file directory after the blocks, values not fitting into the
+    # entries after the directory
+    fmts = {3: 'H', 4: 'I', 12: 'd'}
+    pos += pos & 1
+    ifd_pos   = pos
+    extra_pos = ifd_pos + 2 + 12 * len(tags) + 4
+    entries, extra = b'', b''
+    for tag, typ, vals in tags:
+        packed = struct.pack(f"<{len(vals)}{fmts[typ]}", *vals)
+        if len(packed) <= 4:
+            value = packed.ljust(4, b'\0')
+        else:
+            value = struct.pack('<I', extra_pos + len(extra))
+            extra += packed
+        entries += struct.pack('<HHI', tag, typ, len(vals)) + value
+    with open(path, 'wb') as dst:
+        dst.write(b'II*\0' + struct.pack('<I', ifd_pos))
+        dst.write(b''.join(chunks))
+        dst.write(b'\0' * (ifd_pos - 8 - sum(counts)))
+        dst.write(struct.pack('<H', len(tags)) + entries + b'\0\0\0\0')
+        dst.write(extra)
+
+
+# raster with smooth areas (runs for PackBits, repeated strings for LZW) and
+# noise (float noise overflows the LZW table of a tile)
+def make_raster(dtype):
+    rng  = np.random.default_rng(7)
+    y, x = np.mgrid[:SIZE[1], :SIZE[0]]
+    data = (x // 9 + 3 * (y // 5)).astype(np.float64)
+    data[40:90, 30:120] = rng.integers(0, 250, (50, 90))
+    data = data.astype(dtype)
+    if data.dtype.kind == 'f':
+        data[40:90, 30:120] += rng.uniform(-1., 1., (50, 90)).astype(dtype)
+    elif data.dtype.kind == 'i':
+        data[::7] *= -1
+    return data
+
+
+LAYOUTS = {
+    'tiles':  {'tile': (64, 32)},
+    'strips': {'rows_per_strip': 7}
+}
+
+VARIANTS = [
+    (compression, dtype, predictor)
+    for compression in [
+        GeoTIFF.COMPRESSION_NONE, GeoTIFF.COMPRESSION_LZW,
+        GeoTIFF.COMPRESSION_DEFLATE, GeoTIFF.COMPRESSION_PACKBITS
+    ]
+    for dtype, predictor in [
+        ('u1',  GeoTIFF.PREDICTOR_NONE), ('<u2', GeoTIFF.PREDICTOR_NONE),
+        ('<i2', GeoTIFF.PREDICTOR_NONE), ('<f4', GeoTIFF.PREDICTOR_NONE),
+        ('<u2', GeoTIFF.PREDICTOR_HORIZONTAL),
+        ('<i2', GeoTIFF.PREDICTOR_HORIZONTAL),
+        ('<f4', GeoTIFF.PREDICTOR_FLOAT)
+    ]
+    # predictors are only used with LZW and deflate compression
+    if predictor == GeoTIFF.PREDICTOR_NONE or compression in [
+        GeoTIFF.COMPRESSION_LZW, GeoTIFF.COMPRESSION_DEFLATE
+    ]
+] + [(GeoTIFF.COMPRESSION_ZIP, '<u2', GeoTIFF.PREDICTOR_HORIZONTAL)]
+
+
+@pytest.fixture(params=[
+    (layout,) + variant for layout in LAYOUTS for variant in VARIANTS
+], ids=lambda param: '-'.join(map(str, param)))
+def tiff(request, tmp_path):
+    layout, compression, dtype, predictor = request.param
+    data = make_raster(dtype)
+    path = str(tmp_path / 'raster.tif')
+    write_tiff(path, data, compression, predictor, **LAYOUTS[layout])
+    with Image.open(path) as img:
+        pixels = np.array(img)
+    assert np.array_equal(pixels, data)
+    # a small cache, such that blocks are evicted and decoded again
+    tif = GeoTIFF(path, cache_size=2)
+    assert tif.dtype == data.dtype
+    return tif, pixels
+
+
+def test_read_window(tiff):
+    tif, pixels = tiff
+    assert tif.size == SIZE
+    assert np.array_equal(tif.read_window(0, 0, *SIZE), pixels)
+    # windows within a block, crossing block edges (tiles of 64 x 32, strips
+    # of 7 rows) and in the last, partial blocks
+    for x, y, width, height in [
+        (3, 2, 10, 4), (60, 28, 10, 10), (50, 5, 80, 40), (120, 100, 30, 10),
+        (149, 109, 1, 1)
+    ]:
+        assert np.array_equal(
+            tif.read_window(x, y, width, height),
+            pixels[y:y + height, x:x + width]
+        )
+    # windows partially or completely outside of the raster are filled
+    window = tif.read_window(-5, 100, 20, 20, fill=1)
+    assert np.array_equal(window[:10, 5:], pixels[100:, :15])
+    assert np.all(window[10:] == 1) and np.all(window[:, :5] == 1)
+    assert np.all(tif.read_window(200, 0, 5, 5) == 0)
+
+
+def test_read_pixels(tiff):
+    tif, pixels = tiff
+    rng  = np.random.default_rng(3)
+    cols = rng.integers(-10, SIZE[0] + 10, (40, 30))
+    rows = rng.integers(-10, SIZE[1] + 10, (40, 30))
+    inside = (cols >= 0) & (cols < SIZE[0]) & (rows >= 0) & (rows < SIZE[1])
+    vals = tif.read_pixels(cols, rows, fill=5)
+    assert vals.shape == (40, 30) and vals.dtype == tif.dtype
+    assert np.array_equal(vals[inside], pixels[rows[inside], cols[inside]])
+    assert np.all(vals[~inside] == 5)
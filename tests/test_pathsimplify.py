@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+import pytest
+
+from geogrid import GeoGrid
+from pathsimplify import rdp, visvalingam, simplify_path
+
+
+def distance(point, start, end):
+    line = [e - s for s, e in zip(start, end)]
+    line_len = math.sqrt(sum(val**2 for val in line))
+    if line_len == 0.:
+        return math.dist(point, start)
+    u = [s - p for s, p in zip(start, point)]
+    cross = [
+        line[1] * u[2] - line[2] * u[1],
+        line[2] * u[0] - line[0] * u[2],
+        line[0] * u[1] - line[1] * u[0]
+    ]
+    return math.sqrt(sum(val**2 for val in cross)) / line_len
+
+
+# textbook recursive RDP, returns the indices of the retained points
+def recursive_rdp(points, epsilon, first=0, last=None):
+    if last is None:
+        if len(points) < 2:
+            return list(range(len(points)))
+        last = len(points) - 1
+    dists = [
+        distance(points[idx], points[first], points[last])
+        for idx in range(first + 1, last)
+    ]
+    if dists and max(dists) > epsilon:
+        mid = first + 1 + dists.index(max(dists))
+        return (recursive_rdp(points, epsilon, first, mid)[:-1] +
+                recursive_rdp(points, epsilon, mid, last))
+    return [first, last]
+
+
+# Visvalingam-Whyatt by recomputing all triangles after each removal
+def brute_force_visvalingam(points, count):
+    keep = list(range(len(points)))
+    while len(keep) > max(count, 2):
+        areas = [
+            (0.5 * np.linalg.norm(np.cross(
+                points[keep[i]] - points[keep[i - 1]],
+                points[keep[i + 1]] - points[keep[i - 1]]
+            )), i) for i in range(1, len(keep) - 1)
+        ]
+        del keep[min(areas)[1]]
+    return keep
+
+
+def random_path(rng, n):
+    return np.cumsum(rng.normal(0., 1., (n, 3)) * [1., 1., 3.], axis=0)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_rdp_matches_recursive(seed):
+    rng    = np.random.default_rng(seed)
+    points = random_path(rng, int(rng.integers(3, 200)))
+    for epsilon in [0., 0.5, 2., 10., 1e6]:
+        keep = rdp(points, epsilon)
+        assert keep.tolist() == recursive_rdp(points.tolist(), epsilon)
+        # each removed point is within epsilon of the retained segment
+        for first, last in zip(keep[:-1], keep[1:]):
+            for idx in range(first + 1, last):
+                assert distance(points[idx], points[first], points[last]) <= (
+                    epsilon)
+    assert rdp(points, 1e6).tolist() == [0, len(points) - 1]
+    assert rdp(points, 0.).tolist() == list(range(len(points)))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_visvalingam_count(seed):
+    rng    = np.random.default_rng(seed)
+    n      = int(rng.integers(3, 60))
+    points = random_path(rng, n)
+    for count in [0, 1, 2, 3, n // 2, n - 1, n, n + 5]:
+        keep = visvalingam(points, count)
+        assert len(keep) == min(max(count, 2), n)
+        assert keep[0] == 0 and keep[-1] == n - 1
+        assert keep.tolist() == brute_force_visvalingam(points, count)
+
+
+def test_degenerate_paths():
+    for n in range(3):
+        points = np.arange(3 * n, dtype=np.float64).reshape(n, 3)
+        assert rdp(points, 1.).tolist() == list(range(n))
+        assert rdp(points, 0.).tolist() == list(range(n))
+        assert visvalingam(points, 0).tolist() == list(range(n))
+        assert visvalingam(points, 5).tolist() == list(range(n))
+
+    # collinear (also repeated) points are removed
+    points = np.array([(x, 2. * x, 1.) for x in [0, 1, 1, 2, 3, 7, 10]])
+    assert rdp(points, 0.).tolist() == [0, 6]
+    assert visvalingam(points, 2).tolist() == [0, 6]
+    assert len(visvalingam(points, 4)) == 4
+
+    # closed loop (start equals end), distances are measured to the start
+    points = np.array([(0., 0., 0.), (3., 0., 0.), (3., 4., 0.), (0., 0., 0.)])
+    assert rdp(points, 4.9).tolist() == [0, 2, 3]
+    assert rdp(points, 5.).tolist() == [0, 3]
+
+
+def test_simplify_path():
+    # flat terrain with a 50 m ridge at x = 5
+    vals = np.full((11, 5), 100., np.float32)
+    vals[5] = 150.
+    grid = GeoGrid((11, 5), 100., (0., 400.), vals)
+    path = [(x, 2, 10.) for x in range(11)]
+    assert simplify_path(grid, [], 1.) == []
+    assert simplify_path(grid, path[:1], 1.) == path[:1]
+    assert simplify_path(grid, path[:2], 1.) == path[:2]
+
+    # the ridge is retained unless its scaled height is within epsilon
+    assert simplify_path(grid, path, 1.) == [path[0], path[4], path[5],
+                                             path[6], path[10]]
+    assert simplify_path(grid, path, 1., z_scale=0.01) == [path[0], path[10]]
+    # the altitude offsets compensate the ridge
+    flat = [(x, y, 60. if x == 5 else 110.) for x, y, _ in path]
+    assert simplify_path(grid, flat, 1.) == [flat[0], flat[10]]
+
+    # fixed number of nodes (the flat nodes first)
+    assert simplify_path(grid, path, count=5) == [path[0], path[4], path[5],
+                                                  path[6], path[10]]
+    assert len(simplify_path(grid, path, count=3)) == 3
+    assert simplify_path(grid, path, count=0) == [path[0], path[10]]
+    assert simplify_path(grid, path, count=20) == path
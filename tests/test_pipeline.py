@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from pipeline import Pipeline
+
+
+# stand-in for the grid generation: a network stage (sleeping I/O) overlaps a
+# DEM stage (sleeping CPU work), both are joined by a composite stage
+def make_stages(cache_dir, calls, delay=0.5, sampling='max'):
+    def fetch():
+        calls.append('fetch')
+        time.sleep(delay)
+        return {'features': 3}
+
+    def dem():
+        calls.append('dem')
+        time.sleep(delay)
+        return np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    def grid(features, vals):
+        calls.append('grid')
+        return vals + features['features']
+
+    stages = Pipeline(str(cache_dir))
+    stages.add('fetch', fetch, io=True)
+    stages.add('dem', dem, params={'sampling': sampling}, fmt='npy')
+    stages.add('grid', grid, ['fetch', 'dem'], fmt='npy')
+    return stages
+
+
+def test_io_stage_overlaps_cpu_stage(tmp_path):
+    calls = []
+    start = time.perf_counter()
+    results = make_stages(tmp_path, calls).run()
+    wall = time.perf_counter() - start
+    assert sorted(calls) == ['dem', 'fetch', 'grid']
+    assert wall < 0.9, f"stages did not overlap ({wall:.2f} s)"
+    assert np.array_equal(results['grid'], np.arange(12).reshape(3, 4) + 3)
+
+
+def test_rerun_uses_cached_artifacts(tmp_path):
+    make_stages(tmp_path, []).run()
+    calls = []
+    make_stages(tmp_path, calls).run()
+    assert calls == []
+
+    # changed parameters of the DEM stage invalidate it and the composite
+    make_stages(tmp_path, calls, 0., 'mean').run()
+    assert calls == ['dem', 'grid']
+
+
+def test_stage_may_return_npy_file(tmp_path):
+    def dem():
+        path = str(tmp_path / 'scratch.npy')
+        vals = np.lib.format.open_memmap(path, 'w+', np.float32, (2, 2))
+        vals[:] = 7.
+        vals.flush()
+        return path
+
+    stages = Pipeline(str(tmp_path / 'cache'))
+    stages.add('dem', dem, fmt='npy')
+    results = stages.run()
+    assert not (tmp_path / 'scratch.npy').exists()
+    assert np.all(results['dem'] == 7.)
+
+
+# a deferred parameter (e.g., the hash of the elevation model) is resolved
+# while the stages that do not depend on it are running
+def test_deferred_param_does_not_delay_other_stages(tmp_path):
+    def dem_hash(value):
+        time.sleep(0.5)
+        return value
+
+    def make(calls, value):
+        stages = Pipeline(str(tmp_path))
+        stages.add('fetch', lambda: calls.append('fetch') or time.sleep(0.5),
+                   io=True)
+        stages.add('dem', lambda: calls.append('dem') or np.zeros(3),
+                   params={'dem_hash': lambda: dem_hash(value)}, fmt='npy')
+        stages.add('grid', lambda _, vals: calls.append('grid') or vals + 1.,
+                   ['fetch', 'dem'], fmt='npy')
+        return stages
+
+    calls = []
+    start = time.perf_counter()
+    results = make(calls, 'a').run()
+    wall = time.perf_counter() - start
+    assert sorted(calls) == ['dem', 'fetch', 'grid']
+    assert wall < 0.9, f"deferred parameter delayed the stages ({wall:.2f} s)"
+    assert np.all(results['grid'] == 1.)
+
+    calls = []
+    make(calls, 'a').run()
+    assert calls == []
+    make(calls, 'b').run()
+    assert calls == ['dem', 'grid']
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from geogrid import GeoGrid
+from geojson import GeoJSON
+from routecheck import check_route
+
+# grid of 20 x 20 nodes (100 m) with the terrain at 500 m, rising to 950 m east
+# of x = 12; the path follows row 10 (map y = 1000 m) from node 2 to node 17,
+# segment i spans the map x range [200 + 100 i, 300 + 100 i]
+def make_grid():
+    vals = np.full((20, 20), 500., np.float32)
+    vals[12:] = 950.
+    return GeoGrid((20, 20), 100., (0., 2000.), vals)
+
+PATH = [(x, 10, 0.) for x in range(2, 18)]
+
+
+def feature(idx, x0, x1, y0, y1, lower, upper):
+    props = {'external_reference': f"ref{idx}", 'name': f"zone {idx}",
+             'type_code': 'R', 'code': f"Z{idx}"}
+    for prefix, (alt, ref, unit) in [('lower', lower), ('upper', upper)]:
+        props.update({
+            f"{prefix}_limit_altitude":  alt,
+            f"{prefix}_limit_reference": ref,
+            f"{prefix}_limit_unit":      unit
+        })
+    return {
+        'type': 'Feature', 'id': f"uaszone.{idx}", 'properties': props,
+        'geometry': {'type': 'Polygon', 'coordinates': [[
+            [x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]
+        ]]}
+    }
+
+
+def snapshot(*features):
+    return GeoJSON({
+        'type': 'FeatureCollection', 'features': list(features),
+        'crs': {'type': 'name',
+                'properties': {'name': 'urn:ogc:def:crs:EPSG::3857'}}
+    })
+
+
+def violations(geojson, **kwargs):
+    return [
+        (violation.feature.feature_id, violation.segments.tolist())
+        for violation in check_route(make_grid(), PATH, geojson, **kwargs)
+    ]
+
+
+def test_agl_limit():
+    geojson = snapshot(
+        # up to 150 m above ground: the path at 110 m violates it
+        feature(0, 500., 800., 900., 1100., (0, 'GND', 'm'), (150, 'AGL', 'm')),
+        # from 200 m above ground: the path passes below
+        feature(1, 250., 350., 900., 1100., (200, 'AGL', 'm'), (500, 'AGL', 'm')),
+        # from 400 ft above ground (122 m), which the path only reaches with
+        # an altitude offset of 20 m at the nodes 8 and 9
+        feature(2, 750., 1150., 900., 1100., (400, 'AGL', 'ft'), (1000, 'AGL', 'm'))
+    )
+    assert violations(geojson) == [('uaszone.0', [2, 3, 4, 5, 6])]
+    path = [(x, y, 20. if x in [8, 9] else 0.) for x, y, _ in PATH]
+    result = check_route(make_grid(), path, geojson)
+    assert [(v.feature.feature_id, v.segments.tolist()) for v in result] == [
+        ('uaszone.0', [2, 3, 4, 5, 6]), ('uaszone.2', [5, 6, 7])
+    ]
+
+
+def test_msl_limit():
+    # from 1000 m MSL: the path is at 610 m MSL over the low terrain and at
+    # 1060 m MSL from node 12 on (segment 9 ends at node 12)
+    geojson = snapshot(
+        feature(0, 1000., 1600., 900., 1100., (1000, 'MSL', 'm'), (2000, 'MSL', 'm')),
+        # up to 500 m MSL: the path passes above
+        feature(1, 200., 900., 900., 1100., (0, 'GND', 'm'), (500, 'MSL', 'm'))
+    )
+    assert violations(geojson) == [('uaszone.0', [9, 10, 11, 12, 13, 14])]
+    assert violations(geojson, flight_height=60.) == [
+        ('uaszone.0', [9, 10, 11, 12, 13, 14])
+    ]
+    assert violations(geojson, flight_height=40.) == []
+
+
+def test_feature_without_limits():
+    geojson = snapshot(
+        feature(0, 1650., 1680., 950., 1050., (None, None, None), (None, None, None)),
+        feature(1, 0., 100., 0., 100., (None, None, None), (None, None, None))
+    )
+    assert violations(geojson) == [('uaszone.0', [14])]
+    assert violations(geojson, flight_height=1e5) == [('uaszone.0', [14])]
+
+
+def test_margin():
+    # 50 m north of the path, segments 0 to 2 are within 60 m
+    geojson = snapshot(
+        feature(0, 300., 400., 1050., 1200., (0, 'GND', 'm'), (150, 'AGL', 'm'))
+    )
+    assert violations(geojson) == []
+    assert violations(geojson, margin=49.) == []
+    assert violations(geojson, margin=60.) == [('uaszone.0', [0, 1, 2])]
+
+
+def test_path_leaving_the_grid():
+    geojson = snapshot(
+        feature(0, 500., 800., 900., 1100., (0, 'GND', 'm'), (150, 'AGL', 'm'))
+    )
+    for path in [PATH + [(20, 10, 0.)], [(-1, 10, 0.)] + PATH]:
+        with pytest.raises(AssertionError, match="leaves the grid"):
+            check_route(make_grid(), path, geojson)
@@ -0,0 +1,96 @@
+import pytest
+
+import vector_tile_pb2
+from stylefilter import compile_filter, bind_filters
+
+Tile = vector_tile_pb2.Tile
+
+
+# layer with features (id, geometry type, tags), the second feature has no
+# height, the third one no id and no tags at all
+def make_layer():
+    layer = Tile().layers.add()
+    layer.name, layer.version, layer.extent = 'NUTZUNG', 2, 4096
+    layer.keys.extend(['class', 'height'])
+    layer.values.add().string_value = 'Siedlung'
+    layer.values.add().string_value = 'Wald'
+    layer.values.add().int_value    = 10
+    layer.values.add().int_value    = 30
+    for feature_id, feature_type, tags in [
+        (1,    Tile.POLYGON,    [0, 0, 1, 2]),
+        (2,    Tile.LINESTRING, [0, 1]),
+        (None, Tile.POINT,      []),
+        (4,    Tile.POLYGON,    [1, 3, 0, 1])
+    ]:
+        feature = layer.features.add()
+        if feature_id is not None:
+            feature.id = feature_id
+        feature.type = feature_type
+        feature.tags.extend(tags)
+    return layer
+
+
+FILTERS = [
+    (['==', 'class', 'Siedlung'],           [0]),
+    (['==', 'height', 10],                  [0]),
+    (['==', 'missing', 'Siedlung'],         []),
+    (['!=', 'class', 'Siedlung'],           [1, 2, 3]),
+    (['!=', 'height', 10],                  [1, 2, 3]),
+    (['!=', 'missing', 'Siedlung'],         [0, 1, 2, 3]),
+    (['>', 'height', 10],                   [3]),
+    (['<=', 'height', 30],                  [0, 3]),
+    (['<', 'class', 10],                    []),
+    (['in', 'class', 'Wald', 'Acker'],      [1, 3]),
+    (['in', 'missing', 'Wald'],             []),
+    (['!in', 'class', 'Wald', 'Acker'],     [0, 2]),
+    (['!in', 'missing', 'Wald'],            [0, 1, 2, 3]),
+    (['has', 'height'],                     [0, 3]),
+    (['has', 'missing'],                    []),
+    (['!has', 'height'],                    [1, 2]),
+    (['!has', 'missing'],                   [0, 1, 2, 3]),
+    (['all', ['==', 'class', 'Wald'], ['has', 'height']], [3]),
+    (['all', ['==', 'class', 'Wald'], ['has', 'missing']], []),
+    (['all'],                               [0, 1, 2, 3]),
+    (['any', ['==', 'class', 'Siedlung'], ['>', 'height', 20]], [0, 3]),
+    (['any', ['has', 'missing']],           []),
+    (['any'],                               []),
+    (['none', ['has', 'class'], ['has', 'height']], [2]),
+    (['none', ['has', 'missing']],          [0, 1, 2, 3]),
+    (['==', '$type', 'Polygon'],            [0, 3]),
+    (['!=', '$type', 'Polygon'],            [1, 2]),
+    (['in', '$type', 'Point', 'LineString'], [1, 2]),
+    (['!in', '$type', 'Point', 'LineString'], [0, 3]),
+    (['==', '$id', 2],                      [1]),
+    (['!=', '$id', 2],                      [0, 2, 3]),
+    (['>', '$id', 1],                       [1, 3]),
+    (['in', '$id', 1, 4],                   [0, 3]),
+    (['!in', '$id', 1, 4],                  [1, 2]),
+    (['has', '$id'],                        [0, 1, 3]),
+    (['!has', '$id'],                       [2]),
+]
+
+
+@pytest.mark.parametrize('expr, expected', FILTERS)
+def test_filter(expr, expected):
+    layer   = make_layer()
+    matches = bind_filters([compile_filter(expr)], layer)
+    assert [
+        idx for idx, feature in enumerate(layer.features) if matches(feature)
+    ] == expected
+
+
+# a feature matches if it matches any of the filters
+def test_any_of_the_filters():
+    layer   = make_layer()
+    matches = bind_filters([
+        compile_filter(['==', 'class', 'Siedlung']),
+        compile_filter(['!has', 'class'])
+    ], layer)
+    assert [matches(feature) for feature in layer.features] == [
+        True, False, True, False
+    ]
+
+
+def test_unsupported_operator():
+    with pytest.raises(ValueError):
+        compile_filter(['within', 'class'])
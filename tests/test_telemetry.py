@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import telemetry
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    for key, value in [('enabled', False), ('events', []), ('counters', {}),
+                       ('emitted', {}), ('histograms', {})]:
+        monkeypatch.setitem(telemetry._state, key, value)
+    telemetry.enable()
+    return telemetry._state
+
+
+def test_counter_events_are_coalesced(trace, tmp_path):
+    for _ in range(10000):
+        telemetry.count('tiles.parsed')
+    telemetry.count('http.bytes', 512)
+    assert len(trace['events']) == 2
+    assert telemetry.summary()['counters'] == {
+        'tiles.parsed': 10000, 'http.bytes': 512
+    }
+
+    # the trace ends with the final value of each counter
+    telemetry.write_trace(tmp_path / 'trace.json')
+    with open(tmp_path / 'trace.json') as src:
+        events = json.load(src)['traceEvents']
+    last = {event['name']: event['args']['value'] for event in events}
+    assert last == {'tiles.parsed': 10000, 'http.bytes': 512}
+    assert len(events) == 3
+
+
+def test_counter_events_after_interval(trace, monkeypatch):
+    now = [0.]
+    monkeypatch.setattr(telemetry, '_timestamp', lambda: now[0])
+    for step in range(5):
+        now[0] = step * telemetry.COUNTER_INTERVAL
+        telemetry.count('http.requests')
+        telemetry.count('http.requests')
+    assert [event['args']['value'] for event in trace['events']] == [
+        1, 3, 5, 7, 9
+    ]
+
+
+def test_disabled_telemetry_records_nothing(monkeypatch):
+    monkeypatch.setitem(telemetry._state, 'enabled', False)
+    monkeypatch.setitem(telemetry._state, 'events', [])
+    telemetry.count('tiles.parsed')
+    with telemetry.span('stage dem'):
+        pass
+    assert telemetry._state['events'] == []
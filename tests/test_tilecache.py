@@ -0,0 +1,70 @@
+import time
+
+from tilecache import TileCache
+
+
+# the least recently accessed tiles are evicted once the data exceeds max_size
+# bytes, resources are never evicted
+def test_eviction(tmp_path):
+    path  = str(tmp_path / 'tiles.sqlite')
+    cache = TileCache(path, max_size=350)
+    cache.put_resource('http://host/index.json', b'r' * 50)
+    for x in range(3):
+        cache.put_tile(5, x, 1, bytes([x]) * 100)
+        time.sleep(0.01)
+    assert cache.size == 350
+    assert cache.tile_coords(5) == [(0, 1), (1, 1), (2, 1)]
+
+    # accessing tile 0 makes tile 1 the least recently used one
+    assert cache.get_tile(5, 0, 1)[0] == b'\0' * 100
+    time.sleep(0.01)
+    cache.put_tile(5, 3, 1, b'\3' * 100)
+    assert cache.tile_coords(5) == [(0, 1), (2, 1), (3, 1)]
+    assert cache.get_tile(5, 1, 1) is None
+    assert cache.size == 350
+
+    # replacing a tile only accounts for the difference in size, a larger tile
+    # evicts several others
+    cache.put_tile(5, 3, 1, b'\3' * 80)
+    assert cache.size == 330
+    time.sleep(0.01)
+    cache.put_tile(5, 4, 1, b'\4' * 250)
+    assert cache.tile_coords(5) == [(4, 1)]
+    assert cache.size == 300
+    assert cache.get_resource('http://host/index.json')[0] == b'r' * 50
+
+    # the size is restored when the cache is opened again
+    cache.close()
+    cache = TileCache(path, max_size=350)
+    assert cache.size == 300
+    cache.close()
+
+
+def test_without_limit(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.sqlite'))
+    for x in range(20):
+        cache.put_tile(3, x % 8, x // 8, b'\0' * 1000)
+    assert cache.size == 20000
+    assert len(cache.tile_coords(3)) == 20
+    cache.close()
+
+
+# a revalidated tile (or resource) is marked as fresh, its data, validators and
+# access time are kept
+def test_revalidation(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.sqlite'))
+    cache.put_tile(5, 2, 7, b'tile', '"v1"', 'Sat, 17 Oct 2026 10:00:00 GMT')
+    cache.put_resource('http://host/style.json', b'{}', '"s1"')
+    data, etag, last_modified, fetched = cache.get_tile(5, 2, 7)
+    assert (data, etag, last_modified) == (
+        b'tile', '"v1"', 'Sat, 17 Oct 2026 10:00:00 GMT'
+    )
+    time.sleep(0.01)
+    cache.touch_tile(5, 2, 7)
+    cache.touch_resource('http://host/style.json')
+    revalidated = cache.get_tile(5, 2, 7)
+    assert revalidated[:3] == (data, etag, last_modified)
+    assert revalidated[3] > fetched
+    assert cache.get_resource('http://host/style.json')[3] > fetched
+    assert cache.size == 6
+    cache.close()
@@ -0,0 +1,67 @@
+import multiprocessing
+import math
+
+import numpy as np
+from PIL import Image
+
+import tileexport
+from geogrid import GeoGrid
+from tileexport import TilePyramid, MERCATOR_EXTENT, tile_path
+
+
+def test_long_segment_crosses_tile(tmp_path):
+    size  = (2000, 20)
+    scale = 100. / math.cos(47.5 * math.pi / 180.)
+    grid  = GeoGrid(size, scale, (1060000., 6280000.),
+                    np.full(size, 1000., np.float32))
+    # a single segment across the whole grid
+    route   = [(0, 10, 0.), (size[0] - 1, 10, 0.)]
+    pyramid = TilePyramid(str(tmp_path), grid, [route])
+
+    # tile at the midpoint of the segment, several tiles away from both ends
+    zoom  = pyramid.max_zoom
+    tsize = 2. * MERCATOR_EXTENT / (1 << zoom)
+    (x0, y0), (x1, _) = pyramid.routes[0]
+    mid_x = (x0 + x1) / 2.
+    tile  = (zoom, int((mid_x + MERCATOR_EXTENT) // tsize),
+             int((MERCATOR_EXTENT - y0) // tsize))
+    assert min(abs(x0 - mid_x), abs(x1 - mid_x)) > 3 * tsize
+
+    tileexport._init_worker(
+        grid.vals, grid.scale, grid.orig, pyramid.routes, pyramid.style,
+        str(tmp_path)
+    )
+    _, _, rendered = tileexport._render_tile((tile, None))
+    assert rendered
+    with Image.open(tile_path(str(tmp_path), *tile)) as img:
+        pixels = np.array(img)
+    assert np.all(pixels == (255, 0, 0, 255), axis=-1).any()
+
+
+# an export by a shared pool of generic workers (node values memory-mapped from
+# a file) renders the same tiles as an export by its own pool
+def test_export_with_shared_pool(tmp_path):
+    size  = (300, 200)
+    scale = 500.
+    vals  = np.random.default_rng(1).uniform(0., 4000., size).astype(np.float32)
+    vals[100:120, 50:80] = -1.
+    np.save(tmp_path / 'grid.npy', vals)
+    grid  = GeoGrid.load(str(tmp_path / 'grid.npy'), scale,
+                         (1060000., 6280000.), mmap_mode='r')
+    route = [(10, 10, 0.), (250, 150, 0.)]
+
+    own = TilePyramid(str(tmp_path / 'own'), grid, [route])
+    assert own.export(processes=2) > 0
+    with multiprocessing.Pool(2) as pool:
+        shared = TilePyramid(str(tmp_path / 'shared'), grid, [route])
+        assert shared.export(pool=pool) > 0
+        # a second export with other routes re-initializes the workers
+        other = TilePyramid(str(tmp_path / 'shared'), grid, [])
+        assert other.export(pool=pool) > 0
+        assert shared.export(pool=pool) > 0
+    assert shared._load_hashes() == own._load_hashes()
+    for zoom in range(own.min_zoom, own.max_zoom + 1):
+        for tile in own.tiles(zoom):
+            with Image.open(tile_path(own.path, *tile)) as img1, \
+                 Image.open(tile_path(shared.path, *tile)) as img2:
+                assert np.array_equal(np.array(img1), np.array(img2))
@@ -0,0 +1,193 @@
+import collections
+import email.utils
+import http.server
+import threading
+import pickle
+import json
+import time
+
+import pytest
+import requests
+
+import vector_tile_pb2
+import tilemap
+from tilecache import TileCache
+
+
+def make_tile():
+    tile  = vector_tile_pb2.Tile()
+    layer = tile.layers.add()
+    layer.name, layer.version, layer.extent = 'NUTZUNG', 2, 4096
+    layer.keys.append('class')
+    layer.values.add().string_value = 'Siedlung'
+    feature = layer.features.add()
+    feature.id, feature.type = 7, vector_tile_pb2.Tile.POLYGON
+    feature.tags.extend([0, 0])
+    feature.geometry.extend([9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15])
+    return tile.SerializeToString()
+
+
+# the parse duration is returned to the parent process, which records it
+def test_parse_tile_returns_duration():
+    config = pickle.dumps((None, None))
+    parse_time, features = tilemap._parse_tile((config, make_tile()))
+    assert parse_time >= 0.
+    assert [feature[0] for feature in features] == [
+        vector_tile_pb2.Tile.POLYGON
+    ]
+
+
+# stand-in tile server on a local port: GET /busy/<n> answers 429 (Retry-After
+# of 1 s) to the first n requests, GET /busydate/<n> likewise with an HTTP date
+# 2 s ahead (zone -0000), GET /drop/<n> closes the connection of the
+# first n requests without response, GET /slow/<key> answers after 0.1 s,
+# recording the number of concurrent requests, and the tiles of the map have
+# an ETag (304 for a matching If-None-Match)
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    lock   = threading.Lock()
+    hits   = collections.Counter()
+    active = 0
+    max_active = 0
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cls = StandInHandler
+        with cls.lock:
+            cls.hits[self.path] += 1
+            hits = cls.hits[self.path]
+        _, kind, arg = self.path.split('/', 2)
+        if kind == 'busy' and hits <= int(arg):
+            self.reply(429, headers=[('Retry-After', '1')])
+        elif kind == 'busydate' and hits <= int(arg):
+            self.reply(429, headers=[
+                ('Retry-After', email.utils.formatdate(time.time() + 2.))
+            ])
+        elif kind == 'drop' and hits <= int(arg):
+            self.close_connection = True
+        elif kind == 'slow':
+            with cls.lock:
+                cls.active    += 1
+                cls.max_active = max(cls.max_active, cls.active)
+            time.sleep(0.1)
+            with cls.lock:
+                cls.active -= 1
+            self.reply(200, arg.encode())
+        elif self.path == '/map/index.json':
+            self.reply(200, json.dumps({
+                'defaultStyles': 'styles', 'tiles': ['tile/{z}/{y}/{x}.pbf'],
+                'tileInfo': {
+                    'spatialReference': {'wkid': 3857},
+                    'origin': {'x': -20037508.34, 'y': 20037508.34},
+                    'lods': [{'level': 0, 'resolution': 78271.52}]
+                }
+            }).encode())
+        elif self.path == '/map/styles/root.json':
+            self.reply(200, b'{"layers": []}')
+        elif kind == 'map' and arg.startswith('tile/'):
+            if self.headers.get('If-None-Match', None) == '"v1"':
+                self.reply(304)
+            else:
+                self.reply(200, arg.encode(), [('ETag', '"v1"')])
+        else:
+            self.reply(200, b'ok')
+
+
+@pytest.fixture
+def stand_in():
+    StandInHandler.hits.clear()
+    StandInHandler.max_active = 0
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        yield url, tilemap.VectorTileMap(
+            f"{url}/map/index.json", workers=8, host_limit=3,
+            max_retries=2, backoff=0.01
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_request_retries_after_429(stand_in):
+    url, tmap = stand_in
+    start = time.perf_counter()
+    req = tmap._request('GET', f"{url}/busy/2")
+    assert req.status_code == 200
+    assert StandInHandler.hits['/busy/2'] == 3
+    # the delay requested by Retry-After replaces the (shorter) backoff
+    assert time.perf_counter() - start >= 2.
+
+    # the status of the last attempt is raised
+    with pytest.raises(requests.exceptions.HTTPError):
+        tmap._request('GET', f"{url}/busy/9")
+    assert StandInHandler.hits['/busy/9'] == 3
+
+    # Retry-After as HTTP date (in whole seconds, i.e., 1 to 2 s ahead)
+    start = time.perf_counter()
+    assert tmap._request('GET', f"{url}/busydate/1").status_code == 200
+    assert StandInHandler.hits['/busydate/1'] == 2
+    assert time.perf_counter() - start >= 0.9
+
+
+def test_request_retries_connection_errors(stand_in):
+    url, tmap = stand_in
+    assert tmap._request('GET', f"{url}/drop/2").status_code == 200
+    assert StandInHandler.hits['/drop/2'] == 3
+    with pytest.raises(requests.exceptions.ConnectionError):
+        tmap._request('GET', f"{url}/drop/9")
+    assert StandInHandler.hits['/drop/9'] == 3
+
+
+def test_map_limits_concurrent_requests(stand_in):
+    url, tmap = stand_in
+    fetch = lambda key: tmap._request('GET', f"{url}/slow/{key}").content
+    keys  = [str(key) for key in range(12)]
+    assert list(tmap._map(fetch, keys)) == [
+        (key, key.encode()) for key in keys
+    ]
+    assert StandInHandler.max_active == 3
+    assert sorted(tmap._map(fetch, keys, ordered=False)) == sorted(
+        (key, key.encode()) for key in keys
+    )
+    assert StandInHandler.max_active == 3
+
+
+# cached tiles are revalidated with a conditional request (unless younger than
+# max_age), a 304 response keeps the cached data and marks it as fresh
+def test_tile_revalidation(stand_in, tmp_path):
+    url, _ = stand_in
+    cache  = TileCache(str(tmp_path / 'tiles.sqlite'))
+    tmap   = tilemap.VectorTileMap(f"{url}/map/index.json", cache=cache)
+    path   = '/map/tile/0/0/0.pbf'
+    assert tmap._get_tile(0, 0, 0) == b'tile/0/0/0.pbf'
+    _, etag, _, fetched = cache.get_tile(0, 0, 0)
+    assert etag == '"v1"' and StandInHandler.hits[path] == 1
+
+    time.sleep(0.01)
+    assert tmap._get_tile(0, 0, 0) == b'tile/0/0/0.pbf'
+    assert StandInHandler.hits[path] == 2
+    assert cache.get_tile(0, 0, 0)[3] > fetched
+
+    # fresh tiles and offline mode do not use the network
+    for tmap in [
+        tilemap.VectorTileMap(f"{url}/map/index.json", cache=cache,
+                              max_age=60.),
+        tilemap.VectorTileMap(f"{url}/map/index.json", cache=cache,
+                              offline=True)
+    ]:
+        assert tmap._get_tile(0, 0, 0) == b'tile/0/0/0.pbf'
+    assert StandInHandler.hits[path] == 2
+    cache.close()
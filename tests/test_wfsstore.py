@@ -0,0 +1,43 @@
+import json
+
+from wfsstore import SnapshotStore
+
+
+# stand-in for a WFS response (GeoJSON feature collection) with one polygon per
+# feature id, whose coordinates are derived from the seed
+def response(features):
+    return json.dumps({'type': 'FeatureCollection', 'features': [{
+        'type': 'Feature', 'id': feature_id,
+        'properties': {'name': f"zone {feature_id}"},
+        'geometry': {'type': 'Polygon', 'coordinates': [[
+            [seed, 0], [seed + 1, 0], [seed + 1, 1], [seed, 0]
+        ]]}
+    } for feature_id, seed in features.items()]}, indent=1).encode()
+
+
+def test_update_reports_changes(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    assert store.latest('uaszone') is None
+
+    changes = store.update('uaszone', '2026-10-18', response({'a': 1, 'b': 2}))
+    assert changes == (['a', 'b'], [], [])
+    assert store.latest('uaszone') == '2026-10-18'
+
+    # a refresh of the same window is compared with its snapshot
+    data = response({'b': 3, 'c': 4})
+    assert store.update('uaszone', '2026-10-18', data) == (['c'], ['a'], ['b'])
+    assert store.get('uaszone', '2026-10-18') == data
+    assert set(store.hashes('uaszone', '2026-10-18')) == {'b', 'c'}
+
+    # a new window is compared with the latest snapshot, the formatting of the
+    # response does not change the hashes
+    data = json.dumps(json.loads(data)).encode()
+    assert store.update('uaszone', '2026-10-19', data) == ([], [], [])
+    assert store.hashes('uaszone', '2026-10-19') == (
+        store.hashes('uaszone', '2026-10-18')
+    )
+    assert store.latest('uaszone') == '2026-10-19'
+
+    # type names are independent
+    assert store.latest('airspace') is None
+    assert store.update('airspace', '2026-10-19', data) == (['b', 'c'], [], [])
@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+import time
+
+# persistent store of vector tiles and related resources (e.g., index and style
+# documents) in a SQLite database; the tiles table follows the MBTiles layout
+# (with TMS row numbering) extended by the validators of the HTTP responses and
+# access times, which are used to evict the least recently used tiles once the
+# total size of the cached data exceeds max_size bytes
+class TileCache:
+    def __init__(self, path, max_size=None):
+        self.max_size = max_size
+        self.lock     = threading.Lock()
+        self.db       = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata '
+                '(name TEXT PRIMARY KEY, value TEXT)'
+            )
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS tiles ('
+                'zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, '
+                'tile_data BLOB, etag TEXT, last_modified TEXT, '
+                'fetched REAL, accessed REAL, '
+                'PRIMARY KEY (zoom_level, tile_column, tile_row))'
+            )
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS availability ('
+                'zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, '
+                'available INTEGER, '
+                'PRIMARY KEY (zoom_level, tile_column, tile_row))'
+            )
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS resources ('
+                'url TEXT PRIMARY KEY, data BLOB, etag TEXT, '
+                'last_modified TEXT, fetched REAL, accessed REAL)'
+            )
+        self.size = self._total_size()
+
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+    def _total_size(self):
+        with self.lock:
+            size = 0
+            for table, column in [('tiles', 'tile_data'), ('resources', 'data')]:
+                size += self.db.execute(
+                    f"SELECT COALESCE(SUM(LENGTH({column})), 0) FROM {table}"
+                ).fetchone()[0]
+            return size
+
+
+    @staticmethod
+    def _tms_row(z, y):
+        return (1 << z) - 1 - y
+
+
+    def get_metadata(self, name, default=None):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT value FROM metadata WHERE name = ?', (name,)
+            ).fetchone()
+        return default if row is None else row[0]
+
+
+    def set_metadata(self, name, value):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?)', (name, value)
+            )
+
+
+    # get a cached tile as tuple (data, etag, last_modified, fetched) or None
+    def get_tile(self, z, x, y):
+        key = (z, x, self._tms_row(z, y))
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT tile_data, etag, last_modified, fetched FROM tiles '
+                'WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', key
+            ).fetchone()
+            if row is not None:
+                self.db.execute(
+                    'UPDATE tiles SET accessed = ? WHERE zoom_level = ? AND '
+                    'tile_column = ? AND tile_row = ?', (time.time(),) + key
+                )
+        return row
+
+
+    def put_tile(self, z, x, y, data, etag=None, last_modified=None):
+        now = time.time()
+        key = (z, x, self._tms_row(z, y))
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT LENGTH(tile_data) FROM tiles WHERE zoom_level = ? AND '
+                'tile_column = ? AND tile_row = ?', key
+            ).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (data, etag, last_modified, now, now)
+            )
+            self.size += len(data) - (0 if row is None else row[0])
+        self._evict()
+
+
+    # mark a cached tile as fresh (after a successful revalidation)
+    def touch_tile(self, z, x, y):
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE tiles SET fetched = ? WHERE zoom_level = ? AND '
+                'tile_column = ? AND tile_row = ?',
+                (time.time(), z, x, self._tms_row(z, y))
+            )
+
+
+    # coordinates (x, y) of all cached tiles of a zoom level
+    def tile_coords(self, z):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ? '
+                'ORDER BY tile_column, tile_row', (z,)
+            ).fetchall()
+        return [(x, self._tms_row(z, row)) for x, row in rows]
+
+
+    # known availability of the tiles of a zoom level as dictionary mapping
+    # coordinates (x, y) to True or False
+    def get_availability(self, z):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT tile_column, tile_row, available FROM availability '
+                'WHERE zoom_level = ?', (z,)
+            ).fetchall()
+        return {(x, self._tms_row(z, row)): bool(avail) for x, row, avail in rows}
+
+
+    def set_availability(self, z, coords):
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO availability VALUES (?, ?, ?, ?)', (
+                    (z, x, self._tms_row(z, y), int(avail))
+                    for (x, y), avail in coords.items()
+                )
+            )
+
+
+    # get a cached resource as tuple (data, etag, last_modified, fetched)
+    def get_resource(self, url):
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT data, etag, last_modified, fetched FROM resources '
+                'WHERE url = ?', (url,)
+            ).fetchone()
+            if row is not None:
+                self.db.execute(
+                    'UPDATE resources SET accessed = ? WHERE url = ?',
+                    (time.time(), url)
+                )
+        return row
+
+
+    def put_resource(self, url, data, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT LENGTH(data) FROM resources WHERE url = ?', (url,)
+            ).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)',
+                (url, data, etag, last_modified, now, now)
+            )
+            self.size += len(data) - (0 if row is None else row[0])
+
+
+    def touch_resource(self, url):
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE resources SET fetched = ? WHERE url = ?',
+                (time.time(), url)
+            )
+
+
+    # remove the least recently accessed tiles until the cache size is within
+    # the limit (resources are never evicted)
+    def _evict(self):
+        if self.max_size is None or self.size <= self.max_size:
+            return
+        with self.lock, self.db:
+            rows = self.db.execute(
+                'SELECT rowid, LENGTH(tile_data) FROM tiles ORDER BY accessed'
+            )
+            evict = []
+            for rowid, size in rows:
+                if self.size <= self.max_size:
+                    break
+                evict.append((rowid,))
+                self.size -= size
+            self.db.executemany('DELETE FROM tiles WHERE rowid = ?', evict)
@@ -0,0 +1,308 @@
+import numpy as np
+import multiprocessing
+import contextlib
+import hashlib
+import logging
+import json
+import pickle
+import math
+import os
+from PIL import Image, ImageDraw
+
+from geodraw import GeoDraw
+
+logger = logging.getLogger(__name__)
+
+# half the extent of the world in WGS84 / Pseudo-Mercator (EPSG 3857)
+MERCATOR_EXTENT = 20037508.342789244
+TILE_SIZE       = 256
+
+# state of the worker processes (the node values are inherited from the parent
+# process or loaded memory-mapped from a *.npy file, the routes are given in map
+# coordinates)
+_worker = {}
+
+def _init_worker(grid_vals, grid_scale, grid_orig, routes, style, path):
+    if isinstance(grid_vals, str):
+        grid_vals = np.load(grid_vals, mmap_mode='r')
+    _worker['vals']   = grid_vals
+    _worker['scale']  = grid_scale
+    _worker['orig']   = grid_orig
+    _worker['routes'] = routes
+    _worker['style']  = style
+    _worker['path']   = path
+    _worker['draw']   = GeoDraw((1, 1))
+
+
+# task (function, pickled configuration, token, argument) for a pool of generic
+# workers, which are (re-)initialized if the task belongs to another export than
+# their previous task
+def _run_with(task):
+    func, config, token, arg = task
+    if _worker.get('token') != token:
+        _init_worker(*pickle.loads(config))
+        _worker['token'] = token
+    return func(arg)
+
+
+def tile_bounds(zoom, x, y):
+    size = 2. * MERCATOR_EXTENT / (1 << zoom)
+    x0   = -MERCATOR_EXTENT + x * size
+    y0   =  MERCATOR_EXTENT - y * size
+    return (x0, y0 - size, x0 + size, y0)
+
+
+def tile_path(path, zoom, x, y):
+    return os.path.join(path, str(zoom), str(x), f"{y}.png")
+
+
+# pixel coordinates of map coordinates within a tile
+def _to_pixels(coords, bounds):
+    scale = TILE_SIZE / (bounds[2] - bounds[0])
+    return np.stack((
+        (coords[:, 0] - bounds[0]) * scale, (bounds[3] - coords[:, 1]) * scale
+    ), axis=-1)
+
+
+# render a tile of the base level (nearest node per pixel), unless the hash of
+# its source cells and route segments matches the hash of the last export;
+# returns a tuple (tile, hash, rendered)
+def _render_tile(task):
+    (zoom, x, y), old_hash = task
+    vals, scale, orig = _worker['vals'], _worker['scale'], _worker['orig']
+    style = _worker['style']
+
+    # nodes sampled at the pixel centers
+    bounds = tile_bounds(zoom, x, y)
+    pix    = (np.arange(TILE_SIZE) + 0.5) * (bounds[2] - bounds[0]) / TILE_SIZE
+    cols   = np.floor((bounds[0] + pix - orig[0]) / scale + 0.5).astype(np.intp)
+    rows   = np.floor((orig[1] - (bounds[3] - pix)) / scale + 0.5).astype(np.intp)
+    col_ok = (cols >= 0) & (cols < vals.shape[0])
+    row_ok = (rows >= 0) & (rows < vals.shape[1])
+    cells  = np.full((TILE_SIZE, TILE_SIZE), np.nan, np.float32)
+    cells[np.ix_(row_ok, col_ok)] = vals[
+        np.ix_(cols[col_ok], rows[row_ok])
+    ].T
+
+    # runs of consecutive route segments whose bounding box intersects the tile
+    # (extended by the route width), segments may cross a tile without any of
+    # their vertices being close to it
+    lines  = []
+    margin = style['route_width']
+    for route in _worker['routes']:
+        pixels = _to_pixels(route, bounds)
+        if len(pixels) < 2:
+            continue
+        lower  = np.minimum(pixels[:-1], pixels[1:])
+        upper  = np.maximum(pixels[:-1], pixels[1:])
+        crosses = np.all(
+            (upper >= -margin) & (lower <= TILE_SIZE + margin), axis=1
+        )
+        # split the route at the segments not crossing the tile
+        edges  = np.diff(np.concatenate(([0], crosses.astype(np.int8), [0])))
+        for start, end in zip(np.flatnonzero(edges == 1),
+                              np.flatnonzero(edges == -1)):
+            lines.append(np.round(pixels[start:end + 1], 1))
+
+    sha = hashlib.sha256(cells.tobytes())
+    for line in lines:
+        sha.update(line.tobytes())
+    tile_hash = sha.hexdigest()
+    out_path  = tile_path(_worker['path'], zoom, x, y)
+    if tile_hash == old_hash and os.path.exists(out_path):
+        return ((zoom, x, y), tile_hash, False)
+
+    # elevation colors, exclusion color for removed nodes and transparent
+    # pixels outside of the grid or the palette
+    pixels = np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8)
+    with np.errstate(invalid='ignore'):
+        valid    = (cells >= 0.) & (cells <= style['max_val'])
+        excluded = cells < 0.
+    pixels[..., :3] = _worker['draw'].palette_colors(
+        cells / style['max_val'], 4096
+    )
+    pixels[valid, 3] = 255
+    pixels[excluded] = style['exclusion_color']
+    img = Image.fromarray(pixels, 'RGBA')
+    draw = ImageDraw.Draw(img)
+    for line in lines:
+        draw.line(
+            [tuple(point) for point in line], fill=style['route_color'],
+            width=style['route_width']
+        )
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    img.save(out_path)
+    return ((zoom, x, y), tile_hash, True)
+
+
+# render an overview tile by downsampling its four child tiles
+def _render_overview(tile):
+    zoom, x, y = tile
+    mosaic = Image.new('RGBA', (2 * TILE_SIZE, 2 * TILE_SIZE))
+    for dx in range(2):
+        for dy in range(2):
+            child = tile_path(_worker['path'], zoom + 1, 2 * x + dx, 2 * y + dy)
+            if os.path.exists(child):
+                with Image.open(child) as img:
+                    mosaic.paste(img, (dx * TILE_SIZE, dy * TILE_SIZE))
+    out_path = tile_path(_worker['path'], zoom, x, y)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    mosaic.reduce(2).save(out_path)
+    return tile
+
+
+# pyramid of z/x/y PNG tiles (XYZ / slippy map scheme, EPSG 3857) of a grid
+# (elevation colors and removed nodes) and routes (lists of grid nodes); the
+# base level is the lowest zoom level whose pixels are not larger than the grid
+# cells, the overview levels down to min_zoom are built from the child tiles;
+# the hashes of the base tiles are stored in tiles.json such that subsequent
+# exports only re-render the tiles whose source cells or routes changed
+class TilePyramid:
+    def __init__(self, path, grid, routes=(), min_zoom=None, max_zoom=None,
+                 max_val=4500., exclusion_color=(255, 0, 0, 96),
+                 route_color=(255, 0, 0, 255), route_width=2):
+        self.path = path
+        self.grid = grid
+        self.routes = [
+            grid.grid_to_coords([node[:2] for node in route])
+            for route in routes if len(route) > 0
+        ]
+        self.style = {
+            'max_val':         max_val,
+            'exclusion_color': tuple(exclusion_color),
+            'route_color':     tuple(route_color),
+            'route_width':     route_width
+        }
+
+        # grid bounds (min_x, min_y, max_x, max_y) in map coordinates
+        self.bounds = (
+            grid.orig[0] - grid.scale / 2.,
+            grid.orig[1] - (grid.size[1] - .5) * grid.scale,
+            grid.orig[0] + (grid.size[0] - .5) * grid.scale,
+            grid.orig[1] + grid.scale / 2.
+        )
+        if max_zoom is None:
+            max_zoom = math.ceil(math.log2(
+                2. * MERCATOR_EXTENT / (TILE_SIZE * grid.scale)
+            ))
+        if min_zoom is None:
+            extent   = max(self.bounds[2] - self.bounds[0],
+                           self.bounds[3] - self.bounds[1])
+            min_zoom = max(0, min(max_zoom, math.floor(math.log2(
+                2. * MERCATOR_EXTENT / extent
+            ))))
+        self.min_zoom, self.max_zoom = min_zoom, max_zoom
+
+
+    # tiles (zoom, x, y) covering the grid at a zoom level
+    def tiles(self, zoom):
+        size = 2. * MERCATOR_EXTENT / (1 << zoom)
+        x0 = int((self.bounds[0] + MERCATOR_EXTENT) // size)
+        x1 = int((self.bounds[2] + MERCATOR_EXTENT) // size)
+        y0 = int((MERCATOR_EXTENT - self.bounds[3]) // size)
+        y1 = int((MERCATOR_EXTENT - self.bounds[1]) // size)
+        return [
+            (zoom, x, y) for x in range(max(x0, 0), min(x1, (1 << zoom) - 1) + 1)
+                         for y in range(max(y0, 0), min(y1, (1 << zoom) - 1) + 1)
+        ]
+
+
+    def _params(self):
+        return {
+            'min_zoom': self.min_zoom,
+            'max_zoom': self.max_zoom,
+            'style':    self.style,
+            'grid':     [list(self.grid.size), self.grid.scale,
+                         list(self.grid.orig)]
+        }
+
+
+    def _load_hashes(self):
+        try:
+            with open(os.path.join(self.path, 'tiles.json')) as src:
+                manifest = json.load(src)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('params') != json.loads(json.dumps(self._params())):
+            return {}
+        return manifest.get('hashes', {})
+
+
+    def _save_hashes(self, hashes):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, 'tiles.json.tmp')
+        with open(tmp_path, 'w') as dst:
+            json.dump({'params': self._params(), 'hashes': hashes}, dst)
+        os.replace(tmp_path, os.path.join(self.path, 'tiles.json'))
+
+
+    # render all changed tiles with a pool of worker processes, returns the
+    # number of rendered tiles
+    #
+    # instead of starting its own pool, an existing pool (without initializer)
+    # can be used, e.g., one that was started before the calling process started
+    # other threads (forking a multi-threaded process may deadlock the workers);
+    # the configuration is sent with the tasks and the workers load the node
+    # values from their file, i.e., they must be memory-mapped from a *.npy file
+    def export(self, processes=None, pool=None):
+        old_hashes = self._load_hashes()
+        hashes     = {}
+        tasks      = [
+            (tile, old_hashes.get('/'.join(map(str, tile))))
+            for tile in self.tiles(self.max_zoom)
+        ]
+        num_rendered = 0
+        if pool is None:
+            tile_pool = multiprocessing.Pool(processes, _init_worker, (
+                self.grid.vals, self.grid.scale, self.grid.orig, self.routes,
+                self.style, self.path
+            ))
+            imap = lambda func, args, chunksize=1: tile_pool.imap_unordered(
+                func, args, chunksize
+            )
+        else:
+            assert getattr(self.grid.vals, 'filename', None) is not None, (
+                "a shared pool requires node values memory-mapped from a file")
+            tile_pool = contextlib.nullcontext(pool)
+            config    = pickle.dumps((
+                str(self.grid.vals.filename), self.grid.scale, self.grid.orig,
+                self.routes, self.style, self.path
+            ))
+            token     = os.urandom(8)
+            imap = lambda func, args, chunksize=1: pool.imap_unordered(
+                _run_with, [(func, config, token, arg) for arg in args],
+                chunksize
+            )
+        with tile_pool:
+            changed = set()
+            for tile, tile_hash, rendered in imap(
+                _render_tile, tasks, chunksize=16
+            ):
+                hashes['/'.join(map(str, tile))] = tile_hash
+                if rendered:
+                    changed.add(tile)
+            num_rendered += len(changed)
+            logger.info(
+                f"rendered {len(changed)} of {len(tasks)} tiles at zoom "
+                f"level {self.max_zoom}"
+            )
+
+            # overview tiles with changed (or missing) children
+            for zoom in range(self.max_zoom - 1, self.min_zoom - 1, -1):
+                tiles = [
+                    tile for tile in self.tiles(zoom) if not os.path.exists(
+                        tile_path(self.path, *tile)
+                    ) or any(
+                        (zoom + 1, 2 * tile[1] + dx, 2 * tile[2] + dy) in changed
+                        for dx in range(2) for dy in range(2)
+                    )
+                ]
+                changed = set(imap(_render_overview, tiles))
+                num_rendered += len(changed)
+                logger.info(
+                    f"rendered {len(changed)} overview tiles at zoom level "
+                    f"{zoom}"
+                )
+
+        self._save_hashes(hashes)
+        return num_rendered
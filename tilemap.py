@@ -1,30 +1,77 @@
-
-from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse
+from collections import deque
+from datetime import datetime, timezone
+import numpy as np
+import multiprocessing
+import contextlib
 import requests
+import threading
+import queue
+import random
+import pickle
+import json
+import math
 import re
 import time
 import logging
+import os
+
+import shapely.geometry as shp
+from shapely.ops import linemerge, unary_union, clip_by_rect
+from shapely.validation import make_valid
 
 import vector_tile_pb2
+import telemetry
+from stylefilter import compile_filter, bind_filters, tile_value
 
 class VectorTileMap:
-    def __init__(self, index_url, style_url=None, logger=None):
+    # HTTP status codes of responses that are retried
+    RETRY_STATUS = [429, 500, 502, 503, 504]
+
+    def __init__(self, index_url, style_url=None, logger=None, workers=8,
+                 host_limit=8, max_retries=8, backoff=0.5, max_backoff=60.,
+                 cache=None, offline=False, max_age=None):
         self.logger = logging.getLogger(
             VectorTileMap.__qualname__ if logger is None else logger
         )
 
+        # optional tile cache (TileCache); cached data younger than max_age
+        # seconds is used as is, older data is revalidated with a conditional
+        # request, and in offline mode the network is never used
+        self.cache   = cache
+        self.offline = offline
+        self.max_age = max_age
+        assert cache is not None or not offline, "offline mode requires a cache"
+
+        # availability of tiles learned by probing, per level
+        self.available = {}
+
+        # pooled HTTP session shared by all fetching threads; the number of
+        # concurrent requests per host is limited separately
+        self.workers     = workers
+        self.host_limit  = host_limit
+        self.max_retries = max_retries
+        self.backoff     = backoff
+        self.max_backoff = max_backoff
+        self.host_sems   = {}
+        self.host_lock   = threading.Lock()
+        self.session     = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=workers, pool_maxsize=workers
+        )
+        self.session.mount('http://' , adapter)
+        self.session.mount('https://', adapter)
+
         # load index
-        req = requests.get(index_url)
-        assert req.status_code == 200, f"{index_url}: status {req.status_code}"
-        self.index = req.json()
+        self.index = json.loads(self._get_resource(index_url))
 
         # load style
         if style_url is None:
             style_url  = urljoin(index_url, self.index['defaultStyles'])
             style_url += '/root.json'
-        req = requests.get(style_url)
-        assert req.status_code == 200, f"{style_url}: status {req.status_code}"
-        self.style = req.json()
+        self.style = json.loads(self._get_resource(style_url))
 
         # extract information from index
         self.tile_url = urljoin(index_url, self.index['tiles'][0])
@@ -38,6 +85,166 @@ class VectorTileMap:
             self.lods.append((lod['level'], lod['resolution'] * 512))
 
 
+    @staticmethod
+    def _retry_after(req):
+        # delay in seconds requested by the Retry-After header (if any)
+        val = req.headers.get('Retry-After', None)
+        if val is None:
+            return None
+        try:
+            return max(0., float(val))
+        except ValueError:
+            pass
+        try:
+            date = parsedate_to_datetime(val)
+        except (TypeError, ValueError):
+            return None
+        # dates with the zone -0000 are parsed as naive datetimes (in UTC)
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return max(0., (date - datetime.now(timezone.utc)).total_seconds())
+
+
+    # HTTP request with retries on connection errors and server errors, using
+    # exponential backoff with full jitter (or the delay given by Retry-After)
+    def _request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        with self.host_lock:
+            sem = self.host_sems.get(host, None)
+            if sem is None:
+                sem = threading.Semaphore(self.host_limit)
+                self.host_sems[host] = sem
+        for attempt in range(self.max_retries + 1):
+            delay = None
+            if attempt > 0:
+                telemetry.count('http.retries')
+            try:
+                with sem:
+                    t_start = time.perf_counter()
+                    req = self.session.request(method, url, **kwargs)
+                    telemetry.observe(
+                        'http.latency', time.perf_counter() - t_start
+                    )
+            except requests.exceptions.ConnectionError:
+                telemetry.count('http.connection_errors')
+                if attempt == self.max_retries:
+                    raise
+                self.logger.info(f"{url}: connection error, trying again")
+            else:
+                telemetry.count('http.requests')
+                telemetry.count(f"http.status.{req.status_code}")
+                telemetry.count('http.bytes', len(req.content))
+                if req.status_code not in self.RETRY_STATUS:
+                    return req
+                if attempt == self.max_retries:
+                    req.raise_for_status()
+                self.logger.info(
+                    f"{url}: status {req.status_code}, trying again"
+                )
+                delay = self._retry_after(req)
+            if delay is None:
+                delay = random.uniform(
+                    0., min(self.max_backoff, self.backoff * 2**attempt)
+                )
+            time.sleep(delay)
+
+
+    # apply func to several keys concurrently with a bounded number of pending
+    # calls; yields (key, result) for each key either in the order of the
+    # input or in the order of completion
+    def _map(self, func, keys, ordered=True):
+        keys   = iter(keys)
+        window = 2 * self.workers
+        with ThreadPoolExecutor(self.workers) as pool:
+            def submit():
+                key = next(keys, None)
+                if key is None:
+                    return None
+                return key, pool.submit(func, key)
+
+            if ordered:
+                pending = deque()
+                while True:
+                    while len(pending) < window:
+                        job = submit()
+                        if job is None:
+                            break
+                        pending.append(job)
+                    if len(pending) == 0:
+                        break
+                    key, future = pending.popleft()
+                    yield key, future.result()
+            else:
+                pending = {}
+                while True:
+                    while len(pending) < window:
+                        job = submit()
+                        if job is None:
+                            break
+                        pending[job[1]] = job[0]
+                    if len(pending) == 0:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+
+
+    # get a resource through the cache; returns a tuple (status, data), where
+    # cached is either None or a tuple (data, etag, last_modified, fetched)
+    # and store(data, etag, last_modified) / touch() update the cache
+    def _get_cached(self, url, cached, store, touch):
+        if cached is not None:
+            data, etag, last_modified, fetched = cached
+            if self.offline or (
+                self.max_age is not None and time.time() - fetched < self.max_age
+            ):
+                telemetry.count('cache.hits')
+                return 200, data
+        elif self.offline:
+            return 404, None
+        headers = {}
+        if cached is not None:
+            # conditional request to revalidate the cached data
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+        req = self._request('GET', url, headers=headers)
+        if req.status_code == 304 and cached is not None:
+            telemetry.count('cache.revalidated')
+            touch()
+            return 200, data
+        if req.status_code == 200 and self.cache is not None:
+            store(
+                req.content, req.headers.get('ETag', None),
+                req.headers.get('Last-Modified', None)
+            )
+        return req.status_code, req.content
+
+
+    def _get_resource(self, url):
+        cached = None if self.cache is None else self.cache.get_resource(url)
+        status, data = self._get_cached(
+            url, cached,
+            lambda *args: self.cache.put_resource(url, *args),
+            lambda: self.cache.touch_resource(url)
+        )
+        assert status == 200, f"{url}: status {status}"
+        return data
+
+
+    # get the raw data of a tile, returns None if the tile does not exist
+    def _get_tile(self, level, x, y):
+        url    = self.tile_url.format(z=level, y=y, x=x)
+        cached = None if self.cache is None else self.cache.get_tile(level, x, y)
+        status, data = self._get_cached(
+            url, cached,
+            lambda *args: self.cache.put_tile(level, x, y, *args),
+            lambda: self.cache.touch_tile(level, x, y)
+        )
+        return data if status == 200 else None
+
+
     def get_style_layers(self, zoom_level=None):
         for layer in self.style['layers']:
             zoom_range = layer.get('minzoom', 0), layer.get('maxzoom', 256)
@@ -48,6 +255,14 @@ class VectorTileMap:
                 yield layer
 
 
+    # convert nested lists of a style filter to (hashable) tuples
+    @staticmethod
+    def _freeze(expr):
+        if isinstance(expr, list):
+            return tuple(VectorTileMap._freeze(item) for item in expr)
+        return expr
+
+
     # convert style layers to filters (dictionary for filtering features)
     def get_style_filters(self, style_layer_patterns, zoom_level=None):
         filters = {}
@@ -63,130 +278,373 @@ class VectorTileMap:
                     if layer_filter is None:
                         filters[source_layer] = None
                     else:
-                        layer_filter = set([tuple(layer_filter)])
+                        layer_filter = set([self._freeze(layer_filter)])
                         prev_filters = filters.get(source_layer, set())
                         if prev_filters is not None:
                             filters[source_layer] = prev_filters | layer_filter
         return filters
 
 
-    # binary search to find locations of tiles (avoid trying all urls)
-    def _get_tile_coords(self, lod_seq, coords=None):
-        self.logger.info(f"probing tile coordinates for LOD {lod_seq[0][0]}")
+    # range of tile coordinates (x0, y0, x1, y1) of a LOD that covers the
+    # bounding box (min_x, min_y, max_x, max_y) in the map CRS
+    def _tile_range(self, lod, bbox=None):
+        level, size = lod
+        extent = 2**level
+        if bbox is None:
+            return 0, 0, extent - 1, extent - 1
+        clip = lambda val: min(max(val, 0), extent - 1)
+        return (
+            clip(math.floor((bbox[0] - self.orig[0]) / size)),
+            clip(math.floor((self.orig[1] - bbox[3]) / size)),
+            clip(math.floor((bbox[2] - self.orig[0]) / size)),
+            clip(math.floor((self.orig[1] - bbox[1]) / size))
+        )
+
+
+    # known availability of the tiles of a level (loaded from the cache once)
+    def _get_availability(self, level):
+        available = self.available.get(level, None)
+        if available is None:
+            available = {}
+            if self.cache is not None:
+                available = self.cache.get_availability(level)
+            self.available[level] = available
+        return available
+
+
+    def _set_availability(self, level, coords):
+        self._get_availability(level).update(coords)
+        if self.cache is not None and len(coords) > 0:
+            self.cache.set_availability(level, coords)
+
+
+    # binary search to find locations of tiles (avoid trying all urls); only
+    # tiles within the bounding box are probed and tiles of known availability
+    # are not probed at all
+    def _get_tile_coords(self, lod_seq, coords=None, bbox=None):
+        level = lod_seq[0][0]
+        self.logger.info(f"probing tile coordinates for LOD {level}")
+        x0, y0, x1, y1 = self._tile_range(lod_seq[0], bbox)
         if coords is None:
-            extent = 2**lod_seq[0][0]
-            coords = [(x, y) for x in range(extent) for y in range(extent)]
+            coords = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+        coords    = [(x, y) for x, y in coords if x0 <= x <= x1 and y0 <= y <= y1]
+        available = self._get_availability(level)
+        unknown   = [coord for coord in coords if coord not in available]
+        probe = lambda coord: self._request('HEAD', self.tile_url.format(
+            z=level, y=coord[1], x=coord[0]
+        ))
+        probed = {}
+        telemetry.count('tiles.availability_known', len(coords) - len(unknown))
+        with telemetry.span('probe tiles', level=level, tiles=len(unknown)):
+            for cnt, (coord, req) in enumerate(self._map(probe, unknown)):
+                self.logger.info(f"probed tile {cnt} of {len(unknown)}")
+                probed[coord] = req.status_code == 200
+                telemetry.count('tiles.probed')
+                if probed[coord]:
+                    telemetry.count('tiles.available')
+        self._set_availability(level, probed)
         next_coords = []
-        for cnt, (x, y) in enumerate(coords):
-            self.logger.info(f"probing tile {cnt} of {len(coords)}")
-            while True:
-                try:
-                    req = requests.head(
-                        self.tile_url.format(z=lod_seq[0][0], y=y, x=x)
-                    )
-                except requests.exceptions.ConnectionError:
-                    self.logger.info(f"connection error, trying again")
-                    pass
-                else:
-                    if req.status_code in [429, 500, 502, 503, 504]:
-                        self.logger.info(f"server error, trying again")
-                    else:
-                        break
-            if req.status_code == 200:
+        for x, y in coords:
+            if available[(x, y)]:
                 x, y = x * 2, y * 2
                 next_coords += [(x, y), (x + 1, y), (x, y + 1), (x + 1, y + 1)]
         if len(lod_seq) == 1:
             return next_coords
-        return self._get_tile_coords(lod_seq[1:], next_coords)
+        return self._get_tile_coords(lod_seq[1:], next_coords, bbox)
 
 
-    def _get_tiles(self, lod, bufcnt=10):
+    # fetch the raw data of all tiles of a LOD, yields tuples (data, (x, y))
+    def _fetch_tiles(self, lod, ordered=True, bbox=None):
         level, scale = self.lods[lod]
-        coords       = self._get_tile_coords(self.lods[1:lod])
-        tilebuf      = []
-        for cnt, (x, y) in enumerate(coords):
-            self.logger.info(f"fetching tile {cnt} of {len(coords)}")
-            while True:
+        if self.offline:
+            # only the cached tiles are available in offline mode
+            coords = self.cache.tile_coords(level)
+        else:
+            coords = self._get_tile_coords(self.lods[1:lod], None, bbox)
+        # skip tiles outside of the bounding box or known to be unavailable
+        x0, y0, x1, y1 = self._tile_range(self.lods[lod], bbox)
+        available = self._get_availability(level)
+        coords = [
+            (x, y) for x, y in coords if x0 <= x <= x1 and y0 <= y <= y1
+                                     and available.get((x, y), True)
+        ]
+        fetch  = lambda coord: self._get_tile(level, coord[0], coord[1])
+        probed = {}
+        for cnt, ((x, y), data) in enumerate(self._map(fetch, coords, ordered)):
+            self.logger.info(f"fetched tile {cnt} of {len(coords)}")
+            if not self.offline:
+                probed[(x, y)] = data is not None
+            if data is not None:
+                telemetry.count('tiles.fetched')
+                telemetry.observe('tiles.size', len(data))
+                yield data, (x, y)
+            else:
+                telemetry.count('tiles.missing')
+        self._set_availability(level, probed)
+
+
+    def _get_tiles(self, lod, ordered=True, bbox=None):
+        for data, tile_pos in self._fetch_tiles(lod, ordered, bbox):
+            t_start = time.perf_counter()
+            tile = vector_tile_pb2.Tile()
+            tile.ParseFromString(data)
+            telemetry.observe('tiles.parse_time', time.perf_counter() - t_start)
+            telemetry.count('tiles.parsed')
+            yield tile, tile_pos
+
+
+    def _query_features(self, lod, filters=None, ordered=True, bbox=None):
+        compiled = _compile_filters(filters)
+        for tile, tile_pos in self._get_tiles(lod, ordered, bbox):
+            for feature, extent, _ in _filter_features(tile, compiled):
+                yield (feature, extent, tile_pos)
+
+
+    # pipeline of the stages fetching tiles (thread pool), parsing and
+    # filtering tiles (process pool) and consuming the features (caller),
+    # which are connected by bounded queues; yields tuples (feature type,
+    # extent, tile position, geometry array, merge group); the filters are sent
+    # with the tasks, such that an existing pool can be used (e.g., one started
+    # before other threads and shared with other work)
+    def _parse_features(self, lod, filters=None, ordered=True, bbox=None,
+                        processes=None, merge_key=None, pool=None):
+        processes = processes or os.cpu_count()
+        config    = pickle.dumps((filters, merge_key))
+        pending   = queue.Queue(maxsize=2 * processes)
+        stop      = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
                 try:
-                    req = requests.get(self.tile_url.format(z=level, y=y, x=x))
-                except requests.exceptions.ConnectionError:
-                    self.logger.info(f"connection error, trying again")
+                    pending.put(item, timeout=0.1)
+                    return
+                except queue.Full:
                     pass
+
+        # the worker processes are started before the fetching thread
+        with (
+            multiprocessing.Pool(processes) if pool is None
+            else contextlib.nullcontext(pool)
+        ) as parse_pool:
+            def produce():
+                try:
+                    for data, tile_pos in self._fetch_tiles(lod, ordered, bbox):
+                        if stop.is_set():
+                            return
+                        put((parse_pool.apply_async(
+                            _parse_tile, ((config, data),)
+                        ), tile_pos))
+                except BaseException as exc:
+                    put(exc)
                 else:
-                    if req.status_code in [429, 500, 502, 503, 504]:
-                        self.logger.info(f"server error, trying again")
-                    else:
+                    put(None)
+
+            producer = threading.Thread(target=produce, daemon=True)
+            producer.start()
+            try:
+                while True:
+                    item = pending.get()
+                    if item is None:
                         break
-                time.sleep(5)
-            if req.status_code == 200:
-                tile = vector_tile_pb2.Tile()
-                tile.ParseFromString(req.content)
-                tilebuf.append((tile, (x, y)))
-            if len(tilebuf) > bufcnt:
-                for tile in tilebuf:
-                    yield tile
-                tilebuf = []
-        for tile in tilebuf:
-            yield tile
-
-
-    def _query_features(self, lod, filters=None):
-        for tile, tile_pos in self._get_tiles(lod):
-            for layer in tile.layers:
-                if filters is None or layer.name in filters:
-                    extent = layer.extent
-                    for feature in layer.features:
-                        if filters is None or filters[layer.name] is None:
-                            yield (feature, extent, tile_pos)
-                        else:
-                            # get tags for this feature
-                            tags = {
-                                layer.keys[key]: layer.values[val].sint_value
-                                for key, val
-                                in zip(feature.tags[::2], feature.tags[1::2])
-                            }
-                            # evaluate filters
-                            for op, val1, val2 in filters[layer.name]:
-                                if isinstance(val1, str) and val1 in tags:
-                                    val1 = tags[val1]
-                                if isinstance(val2, str) and val2 in tags:
-                                    val2 = tags[val2]
-                                if eval(f"{val1} {op} {val2}"):
-                                    yield (feature, extent, tile_pos)
-                                    break
-
-
-    def query_shapes(self, lod, filters=None):
-        for feature, extent, tile_pos in self._query_features(lod, filters):
-            shape = []
-            pos   = (0, 0)
-            op    = None
-            cnt   = 0
-            for geometry in feature.geometry:
-                if op is None:
-                    op  = geometry & 0x7
-                    cnt = (geometry >> 3) * 2
-                else:
-                    val = (geometry >> 1) ^ (-(geometry & 1))
-                    if (cnt & 1) == 0:
-                        pos = (pos[0] + val, pos[1])
-                    else:
-                        pos = (pos[0], pos[1] + val)
-                        if op == 1:
-                            shape.append([pos])
-                        elif op == 2:
-                            shape[-1].append(pos)
-                        else:
-                            raise ValueError("invalid geometry command")
-                    cnt -= 1
-                if op == 7 or cnt == 0:
-                    op = None
-            for line in shape:
-                # convert to coordinates
-                x0, y0 = (
-                    self.orig[0] + tile_pos[0] * self.lods[lod][1],
-                    self.orig[1] - tile_pos[1] * self.lods[lod][1]
-                )
-                scale  = self.lods[lod][1] / extent
-                line   = [(x0 + x * scale, y0 - y * scale) for x, y in line]
-                yield (feature.type, line)
+                    if isinstance(item, BaseException):
+                        raise item
+                    result, tile_pos = item
+                    parse_time, features = result.get()
+                    telemetry.observe('tiles.parse_time', parse_time)
+                    telemetry.count('tiles.parsed')
+                    for feature_type, extent, geometry, group in features:
+                        yield (feature_type, extent, tile_pos, geometry, group)
+            finally:
+                stop.set()
+                producer.join()
+
+
+    # query the shapes of all features matching the filters, optionally only
+    # within the bounding box (min_x, min_y, max_x, max_y) in the map CRS;
+    # tiles are parsed by the given number of worker processes (all CPUs by
+    # default, or in the calling process if 0) or by an existing pool and
+    # yields tuples (feature type, array of map coordinates)
+    #
+    # with a merge key ('$id' for the feature id or the name of an attribute)
+    # the geometries are clipped to their tile (removing the tile buffer) and
+    # lines and polygons of features of the same layer sharing the same id or
+    # attribute value are merged across tiles before being yielded (features
+    # without id or attribute are only clipped)
+    def query_shapes(self, lod, filters=None, ordered=True, bbox=None,
+                     processes=None, merge_key=None, pool=None):
+        if processes == 0 and pool is None:
+            compiled = _compile_filters(filters)
+            features = (
+                (feature.type, extent, tile_pos, feature.geometry, group)
+                for tile, tile_pos in self._get_tiles(lod, ordered, bbox)
+                for feature, extent, group
+                in _filter_features(tile, compiled, merge_key)
+            )
+        else:
+            features = self._parse_features(
+                lod, filters, ordered, bbox, processes, merge_key, pool
+            )
+        groups = {}
+        for feature_type, extent, tile_pos, geometry, group in features:
+            # convert to coordinates
+            size   = self.lods[lod][1]
+            x0, y0 = (
+                self.orig[0] + tile_pos[0] * size,
+                self.orig[1] - tile_pos[1] * size
+            )
+            scale = size / extent
+            lines = []
+            for line in decode_geometry(geometry):
+                coords = np.empty(line.shape)
+                coords[:, 0] = x0 + line[:, 0] * scale
+                coords[:, 1] = y0 - line[:, 1] * scale
+                lines.append(coords)
+            if merge_key is None or feature_type not in [2, 3]:
+                for coords in lines:
+                    yield (feature_type, coords)
+                continue
+            shape = _clip_shape(feature_type, lines, (x0, y0 - size, x0 + size, y0))
+            if group is None:
+                for coords in _shape_coords(feature_type, shape):
+                    yield (feature_type, coords)
+            else:
+                groups.setdefault((feature_type, group), []).append(shape)
+        # merge the fragments of each group
+        for (feature_type, group), shapes in groups.items():
+            shape = unary_union(shapes)
+            if feature_type == 2 and shape.geom_type == 'MultiLineString':
+                shape = linemerge(shape)
+            for coords in _shape_coords(feature_type, shape):
+                yield (feature_type, coords)
+
+
+# clip the lines (feature type 2) or polygon rings (feature type 3) of a feature
+# to the bounds of its tile, returns a shapely geometry
+def _clip_shape(feature_type, lines, bounds):
+    if feature_type == 2:
+        shape = shp.MultiLineString([line for line in lines if len(line) > 1])
+    else:
+        # each ring is treated as a polygon on its own (see GeoGrid.rm_polygon)
+        shape = unary_union([
+            make_valid(shp.Polygon(ring)) for ring in lines if len(ring) > 2
+        ])
+    return clip_by_rect(shape, *bounds)
+
+
+# coordinate arrays of the lines or polygon exteriors of a shapely geometry
+def _shape_coords(feature_type, shape):
+    parts = getattr(shape, 'geoms', [shape])
+    for part in parts:
+        if part.is_empty:
+            continue
+        if feature_type == 2 and part.geom_type == 'LineString':
+            yield np.array(part.coords)
+        elif feature_type == 3 and part.geom_type == 'Polygon':
+            yield np.array(part.exterior.coords)
+        elif hasattr(part, 'geoms'):
+            yield from _shape_coords(feature_type, part)
+
+
+# compile the filters once, they are bound to the keys and values of each tile
+# layer, such that testing a feature only compares indices
+def _compile_filters(filters):
+    if filters is None:
+        return None
+    return {
+        name: None if layer_filters is None else [
+            compile_filter(layer_filter) for layer_filter in layer_filters
+        ] for name, layer_filters in filters.items()
+    }
+
+
+# features of a tile matching the compiled filters as tuples (feature, extent,
+# merge group), where the merge group is a tuple (layer name, value of the merge
+# key) or None if the feature has no such value
+def _filter_features(tile, compiled, merge_key=None):
+    for layer in tile.layers:
+        if compiled is None or layer.name in compiled:
+            extent = layer.extent
+            group  = _merge_group(layer, merge_key)
+            if compiled is None or compiled[layer.name] is None:
+                for feature in layer.features:
+                    yield (feature, extent, group(feature))
+            else:
+                matches = bind_filters(compiled[layer.name], layer)
+                for feature in layer.features:
+                    if matches(feature):
+                        yield (feature, extent, group(feature))
+
+
+# function determining the merge group of the features of a layer
+def _merge_group(layer, merge_key):
+    if merge_key is None:
+        return lambda feature: None
+    if merge_key == '$id':
+        return lambda feature: (layer.name, feature.id) if feature.id else None
+    keys = list(layer.keys)
+    if merge_key not in keys:
+        return lambda feature: None
+    key_idx = keys.index(merge_key)
+    values  = [tile_value(value) for value in layer.values]
+    def group(feature):
+        for key, val in zip(feature.tags[::2], feature.tags[1::2]):
+            if key == key_idx:
+                return (layer.name, values[val])
+        return None
+    return group
+
+
+# state of the tile parsing worker processes
+_parser = {}
+
+def _init_parser(filters, merge_key=None):
+    _parser['filters']   = _compile_filters(filters)
+    _parser['merge_key'] = merge_key
+
+
+# parse task (configuration, tile data), the worker is (re-)initialized with the
+# pickled filters and merge key of the configuration if it differs from the one
+# of its previous task; returns the parse duration (recorded by the parent, as
+# telemetry is per process) and the filtered features
+def _parse_tile(task):
+    config, data = task
+    if _parser.get('config') != config:
+        _init_parser(*pickle.loads(config))
+        _parser['config'] = config
+    t_start = time.perf_counter()
+    tile = vector_tile_pb2.Tile()
+    tile.ParseFromString(data)
+    return time.perf_counter() - t_start, [
+        (feature.type, extent, np.array(feature.geometry, np.int64), group)
+        for feature, extent, group in _filter_features(
+            tile, _parser['filters'], _parser['merge_key']
+        )
+    ]
+
+
+# decode the geometry of a vector tile feature into a list of lines (arrays of
+# tile coordinates), each starting with a MoveTo command; only the command
+# integers are processed one by one, the parameters are decoded as a whole
+def decode_geometry(geometry):
+    if not isinstance(geometry, np.ndarray):
+        geometry = np.fromiter(geometry, np.int64, len(geometry))
+    params   = np.zeros(len(geometry), bool)
+    starts   = []
+    pos, cnt = 0, 0
+    while pos < len(geometry):
+        op, num = geometry[pos] & 0x7, int(geometry[pos] >> 3)
+        pos += 1
+        if op == 7:
+            continue
+        if op not in [1, 2]:
+            raise ValueError("invalid geometry command")
+        if op == 1:
+            starts += range(cnt, cnt + num)
+        params[pos:pos+2*num] = True
+        pos += 2 * num
+        cnt += num
+    # zigzag decoding of the parameters and accumulation of the deltas
+    vals   = geometry[params]
+    deltas = ((vals >> 1) ^ -(vals & 1)).reshape(-1, 2)
+    coords = np.cumsum(deltas, axis=0)
+    return np.split(coords, starts[1:]) if len(starts) > 0 else []
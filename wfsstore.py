@@ -0,0 +1,113 @@
+import collections
+import sqlite3
+import threading
+import hashlib
+import json
+import time
+
+from geojson import FeatureStream
+
+# ids of the features added, removed and changed by a refresh of a snapshot
+SnapshotChanges = collections.namedtuple(
+    'SnapshotChanges', ['added', 'removed', 'changed']
+)
+
+
+# content hashes of the features of a GeoJSON feature collection by feature id;
+# the hash is computed from the canonical JSON encoding (sorted keys, no
+# whitespace) of a feature, i.e., it does not depend on the formatting of the
+# response
+def feature_hashes(data):
+    hashes = {}
+    for raw in FeatureStream().feed(data):
+        feature = json.loads(raw)
+        hashes[feature['id']] = hashlib.sha256(json.dumps(
+            feature, sort_keys=True, separators=(',', ':')
+        ).encode()).hexdigest()
+    return hashes
+
+
+# persistent store of WFS responses (GeoJSON feature collections) in a SQLite
+# database; a snapshot is the raw response for a feature type name and time
+# window (e.g., a UTC day) along with the content hashes of its features, such
+# that a refresh reports which features were added, removed or changed w.r.t.
+# the stored snapshot of the time window (or the latest snapshot of the type
+# name if there is none yet)
+class SnapshotStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db   = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'typename TEXT, time_window TEXT, data BLOB, fetched REAL, '
+                'PRIMARY KEY (typename, time_window))'
+            )
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS features ('
+                'typename TEXT, time_window TEXT, feature_id TEXT, hash TEXT, '
+                'PRIMARY KEY (typename, time_window, feature_id))'
+            )
+
+
+    # raw response of a snapshot (None if there is none)
+    def get(self, typename, window):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT data FROM snapshots WHERE typename=? AND time_window=?',
+                (typename, window)
+            ).fetchone()
+        return None if row is None else row[0]
+
+
+    # content hashes of the features of a snapshot by feature id
+    def hashes(self, typename, window):
+        with self.lock:
+            return dict(self.db.execute(
+                'SELECT feature_id, hash FROM features '
+                'WHERE typename=? AND time_window=?', (typename, window)
+            ))
+
+
+    # time window of the most recently fetched snapshot of a type name
+    def latest(self, typename):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT time_window FROM snapshots WHERE typename=? '
+                'ORDER BY fetched DESC LIMIT 1', (typename,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+
+    # store a (new) response as snapshot of the time window, returns the changes
+    # of the features w.r.t. the previous snapshot
+    def update(self, typename, window, data):
+        hashes = feature_hashes(data)
+        base   = window if self.get(typename, window) is not None else (
+            self.latest(typename)
+        )
+        old_hashes = {} if base is None else self.hashes(typename, base)
+        changes = SnapshotChanges(
+            sorted(set(hashes) - set(old_hashes)),
+            sorted(set(old_hashes) - set(hashes)),
+            sorted(
+                feature_id for feature_id, feature_hash in hashes.items()
+                if old_hashes.get(feature_id, feature_hash) != feature_hash
+            )
+        )
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+                (typename, window, bytes(data), time.time())
+            )
+            self.db.execute(
+                'DELETE FROM features WHERE typename=? AND time_window=?',
+                (typename, window)
+            )
+            self.db.executemany(
+                'INSERT INTO features VALUES (?, ?, ?, ?)', [
+                    (typename, window, feature_id, feature_hash)
+                    for feature_id, feature_hash in hashes.items()
+                ]
+            )
+        return changes